@@ -15,7 +15,7 @@
 import os.path
 import datetime
 
-__version__ = (0, 1, 2, 2)
+__version__ = (0, 1, 2, 3)
 
 DEFAULT_ENCODING = 'utf-8'
 
@@ -25,6 +25,23 @@ LOG_MODE = True
 # Консольный режим работы
 NO_GUI_MODE = False
 
+# Потоковый режим генерации отчетов.
+# Строки отчета записываются в файл по мере генерации
+# и не накапливаются в памяти
+STREAM_MODE = False
+
+# Пакетный подсчет итогов SUM/AVG по колонкам таблицы запроса
+# при выводе итоговых ячеек вместо суммирования на каждой записи
+BULK_SUM_MODE = False
+
+# Сортировка записей таблицы запроса по полям групп перед генерацией отчета
+SORT_GROUPS_MODE = False
+
+# Количество записей SQL запроса, читаемых из БД за один раз.
+# Записи читаются по мере генерации отчета.
+# 0 - все записи загружаются в память до начала генерации
+QUERY_CHUNK_SIZE = 1000
+
 # Имя папки профиля программы
 PROFILE_DIRNAME = '.icreport'
 # Путь до папки профиля
@@ -35,6 +52,15 @@ PROFILE_PATH = os.path.join(os.environ.get('HOME', os.path.dirname(__file__)),
 LOG_FILENAME = os.path.join(PROFILE_PATH,
                             'icreport_%s.log' % datetime.date.today().isoformat())
 
+# Папка кеша скомпилированных шаблонов отчетов и ресурсных файлов.
+# Ключ кеша - хеш содержимого исходного файла, поэтому кеш
+# может разделяться несколькими процессами.
+# None - кеш не используется
+CACHE_PATH = os.path.join(PROFILE_PATH, 'cache')
+# Максимальный размер кеша в байтах.
+# При превышении удаляются давно не используемые файлы
+CACHE_MAX_SIZE = 256 * 1024 * 1024
+
 
 def get_glob_var(name):
     """
@@ -7,6 +7,11 @@
 
 import os
 import os.path
+import sys
+import copy
+import time
+import traceback
+import concurrent.futures
 import wx
 
 # Подключение библиотек
@@ -14,13 +19,16 @@ from ic.std.log import log
 from ic.std.utils import resfunc
 from ic.std.utils import textfunc
 from ic.std.utils import filefunc
+from ic.std.utils import inifunc
 
 from ic.report import icreportbrowser
 from ic.report import report_generator
 from ic.report import icstylelib
 
+from ic import config
 
-__version__ = (0, 1, 1, 2)
+
+__version__ = (0, 1, 1, 3)
 
 DEFAULT_REPORT_FILE_EXT = '.rprt'
 
@@ -399,5 +407,170 @@ def doReport(parent_form=None, report_filename='', report_dir='', db_url='', sql
         log.fatal(u'Ошибка запуска генератора отчета <%s>' % report_filename)
 
 
+def loadBatchManifest(manifest_filename, report_dir='', output_dir=None):
+    """
+    Загрузить описание заданий пакетной генерации отчетов.
+    Манифест представляет собой INI файл. Каждая секция - задание:
+
+        [имя задания]
+        report = имя файла отчета
+        db = Connection string в виде url (не обязательно)
+        sql = Запрос SQL (не обязательно)
+        stylelib = Файл библиотеки стилей (не обязательно)
+        variables = {'имя переменной': значение} (не обязательно)
+        output = Имя результирующего файла (не обязательно)
+
+    ВНИМАНИЕ! Символ % в значениях необходимо удваивать (%%).
+    Пакетно генерируются только отчеты ODS и XLS. Задания отчетов
+    других типов (RTF, XML) отбрасываются, т.к. эти системы генерации
+    не сохраняют отчет в указанный файл.
+    Расширение результирующего файла определяется типом отчета.
+
+    :param manifest_filename: Имя файла манифеста.
+    :param report_dir: Директорий, где хранятся отчеты.
+    :param output_dir: Папка результирующих файлов.
+        Если не указана, то используется папка манифеста.
+    :return: Список кортежей (имя задания, словарь задания) в порядке
+        следования в манифесте или None в случае ошибки.
+    """
+    manifest = inifunc.INI2Dict(manifest_filename)
+    if manifest is None:
+        return None
+
+    if output_dir is None:
+        output_dir = os.path.dirname(os.path.abspath(manifest_filename))
+
+    jobs = list()
+    for job_name, params in manifest.items():
+        if not params.get('report'):
+            log.warning(u'Не определен отчет в задании <%s> пакетной генерации' % job_name)
+            continue
+        job = dict(report=getReportResourceFilename(str(params['report']), report_dir),
+                   db=str(params['db']) if params.get('db') else None,
+                   sql=str(params['sql']) if params.get('sql') else None,
+                   stylelib=str(params['stylelib']) if params.get('stylelib') else None,
+                   variables=params.get('variables', None) or None)
+        # Отсутствующий шаблон отмечается ошибкой при выполнении задания
+        result_ext = ''
+        if job['report']:
+            report = resfunc.loadResourceFile(job['report'])
+            generator = report.get('generator', None) if report else None
+            result_ext = report_generator.getReportResultExt(generator)
+            if not result_ext:
+                log.warning(u'Тип отчета <%s> не поддерживается пакетной генерацией. Задание <%s> отброшено' % (generator,
+                                                                                                             job_name))
+                continue
+        # Имя результирующего файла определяется именем задания
+        job['output'] = str(params['output']) if params.get('output') else os.path.join(output_dir,
+                                                                                         job_name + result_ext)
+        jobs.append((job_name, job))
+    return jobs
+
+
+def _initBatchWorker(report_dir=''):
+    """
+    Инициализация процесса пакетной генерации отчетов.
+
+    :param report_dir: Директорий, где хранятся отчеты.
+    """
+    config.set_glob_var('NO_GUI_MODE', True)
+    # Путь к папке отчетов, чтобы проходили импорты модулей отчетов
+    if report_dir and os.path.isdir(report_dir) and report_dir not in sys.path:
+        sys.path.append(report_dir)
+
+
+def _doBatchJob(job_name, job):
+    """
+    Выполнить задание пакетной генерации отчета.
+    Шаблон отчета загружается один раз в процессе (буфер resfunc)
+    и копируется для каждого задания.
+
+    :param job_name: Имя задания.
+    :param job: Словарь задания (см. loadBatchManifest).
+    :return: Словарь результата задания:
+        {'name': имя задания, 'filename': имя результирующего файла,
+         'time': время выполнения в секундах, 'error': текст ошибки или None}.
+    """
+    time_start = time.time()
+    result = dict(name=job_name, filename=None, time=0.0, error=None)
+    try:
+        if not job['report']:
+            result['error'] = u'Не найден шаблон отчета'
+        else:
+            report = copy.deepcopy(resfunc.loadResourceFile(job['report']))
+            repgen_system = report_generator.createReportGeneratorSystem(report['generator'], report)
+            repgen_system.RepTmplFileName = job['report']
+            stylelib = loadStyleLib(job['stylelib'])
+
+            data = repgen_system.generate(report, job['db'], job['sql'],
+                                          stylelib=stylelib, vars=job['variables'])
+            if data is None:
+                result['error'] = u'Ошибка генерации отчета <%s>' % job['report']
+            else:
+                result['filename'] = repgen_system.save(data, to_filename=job['output'])
+                if not result['filename']:
+                    result['error'] = u'Ошибка сохранения отчета <%s>' % job['report']
+    except:
+        log.fatal(u'Ошибка выполнения задания <%s> пакетной генерации' % job_name)
+        result['error'] = traceback.format_exc()
+    result['time'] = time.time() - time_start
+    return result
+
+
+def doReportBatch(manifest_filename, report_dir='', output_dir=None, max_workers=None):
+    """
+    Пакетная генерация отчетов.
+    Задания распределяются по пулу процессов.
+
+    :param manifest_filename: Имя файла манифеста (см. loadBatchManifest).
+    :param report_dir: Директорий, где хранятся отчеты.
+    :param output_dir: Папка результирующих файлов.
+        Если не указана, то используется папка манифеста.
+    :param max_workers: Количество процессов генерации.
+        Если не указано, то по количеству процессоров.
+    :return: Список словарей результатов заданий в порядке манифеста
+        или None в случае ошибки.
+    """
+    try:
+        jobs = loadBatchManifest(manifest_filename, report_dir, output_dir)
+        if jobs is None:
+            return None
+
+        time_start = time.time()
+        log.info(u'Пакетная генерация отчетов <%s>. Заданий: %d' % (manifest_filename, len(jobs)))
+        for job_name, job in jobs:
+            job_dir = os.path.dirname(os.path.abspath(job['output']))
+            if not os.path.exists(job_dir):
+                os.makedirs(job_dir)
+
+        results = list()
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers,
+                                                    initializer=_initBatchWorker,
+                                                    initargs=(report_dir,)) as executor:
+            futures = [executor.submit(_doBatchJob, job_name, job) for job_name, job in jobs]
+            for i, future in enumerate(futures):
+                try:
+                    result = future.result()
+                except:
+                    # Процесс генерации завершился аварийно
+                    result = dict(name=jobs[i][0], filename=None, time=0.0, error=traceback.format_exc())
+                results.append(result)
+
+                if result['error']:
+                    log.error(u'Задание <%s>. Ошибка: %s' % (result['name'], result['error']))
+                else:
+                    log.info(u'Задание <%s>. Файл <%s>. Время: %.2f сек.' % (result['name'], result['filename'],
+                                                                            result['time']))
+
+        errors = [result for result in results if result['error']]
+        log.info(u'Пакетная генерация отчетов завершена. Выполнено: %d. Ошибок: %d. Время: %.2f сек.' % (len(results) - len(errors),
+                                                                                                        len(errors),
+                                                                                                        time.time() - time_start))
+        return results
+    except:
+        log.fatal(u'Ошибка пакетной генерации отчетов <%s>' % manifest_filename)
+    return None
+
+
 if __name__ == '__main__':
     doReport()
@@ -0,0 +1,495 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Модуль файла отчета в формате ODS.
+    Заполненный генератором отчет записывается непосредственно
+    в ODS файл (content.xml/styles.xml внутри zip архива)
+    без промежуточного XMLSS файла и загрузки его в Virtual Excel.
+"""
+
+# Подключение библиотек
+import shutil
+import tempfile
+import zipfile
+from xml.sax import saxutils
+
+from ic.std.log import log
+from ic.std.utils import textfunc
+
+from ic.report import icrepgen
+from ic.report import icrepfile
+
+__version__ = (0, 1, 1, 1)
+
+ODS_MIMETYPE = 'application/vnd.oasis.opendocument.spreadsheet'
+
+# Пространства имен документа
+ODS_NAMESPACES = ' '.join(['xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0"',
+                           'xmlns:style="urn:oasis:names:tc:opendocument:xmlns:style:1.0"',
+                           'xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0"',
+                           'xmlns:table="urn:oasis:names:tc:opendocument:xmlns:table:1.0"',
+                           'xmlns:fo="urn:oasis:names:tc:opendocument:xmlns:xsl-fo-compatible:1.0"',
+                           'xmlns:number="urn:oasis:names:tc:opendocument:xmlns:datastyle:1.0"',
+                           'xmlns:meta="urn:oasis:names:tc:opendocument:xmlns:meta:1.0"',
+                           'office:version="1.2"'])
+
+XML_HEADER = '<?xml version="1.0" encoding="utf-8"?>\n'
+
+# Имя мастер-страницы, используемой листами по умолчанию
+DEFAULT_MASTER_PAGE = 'Default'
+
+INCH2CM = 2.54
+
+# Коэффициент перевода размеров отчета (в точках) в сотые доли мм.
+# Совпадает с коэффициентом Virtual Excel (icods.DIMENSION_CORRECT)
+DIMENSION_CORRECT = 35
+
+# Поля страницы по умолчанию (в дюймах)
+DEFAULT_MARGIN = 0.787401575
+
+# Ширина колонки по умолчанию, если ячейка не определена
+DEFAULT_COLUMN_WIDTH = 8.43
+
+# Размеры листов по индексу Excel (в см)
+PAPER_SIZES = {9: (21.0, 29.7),     # A4
+               8: (42.0, 29.7),     # A3
+               }
+
+# Преобразование выравнивания из нашего представления в ODS
+ALIGN_REP2ODS = {icrepgen.IC_HORIZ_ALIGN_LEFT: 'start',
+                 icrepgen.IC_HORIZ_ALIGN_CENTRE: 'center',
+                 icrepgen.IC_HORIZ_ALIGN_RIGHT: 'end',
+                 icrepgen.IC_VERT_ALIGN_TOP: 'top',
+                 icrepgen.IC_VERT_ALIGN_CENTRE: 'middle',
+                 icrepgen.IC_VERT_ALIGN_BOTTOM: 'bottom',
+                 }
+
+# Преобразование стилей линий обрамления
+LINE_REP2ODS = {icrepgen.IC_REP_LINE_SOLID: 'solid',
+                icrepgen.IC_REP_LINE_SHORT_DASH: 'dashed',
+                icrepgen.IC_REP_LINE_DOT_DASH: 'dotted',
+                icrepgen.IC_REP_LINE_DOT: 'dotted',
+                }
+
+# Позиции линий обрамления
+BORDER_REP2ODS = ((icrepgen.IC_REP_BORDER_LEFT, 'fo:border-left'),
+                  (icrepgen.IC_REP_BORDER_TOP, 'fo:border-top'),
+                  (icrepgen.IC_REP_BORDER_BOTTOM, 'fo:border-bottom'),
+                  (icrepgen.IC_REP_BORDER_RIGHT, 'fo:border-right'),
+                  )
+
+
+def _attrs(**attrs):
+    """
+    Строковое представление атрибутов тега.
+    Атрибуты со значением None пропускаются.
+    Символ '_' в имени атрибута заменяется на ':', '__' на '-'.
+    """
+    return ''.join([' %s=%s' % (name.replace('__', '-').replace('_', ':', 1), saxutils.quoteattr(str(value)))
+                    for name, value in attrs.items() if value is not None])
+
+
+class icODSReportFile(icrepfile.icReportFile):
+    """
+    Файл *.ODS отчета.
+    Может использоваться как приемник строк потоковой генерации
+    (см. icReportGenerator.generate(..., sink=...)).
+    Строки таблицы записываются во временный файл по мере поступления,
+    а стили, ширины колонок и объединения ячеек отслеживаются
+    инкрементально.
+    """
+
+    def __init__(self):
+        """
+        Конструктор.
+        """
+        icrepfile.icReportFile.__init__(self)
+
+        # Временный файл строк таблицы
+        self._body_file = tempfile.TemporaryFile(mode='w+t', encoding='utf-8')
+
+        # Стили ячеек {Ключ стиля: Имя стиля} и описания стилей в порядке создания
+        self._cell_styles = dict()
+        self._cell_style_list = list()
+        # Стили числовых форматов {Формат: Имя стиля}
+        self._number_styles = dict()
+        # Стили строк {Высота: Имя стиля}
+        self._row_styles = dict()
+
+        # Количество колонок и ширины колонок по первой самой длинной строке
+        self._col_count = 0
+        self._col_widths = list()
+
+        # Ячейки последующих строк, попадающие в зону объединения
+        # Словарь {(Номер строки, Номер колонки): True}
+        self._merge_hidden = dict()
+
+        # Количество записанных строк
+        self._row_count = 0
+
+    def write(self, rep_filename, rec_data):
+        """
+        Сохранить заполненный отчет в файле.
+
+        :param rep_filename: Имя файла отчета ODS.
+        :param rec_data: Данные отчета.
+            В потоковом режиме строки листа уже записаны и лист пуст.
+        :return: Функция возвращает имя созданного ods файла,
+            или None в случае ошибки.
+        """
+        for row in rec_data['sheet']:
+            self.writeRow(self._row_count, row)
+        return self.close(rep_filename, rec_data)
+
+    def _getStyleName(self, cell):
+        """
+        Имя стиля ячейки. Если такой стиль еще не зарегистрирован,
+        то он регистрируется.
+        """
+        style_key = icrepfile.getStyleKey(cell)
+        style_name = self._cell_styles.get(style_key, None)
+        if style_name is None:
+            style_name = 'x%d' % len(self._cell_style_list)
+            self._cell_styles[style_key] = style_name
+            self._cell_style_list.append((style_name, dict(align=cell['align'], font=cell['font'],
+                                                           border=cell['border'], format=cell['format'],
+                                                           color=cell['color'])))
+        return style_name
+
+    def getStyleCount(self):
+        """
+        Количество различных стилей ячеек.
+        Используется для диагностики.
+        """
+        return len(self._cell_style_list)
+
+    def _getRowStyleName(self, row):
+        """
+        Имя стиля высоты строки.
+        """
+        heights = [cell['height'] for cell in row if cell is not None and 'height' in cell]
+        if not heights:
+            return None
+        height = min(heights)
+        style_name = self._row_styles.get(height, None)
+        if style_name is None:
+            style_name = 'ro%d' % (len(self._row_styles) + 1)
+            self._row_styles[height] = style_name
+        return style_name
+
+    def writeRow(self, i_row, row):
+        """
+        Записать строку отчета.
+
+        :param i_row: Номер строки отчета (начиная с 0).
+        :param row: Список ячеек строки.
+        """
+        if len(row) > self._col_count:
+            self._col_count = len(row)
+            self._col_widths = [cell['width'] if cell else DEFAULT_COLUMN_WIDTH for cell in row]
+
+        out = ['<table:table-row%s>' % _attrs(table_style__name=self._getRowStyleName(row))]
+        # Текущий номер колонки ODS таблицы (начиная с 1)
+        i = 1
+        prev_style_name = None
+        # Ячейки текущей строки, попадающие в горизонтальную зону объединения
+        across_hidden = set()
+        for i_col, cell in enumerate(row):
+            if cell is None:
+                continue
+            # Ячейка попадает в зону объединения
+            if self._merge_hidden.pop((i_row, i_col), False) or i_col in across_hidden:
+                if not cell['value']:
+                    continue
+
+            column = i_col + 1
+            if column > i:
+                out.append(self._coveredCell(column - i, prev_style_name))
+                i = column + 1
+            else:
+                i += 1
+
+            style_name = self._getStyleName(cell)
+            merge_across = cell['merge_col'] - 1 if cell['merge_col'] > 1 else 0
+            merge_down = cell['merge_row'] - 1 if cell['merge_row'] > 1 else 0
+            out.append(self._cell(cell, style_name, merge_across, merge_down))
+            if merge_across:
+                out.append(self._coveredCell(merge_across, prev_style_name))
+                i += merge_across
+            prev_style_name = style_name
+
+            # Запомнить ячейки, попадающие в зону объединения
+            for x in range(1, merge_across + 1):
+                across_hidden.add(i_col + x)
+            for y in range(1, merge_down + 1):
+                for x in range(merge_across + 1):
+                    self._merge_hidden[(i_row + y, i_col + x)] = True
+
+        out.append('</table:table-row>\n')
+        self._body_file.write(''.join(out))
+        self._row_count = i_row + 1
+
+    def _coveredCell(self, repeated, style_name=None):
+        """
+        Тег перекрытой ячейки.
+        """
+        return '<table:covered-table-cell%s/>' % _attrs(table_number__columns__repeated=repeated,
+                                                          table_style__name=style_name)
+
+    def _cell(self, cell, style_name, merge_across=0, merge_down=0):
+        """
+        Тег ячейки.
+        """
+        value = cell['value']
+        value_type = 'string'
+        number_value = None
+        if value is not None:
+            value = str(value)
+            try:
+                float(value)
+                value_type = 'float'
+                number_value = value.strip()
+            except ValueError:
+                pass
+
+        attrs = _attrs(table_style__name=style_name,
+                       office_value__type=value_type,
+                       office_value=number_value,
+                       table_number__columns__spanned=merge_across + 1 if merge_across else None,
+                       table_number__rows__spanned=merge_down + 1 if merge_down else None)
+        if not value:
+            return '<table:table-cell%s/>' % attrs
+        # Разбить на строки
+        text = ''.join(['<text:p>%s</text:p>' % saxutils.escape(line) for line in value.split('\n') if line])
+        return '<table:table-cell%s>%s</table:table-cell>' % (attrs, text)
+
+    def close(self, rep_filename, report):
+        """
+        Закончить запись и сохранить отчет в файле.
+
+        :param rep_filename: Имя файла отчета ODS.
+        :param report: Данные отчета (без строк листа).
+        :return: Функция возвращает имя созданного ods файла,
+            или None в случае ошибки.
+        """
+        try:
+            with zipfile.ZipFile(rep_filename, 'w', zipfile.ZIP_DEFLATED) as ods_file:
+                # ВНИМАНИЕ! mimetype должен быть первым и не сжатым
+                ods_file.writestr(zipfile.ZipInfo('mimetype'), ODS_MIMETYPE, compress_type=zipfile.ZIP_STORED)
+                ods_file.writestr('META-INF/manifest.xml', self._getManifestXML())
+                ods_file.writestr('meta.xml', self._getMetaXML())
+                ods_file.writestr('styles.xml', self._getStylesXML(report))
+                with ods_file.open('content.xml', 'w', force_zip64=True) as content_file:
+                    self._writeContentXML(content_file, report)
+            self._body_file.close()
+            return rep_filename
+        except:
+            self._body_file.close()
+            log.error(u'Ошибка сохранения отчета <%s>.' % textfunc.toUnicode(rep_filename))
+            raise
+        return None
+
+    def _getManifestXML(self):
+        """
+        Содержимое META-INF/manifest.xml.
+        """
+        entries = [('/', ODS_MIMETYPE), ('content.xml', 'text/xml'),
+                   ('styles.xml', 'text/xml'), ('meta.xml', 'text/xml')]
+        return XML_HEADER + \
+            '<manifest:manifest xmlns:manifest="urn:oasis:names:tc:opendocument:xmlns:manifest:1.0" manifest:version="1.2">' + \
+            ''.join(['<manifest:file-entry%s/>' % _attrs(manifest_full__path=path, manifest_media__type=media_type)
+                     for path, media_type in entries]) + \
+            '</manifest:manifest>'
+
+    def _getMetaXML(self):
+        """
+        Содержимое meta.xml.
+        """
+        return XML_HEADER + \
+            '<office:document-meta %s><office:meta><meta:generator>icReport</meta:generator></office:meta></office:document-meta>' % ODS_NAMESPACES
+
+    def _getStylesXML(self, report):
+        """
+        Содержимое styles.xml. Параметры страницы.
+
+        :param report: Данные отчета.
+        """
+        properties = dict(style_writing__mode='lr-tb')
+        page_setup = report.get('page_setup', None)
+        if page_setup:
+            orientation = page_setup.get('orientation', None)
+            if orientation is not None:
+                orientation = 'landscape' if str(orientation) == str(icrepgen.IC_REP_ORIENTATION_LANDSCAPE) else 'portrait'
+                properties['style_print__orientation'] = orientation
+            margins = page_setup.get('page_margins', None)
+            if not margins:
+                margins = (DEFAULT_MARGIN, DEFAULT_MARGIN, DEFAULT_MARGIN, DEFAULT_MARGIN)
+            for name, margin in zip(('fo_margin__left', 'fo_margin__right', 'fo_margin__top', 'fo_margin__bottom'),
+                                    margins):
+                properties[name] = '%scm' % (float(margin) * INCH2CM)
+
+            paper_size = page_setup.get('paper_size', None)
+            if paper_size is not None:
+                width, height = PAPER_SIZES.get(int(paper_size), PAPER_SIZES[9])
+                if orientation == 'landscape':
+                    width, height = height, width
+                properties['fo_page__width'] = '%scm' % width
+                properties['fo_page__height'] = '%scm' % height
+        else:
+            log.warning(u'Параметры страницы не определены')
+
+        return XML_HEADER + \
+            '<office:document-styles %s>' % ODS_NAMESPACES + \
+            '<office:automatic-styles><style:page-layout style:name="pm1"><style:page-layout-properties%s/>' % _attrs(**properties) + \
+            '</style:page-layout></office:automatic-styles>' + \
+            '<office:master-styles><style:master-page%s/></office:master-styles>' % _attrs(style_name=DEFAULT_MASTER_PAGE,
+                                                                                         style_page__layout__name='pm1') + \
+            '</office:document-styles>'
+
+    def _writeContentXML(self, content_file, report):
+        """
+        Записать content.xml.
+
+        :param content_file: Бинарный файловый объект content.xml в архиве.
+        :param report: Данные отчета.
+        """
+        head = [XML_HEADER, '<office:document-content %s><office:automatic-styles>' % ODS_NAMESPACES]
+
+        # Стили колонок
+        col_styles = dict()
+        for width in self._col_widths:
+            if width is not None and width not in col_styles:
+                col_styles[width] = 'co%d' % (len(col_styles) + 1)
+                head.append('<style:style%s><style:table-column-properties%s/></style:style>' %
+                            (_attrs(style_name=col_styles[width], style_family='table-column'),
+                             _attrs(style_column__width=self._dimension_rep2ods(width), fo_break__before='auto')))
+        # Стили строк
+        for height, style_name in self._row_styles.items():
+            head.append('<style:style%s><style:table-row-properties%s/></style:style>' %
+                        (_attrs(style_name=style_name, style_family='table-row'),
+                         _attrs(style_row__height=self._dimension_rep2ods(height), fo_break__before='auto')))
+        # Стили ячеек
+        for style_name, style in self._cell_style_list:
+            head.append(self._getCellStyleXML(style_name, style))
+        head.append('</office:automatic-styles><office:body><office:spreadsheet>')
+
+        head.append('<table:table%s>' % _attrs(table_name=report['name']))
+        for width in self._col_widths:
+            head.append('<table:table-column%s/>' % _attrs(table_style__name=col_styles.get(width, None)))
+        content_file.write(''.join(head).encode('utf-8'))
+
+        # Строки
+        self._body_file.seek(0)
+        while True:
+            block = self._body_file.read(shutil.COPY_BUFSIZE)
+            if not block:
+                break
+            content_file.write(block.encode('utf-8'))
+
+        content_file.write('</table:table></office:spreadsheet></office:body></office:document-content>'.encode('utf-8'))
+
+    def _dimension_rep2ods(self, dimension):
+        """
+        Перевод размеров из представления отчета в ODS (в мм).
+
+        :param dimension: Размер в точках.
+        """
+        return '%smm' % (float(dimension) * DIMENSION_CORRECT / 100.0)
+
+    def _getNumberStyleXML(self, fmt):
+        """
+        Определить стиль числового формата.
+
+        :param fmt: Формат ячейки.
+        :return: Кортеж (Имя стиля, Описание стиля в xml) или (None, '').
+        """
+        if not fmt:
+            return None, ''
+        if fmt in self._number_styles:
+            return self._number_styles[fmt], ''
+
+        num_fmt = self._getNumFmt(fmt)
+        style_name = 'N%d' % (len(self._number_styles) + 1)
+        self._number_styles[fmt] = style_name
+
+        # Не анализировать знак %
+        digits = num_fmt.replace('%', '')
+        decimal_places = len(digits[digits.find(',')+1:]) if digits.find(',') >= 0 else 0
+        int_digits = digits[:digits.find(',')] if digits.find(',') >= 0 else digits
+        number = '<number:number%s/>' % _attrs(number_decimal__places=decimal_places,
+                                               number_min__integer__digits=int_digits.count('0'),
+                                               number_grouping='true' if ' ' in digits else 'false')
+        if '%' in num_fmt:
+            return style_name, '<number:percentage-style style:name="%s">%s<number:text>%%</number:text></number:percentage-style>' % (style_name, number)
+        return style_name, '<number:number-style style:name="%s">%s</number:number-style>' % (style_name, number)
+
+    def _getNumFmt(self, fmt):
+        """
+        Формат чисел.
+        """
+        if fmt[0] == icrepgen.REP_FMT_EXCEL:
+            return fmt[1:]
+        elif fmt[0] == icrepgen.REP_FMT_STR:
+            return '@'
+        elif fmt[0] == icrepgen.REP_FMT_NUM:
+            return '0'
+        elif fmt[0] == icrepgen.REP_FMT_FLOAT:
+            return '0.'
+        return '0'
+
+    def _getRGBColor(self, color):
+        """
+        Преобразование цвета из (R,G,B) в #RRGGBB.
+        """
+        if type(color) in (list, tuple):
+            return '#%02X%02X%02X' % (color[0], color[1], color[2])
+        return color
+
+    def _getCellStyleXML(self, style_name, style):
+        """
+        Описание стиля ячейки в xml.
+
+        :param style_name: Имя стиля.
+        :param style: Словарь атрибутов стиля.
+        """
+        number_style_name, number_style = self._getNumberStyleXML(style['format'])
+
+        # Шрифт
+        font = style['font'] or dict()
+        font_style = font.get('style', None)
+        text_properties = dict(fo_font__family=font.get('name', None),
+                               fo_font__size='%dpt' % int(font['size']) if font.get('size', None) else None,
+                               fo_font__weight='bold' if font_style in ('bold', 'boldItalic') else None,
+                               fo_font__style='italic' if font_style in ('italic', 'boldItalic') else None)
+        color = style['color'] or dict()
+        if color.get('text', None):
+            text_properties['fo_color'] = self._getRGBColor(color['text'])
+
+        # Обрамление, выравнивание и заливка
+        cell_properties = dict()
+        border = style['border'] or (None, None, None, None)
+        for position, attr_name in BORDER_REP2ODS:
+            line = border[position]
+            if line:
+                line_color = self._getRGBColor(line.get('color', None) or (0, 0, 0))
+                cell_properties[attr_name.replace(':', '_').replace('-', '__')] = '%spt %s %s' % (line.get('weight', 1),
+                                                                                                  LINE_REP2ODS.get(line.get('style', None), 'solid'),
+                                                                                                  line_color)
+        align = style['align'] or dict()
+        align_txt = align.get('align_txt', (None, None))
+        cell_properties['style_vertical__align'] = ALIGN_REP2ODS.get(align_txt[icrepgen.IC_REP_ALIGN_VERT], None)
+        if align.get('wrap_txt', False):
+            cell_properties['fo_wrap__option'] = 'wrap'
+        if color.get('background', None):
+            cell_properties['fo_background__color'] = self._getRGBColor(color['background'])
+
+        paragraph_properties = dict(fo_text__align=ALIGN_REP2ODS.get(align_txt[icrepgen.IC_REP_ALIGN_HORIZ], None))
+
+        return number_style + \
+            '<style:style%s>' % _attrs(style_name=style_name, style_family='table-cell',
+                                       style_data__style__name=number_style_name) + \
+            '<style:table-cell-properties%s/>' % _attrs(**cell_properties) + \
+            '<style:paragraph-properties%s/>' % _attrs(**paragraph_properties) + \
+            '<style:text-properties%s/>' % _attrs(**text_properties) + \
+            '</style:style>'
@@ -15,11 +15,10 @@ from ic.std.log import log
 from ic.std.dlg import dlg
 from ic.std.utils import textfunc
 
-from ic.virtual_excel import icexcel
-
 from ic.report import icrepgensystem
 from ic.report import icrepgen
 from ic.report import icrepfile
+from ic.report import icodsrepfile
 
 from ic import config
 
@@ -73,17 +72,36 @@ class icODSReportGeneratorSystem(icrepgensystem.icReportGeneratorSystem):
                                 
         return self._report_dir
 
-    def _genODSReport(self, report, *args, **kwargs):
+    def createSink(self, is_virtual_excel=True):
+        """
+        Приемник строк отчета для потоковой генерации.
+
+        :param is_virtual_excel: Сохранение произвести без внешних конверторов?
+            True - ODS файл записывается непосредственно,
+            False - записывается XML файл для конвертации с помощью UNOCONV.
+        :return: Объект приемника строк или None, если потоковый режим отключен.
+        """
+        if not config.get_glob_var('STREAM_MODE'):
+            return None
+        if is_virtual_excel:
+            return icodsrepfile.icODSReportFile()
+        return icrepfile.icExcelXMLReportStream()
+
+    def _genODSReport(self, report, *args, is_virtual_excel=True, **kwargs):
         """
         Генерация отчета и сохранение его в ODS файл.
 
         :param report: Полное описание шаблона отчета.
+        :param is_virtual_excel: Сохранение произвести без внешних конверторов?
         :return: Возвращает имя xml файла или None в случае ошибки.
         """
         if report is None:
             report = self._Rep
-        data_rep = self.generateReport(report, *args, **kwargs)
-        return self.save(data_rep)
+        # В потоковом режиме строки отчета записываются в файл
+        # по мере генерации
+        sink = self.createSink(is_virtual_excel)
+        data_rep = self.generateReport(report, *args, sink=sink, **kwargs)
+        return self.save(data_rep, is_virtual_excel=is_virtual_excel, sink=sink)
 
     def selectAction(self, report=None, *args, **kwargs):
         """
@@ -217,13 +235,16 @@ class icODSReportGeneratorSystem(icrepgensystem.icReportGeneratorSystem):
         # и запустить
         os.system(cmd)
 
-    def generateReport(self, report=None, *args, **kwargs):
+    def generateReport(self, report=None, *args, sink=None, **kwargs):
         """
         Запустить генератор отчета.
 
         :param report: Шаблон отчета.
+        :param sink: Приемник строк отчета для потоковой генерации
+            (см. createSink).
         :return: Возвращает сгенерированный отчет или None в случае ошибки.
         """
+        query_tbl = None
         try:
             if report is not None:
                 self._Rep = report
@@ -248,12 +269,15 @@ class icODSReportGeneratorSystem(icrepgensystem.icReportGeneratorSystem):
             rep = icrepgen.icReportGenerator()
             coord_fill = kwargs.get('coord_fill', None)
             data_rep = rep.generate(self._Rep, query_tbl,
-                                    name_space=variables, coord_fill=coord_fill)
+                                    name_space=variables, coord_fill=coord_fill, sink=sink)
 
             return data_rep
         except:
             # Вывести сообщение об ошибке в лог
             log.fatal(u'Ошибка генерации отчета <%s>.' % self._Rep['name'])
+        finally:
+            # Закрыть связь с БД таблицы запроса, читаемой порциями
+            self.closeQueryTbl(query_tbl)
         return None
 
     def generate(self, report=None, db_url=None, sql=None, stylelib=None, vars=None, *args, **kwargs):
@@ -268,6 +292,7 @@ class icODSReportGeneratorSystem(icrepgensystem.icReportGeneratorSystem):
         :param vars: Словарь переменных отчета.
         :return: Возвращает сгенерированный отчет или None в случае ошибки.
         """
+        query_tbl = None
         try:
             if report is not None:
                 self._Rep = report
@@ -283,9 +308,12 @@ class icODSReportGeneratorSystem(icrepgensystem.icReportGeneratorSystem):
             _kwargs.update(dict(db_url=db_url, sql=sql, stylelib=stylelib, variables=vars))
             query_tbl = self.getQueryTbl(self._Rep, **_kwargs)
             if self._isEmptyQueryTbl(query_tbl):
-                dlg.getMsgBox(u'Внимание',
-                              u'Нет данных, соответствующих запросу: %s' % self._Rep['query'],
-                              self._ParentForm)
+                if not config.get_glob_var('NO_GUI_MODE'):
+                    dlg.getMsgBox(u'Внимание',
+                                  u'Нет данных, соответствующих запросу: %s' % self._Rep['query'],
+                                  self._ParentForm)
+                else:
+                    log.warning(u'Нет данных, соответствующих запросу: %s' % self._Rep['query'])
                 return None
 
             # 2. Запустить генерацию
@@ -297,38 +325,51 @@ class icODSReportGeneratorSystem(icrepgensystem.icReportGeneratorSystem):
         except:
             # Вывести сообщение об ошибке в лог
             log.fatal(u'Ошибка генерации отчета <%s>.' % textfunc.toUnicode(self._Rep['name']))
+        finally:
+            # Закрыть связь с БД таблицы запроса, читаемой порциями
+            self.closeQueryTbl(query_tbl)
         return None
 
-    def save(self, report_data=None, is_virtual_excel=True):
+    def save(self, report_data=None, is_virtual_excel=True, sink=None, to_filename=None):
         """
         Сохранить результаты генерации в файл
 
         :param report_data: Сгенерированный отчет.
-        :param is_virtual_excel: Сохранение произвести с помощью VirtualExcel?
-            True - да, False - Сохранение производится конвертацией с помощью UNOCONV.
+        :param is_virtual_excel: Сохранение произвести без внешних конверторов?
+            True - да, ODS файл записывается непосредственно из структуры отчета,
+            False - Сохранение производится конвертацией XML файла с помощью UNOCONV.
             ВНИМАНИЕ! При конвертации с помощью UNOCONV ячейки не образмериваются.
                 Размеры ячеек остаются по умолчанию.
                 UNOCONV транслирует не все стили и атрибуты ячеек.
+        :param sink: Приемник строк отчета, заполненный при потоковой генерации.
+            Если указан, то файл дописывается им. Тип приемника должен
+            соответствовать способу сохранения (см. createSink).
+        :param to_filename: Имя результирующего ODS файла.
+            Если не указано, то отчет сохраняется в папке профиля
+            в файле <имя отчета>_report_result.ods.
         :return: Имя сохраненного файла или None, если сохранения не произошло.
         """
         if report_data:
-            rep_file = icrepfile.icExcelXMLReportFile()
             save_dir = self.getProfileDir()
             if not save_dir:
                 save_dir = icrepgensystem.DEFAULT_REPORT_DIR
-            # print(u'DBG:', save_dir, report_data, type(report_data))
             xml_rep_file_name = os.path.join(save_dir, '%s_report_result.xml' % report_data['name'])
             rep_file_name = os.path.join(save_dir, '%s_report_result.ods' % report_data['name'])
-
-            rep_file.write(xml_rep_file_name, report_data)
+            if to_filename:
+                rep_file_name = to_filename
+                xml_rep_file_name = os.path.splitext(to_filename)[0] + '.xml'
 
             if is_virtual_excel:
-                log.info(u'Конвертация отчета <%s> в файл <%s>' % (textfunc.toUnicode(xml_rep_file_name),
-                                                                   textfunc.toUnicode(rep_file_name)))
-                v_excel = icexcel.icVExcel()
-                v_excel.load(xml_rep_file_name)
-                v_excel.saveAs(rep_file_name)
+                # ODS файл записывается непосредственно из структуры отчета
+                # без промежуточного XML файла
+                log.info(u'Сохранение отчета <%s> в файл <%s>' % (textfunc.toUnicode(report_data['name']),
+                                                                  textfunc.toUnicode(rep_file_name)))
+                rep_file = sink if sink is not None else icodsrepfile.icODSReportFile()
+                rep_file.write(rep_file_name, report_data)
             else:
+                rep_file = sink if sink is not None else icrepfile.icExcelXMLReportFile()
+                rep_file.write(xml_rep_file_name, report_data)
+
                 # ВНИМАНИЕ! UNOCONV транслирует не все стили и атрибуты ячеек
                 # Поэтому сначала используется Virtual Excel
                 cmd = 'unoconv --format=ods %s' % xml_rep_file_name
@@ -11,14 +11,17 @@
 # Подключение библиотек
 import time
 import copy
+import shutil
+import tempfile
 from xml.sax import saxutils
 
 from ic.std.log import log
 from ic.std.utils import textfunc
+from ic.std.convert import dict2xml
 
 from ic.report import icrepgen
 
-__version__ = (0, 1, 1, 2)
+__version__ = (0, 1, 2, 1)
 
 # Спецификации и структуры
 # Спецификация стиля ячеек
@@ -31,6 +34,39 @@ SPC_IC_XML_STYLE = {'style_id': '',                                           #
                     }
 
 
+# Атрибуты ячейки, определяющие ее стиль
+STYLE_ATTRIBUTES = ('align', 'font', 'border', 'format', 'color')
+
+
+def _freezeStyleValue(value):
+    """
+    Привести значение атрибута стиля к хешируемому виду.
+    Равные значения приводятся к равным ключам.
+    """
+    if isinstance(value, dict):
+        items = [(key, _freezeStyleValue(item)) for key, item in value.items()]
+        try:
+            items.sort()
+        except TypeError:
+            items.sort(key=repr)
+        return dict, tuple(items)
+    elif isinstance(value, (list, tuple)):
+        return type(value), tuple([_freezeStyleValue(item) for item in value])
+    return value
+
+
+def getStyleKey(cell):
+    """
+    Канонический ключ стиля ячейки.
+    Ячейки с равными атрибутами стиля (см. STYLE_ATTRIBUTES)
+    имеют равные ключи.
+
+    :param cell: Атрибуты ячейки.
+    :return: Хешируемый ключ стиля.
+    """
+    return tuple([_freezeStyleValue(cell[attr_name]) for attr_name in STYLE_ATTRIBUTES])
+
+
 class icReportFile:
     """
     Класс файла отчета.
@@ -76,7 +112,7 @@ class icExcelXMLReportFile(icReportFile):
         xml_file = None
         try:
             # Начать запись
-            xml_file = open(rep_filename, 'wt')
+            xml_file = dict2xml.open_xml_file(rep_filename)
             xml_gen = icXMLSSGenerator(xml_file)
             xml_gen.startDocument()
             xml_gen.startBook()
@@ -105,12 +141,12 @@ class icExcelXMLReportFile(icReportFile):
             # Закончить запись
             xml_gen.endBook()
             xml_gen.endDocument()
-            xml_file.close()
+            dict2xml.close_xml_file(xml_file)
         
             return rep_filename
         except:
             if xml_file:
-                xml_file.close()
+                dict2xml.close_xml_file(xml_file)
             log.error(u'Ошибка сохранения отчета <%s>.' % textfunc.toUnicode(rep_filename))
             raise
         return None
@@ -127,7 +163,7 @@ class icExcelXMLReportFile(icReportFile):
         xml_file = None
         try:
             # Начать запись
-            xml_file = open(rep_filename, 'wt')
+            xml_file = dict2xml.open_xml_file(rep_filename)
             xml_gen = icXMLSSGenerator(xml_file)
             xml_gen.startDocument()
             xml_gen.startBook()
@@ -155,17 +191,154 @@ class icExcelXMLReportFile(icReportFile):
             # Закончить запись
             xml_gen.endBook()
             xml_gen.endDocument()
-            xml_file.close()
+            dict2xml.close_xml_file(xml_file)
         
             return rep_filename
         except:
             if xml_file:
-                xml_file.close()
+                dict2xml.close_xml_file(xml_file)
             log.error(u'Ошибка сохранения отчета %s.' % rep_filename)
             raise
         return None
 
 
+class icExcelXMLReportStream(icReportFile):
+    """
+    Потоковая запись *.XML отчета в формате Excel XMLSS.
+    Строки отчета передаются генератором по мере их заполнения
+    (см. icReportGenerator.generate(..., sink=...)) и сразу записываются
+    во временный файл тела листа. Стили, ширины колонок и объединения
+    ячеек отслеживаются инкрементально, поэтому весь лист в памяти
+    не хранится.
+    """
+
+    def __init__(self):
+        """
+        Конструктор.
+        """
+        icReportFile.__init__(self)
+
+        # Временный файл тела листа
+        self._body_file = tempfile.TemporaryFile(mode='w+b', buffering=dict2xml.WRITE_BUFFER_SIZE)
+        self._body_gen = icXMLSSGenerator(self._body_file)
+
+        # Количество колонок и ширины колонок по первой самой длинной строке
+        self._col_count = 0
+        self._col_widths = list()
+
+        # Ячейки последующих строк, попадающие в зону объединения
+        # Словарь {(Номер строки, Номер колонки): True}
+        self._merge_hidden = dict()
+
+        # Количество записанных строк
+        self._row_count = 0
+
+    def write(self, rep_filename, rec_data):
+        """
+        Сохранить заполненный отчет в файле.
+
+        :param rep_filename: Имя файла отчета XML.
+        :param rec_data: Данные отчета.
+            В потоковом режиме строки листа уже записаны и лист пуст.
+        :return: Функция возвращает имя созданного xml файла,
+            или None в случае ошибки.
+        """
+        for row in rec_data['sheet']:
+            self.writeRow(self._row_count, row)
+        return self.close(rep_filename, rec_data)
+
+    def writeRow(self, i_row, row):
+        """
+        Записать строку отчета.
+
+        :param i_row: Номер строки отчета (начиная с 0).
+        :param row: Список ячеек строки.
+        """
+        if len(row) > self._col_count:
+            self._col_count = len(row)
+            self._col_widths = [cell['width'] if cell else 8.43 for cell in row]
+        self._row_count = i_row + 1
+
+        for i_col, cell in enumerate(row):
+            if cell is not None:
+                # Ячейка попадает в зону объединения вышестоящей ячейки
+                if self._merge_hidden.pop((i_row, i_col), False) and not cell['value']:
+                    cell['hidden'] = True
+                self._body_gen.setStyle(cell)
+
+        sheet = icStreamSheetWindow(i_row, row)
+        self._body_gen.startRow(row)
+        for i_col, cell in enumerate(row):
+            self._body_gen.saveCell(i_row + 1, i_col + 1, cell, sheet)
+            if cell is not None and not cell.get('hidden', False) and cell['merge_row'] > 1:
+                # Запомнить ячейки нижних строк, попадающие в зону объединения
+                for y in range(1, cell['merge_row']):
+                    for x in range(max(cell['merge_col'], 1)):
+                        self._merge_hidden[(i_row + y, i_col + x)] = True
+        self._body_gen.endRow()
+
+    def close(self, rep_filename, report):
+        """
+        Закончить запись и сохранить отчет в файле.
+
+        :param rep_filename: Имя файла отчета XML.
+        :param report: Данные отчета (без строк листа).
+        :return: Функция возвращает имя созданного xml файла,
+            или None в случае ошибки.
+        """
+        xml_file = None
+        try:
+            xml_file = dict2xml.open_xml_file(rep_filename)
+            xml_gen = icXMLSSGenerator(xml_file)
+            xml_gen.startDocument()
+            xml_gen.startBook()
+
+            # Стили, зарегистрированные при записи строк
+            xml_gen._styles = self._body_gen._styles
+            xml_gen.saveStyles()
+
+            # Данные
+            xml_gen.startSheet(report['name'], report)
+            xml_gen.saveColumnWidths(self._col_widths)
+            xml_gen.flushBuffer()
+            self._body_file.seek(0)
+            shutil.copyfileobj(self._body_file, xml_file)
+            xml_gen.break_line = self._body_gen.break_line
+            xml_gen.endSheet(report)
+
+            # Закончить запись
+            xml_gen.endBook()
+            xml_gen.endDocument()
+            dict2xml.close_xml_file(xml_file)
+            self._body_file.close()
+            return rep_filename
+        except:
+            if xml_file:
+                dict2xml.close_xml_file(xml_file)
+            self._body_file.close()
+            log.error(u'Ошибка сохранения отчета <%s>.' % textfunc.toUnicode(rep_filename))
+            raise
+        return None
+
+
+class icStreamSheetWindow(object):
+    """
+    Окно листа из одной текущей строки для потоковой записи.
+    Обращение к другим строкам генерирует IndexError, который
+    обрабатывается функциями объединения ячеек icXMLSSGenerator.
+    """
+    __slots__ = ('i_row', 'row')
+
+    def __init__(self, i_row, row):
+        self.i_row = i_row
+        self.row = row
+
+    def __getitem__(self, i):
+        if i != self.i_row:
+            raise IndexError(i)
+        return self.row
+
+
 class icXMLSSGenerator(saxutils.XMLGenerator):
     """
     Класс генератора конвертора отчетов в xml представление.
@@ -183,6 +356,8 @@ class icXMLSSGenerator(saxutils.XMLGenerator):
         
         # Стили ячеек
         self._styles = []
+        # Индекс стилей {Ключ стиля: Индекс стиля в списке стилей}
+        self._style_idx = {}
         
         # Текущий индекс ячейки в строке
         self.cell_idx = 0
@@ -192,6 +367,43 @@ class icXMLSSGenerator(saxutils.XMLGenerator):
         # Время начала создания файла
         self.time_start = 0
 
+        # Буфер записи.
+        # Все фрагменты XML накапливаются в буфере и записываются
+        # в файл одной строкой по окончании каждой строки листа
+        self._buffer = []
+        self._buffer_write = self._write
+        self._write = self._buffer.append
+        # Кеш значений атрибутов в кавычках
+        self._quoted_attrs = {}
+
+    def flushBuffer(self):
+        """
+        Записать содержимое буфера в файл.
+        """
+        if self._buffer:
+            self._buffer_write(''.join(self._buffer))
+            del self._buffer[:]
+
+    def endDocument(self):
+        """
+        Конец документа.
+        """
+        self.flushBuffer()
+        saxutils.XMLGenerator.endDocument(self)
+
+    def _quoteAttr(self, value):
+        """
+        Значение атрибута в кавычках.
+        Идентификаторы стилей и типы данных ячеек постоянно
+        повторяются, поэтому результат кешируется.
+        """
+        quoted_value = self._quoted_attrs.get(value, None)
+        if quoted_value is None:
+            if len(self._quoted_attrs) >= dict2xml.QUOTE_ATTR_CACHE_SIZE:
+                self._quoted_attrs.clear()
+            quoted_value = self._quoted_attrs[value] = saxutils.quoteattr(value)
+        return quoted_value
+
     def startElementLevel(self, name, attrs):
         """
         Начало тега.
@@ -413,7 +625,8 @@ class icXMLSSGenerator(saxutils.XMLGenerator):
         :param cell: Атрибуты ячейки.
         :return: Возвращает индекс стиля в списке стилей.
         """
-        cell_style_idx = self.getStyle(cell)
+        style_key = getStyleKey(cell)
+        cell_style_idx = self.getStyle(cell, style_key)
         if cell_style_idx is None:
             # Создать новый стиль
             new_idx = len(self._styles)
@@ -427,24 +640,33 @@ class icXMLSSGenerator(saxutils.XMLGenerator):
             # Прописать в ячейке идентификатор стиля
             cell['style_id'] = cell_style['style_id']
             self._styles.append(cell_style)
+            self._style_idx[style_key] = new_idx
             return new_idx
         return cell_style_idx
       
-    def getStyle(self, cell):
+    def getStyle(self, cell, style_key=None):
         """
         Определить стиль ячейки из уже имеющихся.
 
         :param cell: Атрибуты ячейки.
+        :param style_key: Ключ стиля ячейки, если уже вычислен.
         :return: Возвращает индекс стиля в списке стилей.
         """
-        # сначала поискать в списке стилей
-        find_style = [style for style in self._styles if self._equalStyles(style, cell)]
+        if style_key is None:
+            style_key = getStyleKey(cell)
+        style_idx = self._style_idx.get(style_key, None)
 
         # Если такой стиль найден, то вернуть его
-        if find_style:
-            cell['style_id'] = find_style[0]['style_id']
-            return self._styles.index(find_style[0])
-        return None
+        if style_idx is not None:
+            cell['style_id'] = self._styles[style_idx]['style_id']
+        return style_idx
+
+    def getStyleCount(self):
+        """
+        Количество различных стилей ячеек.
+        Используется для диагностики.
+        """
+        return len(self._styles)
         
     def _equalStyles(self, style1, style2):
         """
@@ -645,6 +867,14 @@ class icXMLSSGenerator(saxutils.XMLGenerator):
         Запись атрибутов колонок.
         """
         width_cols = self.getWidthColumns(sheet)
+        self.saveColumnWidths(width_cols)
+
+    def saveColumnWidths(self, width_cols):
+        """
+        Запись атрибутов колонок по списку ширин.
+
+        :param width_cols: Список ширин колонок.
+        """
         for width_col in width_cols:
             # Если ширина колонки определена
             if width_col is not None:
@@ -682,7 +912,7 @@ class icXMLSSGenerator(saxutils.XMLGenerator):
         """
         Высота строки.
         """
-        return min([cell['height'] for cell in [cell_ for cell_ in row if type(cell_) == dict and 'height' in cell_]])
+        return min([cell['height'] for cell in [cell_ for cell_ in row if cell_ is not None and 'height' in cell_]])
             
     def startRow(self, row):
         """
@@ -698,6 +928,8 @@ class icXMLSSGenerator(saxutils.XMLGenerator):
         Конец строки.
         """
         self.endElementLevel('Row')
+        # Строка полностью сформирована в буфере
+        self.flushBuffer()
         
     def _saveCellStyleID(self, cell):
         """
@@ -760,15 +992,19 @@ class icXMLSSGenerator(saxutils.XMLGenerator):
         # Стиль
         cell_attr['ss:StyleID'] = self._saveCellStyleID(cell)
 
-        self.startElement('Cell', cell_attr)
+        # Ячейка формируется одной строкой.
+        # Отступы изменяются так же, как при вызовах startElement/endElement
+        break_line = self.break_line
+        cell_xml = '\n%s<Cell%s>' % (break_line, ''.join([' %s=%s' % (name, self._quoteAttr(value))
+                                                          for name, value in cell_attr.items()]))
         if cell['value'] is not None:
-            self.startElement('Data', {'ss:Type': self._getCellType(cell['value'])})
             value = self._getCellValue(cell['value'])
-            self.characters(value)
-        
-            self.endElement('Data')
-
-        self.endElement('Cell')
+            cell_xml += '\n%s<Data ss:Type=%s>%s</Data>' % (break_line,
+                                                             self._quoteAttr(self._getCellType(cell['value'])),
+                                                             saxutils.escape(value) if value else '')
+            break_line = break_line[:-1]
+        self._write(cell_xml + '</Cell>')
+        self.break_line = break_line[:-1]
         
     def _getCellValue(self, value):
         """
@@ -34,12 +34,22 @@
 import time
 import re
 import copy
+import operator
+import collections.abc
 
 from ic.std.log import log
 from ic.std.utils import textfunc
 from ic.std.utils import execfunc
 
-__version__ = (0, 1, 2, 2)
+from ic import config
+
+try:
+    import numpy
+except ImportError:
+    # Подсчет итогов в пакетном режиме производится без NumPy
+    numpy = None
+
+__version__ = (0, 1, 2, 3)
 
 # Константы
 # Ключевые теги для обозначения:
@@ -59,6 +69,8 @@ REP_EXEC_PATT = r'(\[=.*?=\])'
 REP_SYS_PATT = r'(\[\^.*?\^\])'
 REP_SUM_FIELD_START = '{'   # Теги используются в системной функции
 REP_SUM_FIELD_STOP = '}'    # суммирования SUM для обозначения значений полей
+# Формула суммирования, состоящая из обращения к одному полю
+REP_SUM_FIELD_FORMUL_RE = re.compile(r'^record\[\'([^\']+)\'\]$')
 # Указание стиля из библиотеки стилей
 REP_STYLE_PATT = r'(\[\*.*?\*\])'
 # Указание родительского отчета
@@ -75,7 +87,36 @@ ALL_PATTERNS = [REP_FIELD_PATT,
                 REP_STYLE_PATT,
                 REP_SUBREPORT_PATT,
                 ]
-    
+
+# Виды тегов ячейки шаблона
+REP_TAG_FUNC = 'func'
+REP_TAG_EXP = 'exp'
+REP_TAG_LAMBDA = 'lambda'
+REP_TAG_VAR = 'var'
+REP_TAG_EXEC = 'exec'
+REP_TAG_SYS = 'sys'
+REP_TAG_STYLE = 'style'
+REP_TAG_FIELD = 'field'
+REP_TAG_SUBREPORT = 'subreport'
+
+# Порядок определения вида тега при генерации
+REP_TAG_KINDS = ((re.compile(REP_FUNC_PATT), REP_TAG_FUNC),
+                 (re.compile(REP_EXP_PATT), REP_TAG_EXP),
+                 (re.compile(REP_LAMBDA_PATT), REP_TAG_LAMBDA),
+                 (re.compile(REP_VAR_PATT), REP_TAG_VAR),
+                 (re.compile(REP_EXEC_PATT), REP_TAG_EXEC),
+                 (re.compile(REP_SYS_PATT), REP_TAG_SYS),
+                 (re.compile(REP_STYLE_PATT), REP_TAG_STYLE),
+                 (re.compile(REP_FIELD_PATT), REP_TAG_FIELD),
+                 (re.compile(REP_SUBREPORT_PATT), REP_TAG_SUBREPORT),
+                 )
+
+# Разбор значения ячейки на теги по всем патернам
+REP_ALL_PATT_RE = re.compile(r'|'.join(ALL_PATTERNS))
+
+# Признак системной функции суммирования в значении ячейки
+REP_SUM_FUNC_RE = re.compile(r'\[\^(?:sum|avg)\(', re.IGNORECASE)
+
 # Спецификации и структуры
 # Структура шаблона отчета
 # Следующие ключи необходимы только для ICReportGenerator'a
@@ -95,6 +136,7 @@ IC_REP_TMPL = {'name': '',              # Имя отчета
                'sheet': [],             # Лист ячеек отчета (Список строк описаний ячеек)
                'args': {},              # Аргументы для вывода отчета в акцесс
                'page_setup': None,      # Параметры страницы
+               'sum_cells': None,       # Индекс ячеек с суммами (Список (Строка, Колонка) листа)
                }
 
 # Ориентация страницы
@@ -199,6 +241,253 @@ IC_REP_GRP = {'header': {},         # Заголовок группы.
 DEFAULT_ENCODING = 'utf-8'
 
 
+class icRepCell(collections.abc.MutableMapping):
+    """
+    Ячейка выходного отчета.
+    Атрибуты ячейки шаблона (шрифт, обрамление, цвет, выравнивание и т.п.)
+    не копируются, а разделяются всеми ячейками отчета, сгенерированными из нее.
+    В самой ячейке хранятся только значение, координата Y и
+    переопределенные атрибуты.
+    ВНИМАНИЕ! Атрибуты стиля в блоках кода необходимо переопределять
+        присваиванием, например cell['color'] = dict(...),
+        а не изменением разделяемого словаря cell['color']['background'] = ...
+    """
+    __slots__ = ('style', 'value', 'top', 'attrs')
+
+    def __init__(self, style, value=None, top=0):
+        """
+        Конструктор класса.
+
+        :param style: Ячейка шаблона, атрибуты которой разделяются.
+        :param value: Значение ячейки.
+        :param top: Координата Y.
+        """
+        self.style = style
+        self.value = value
+        self.top = top
+        # Переопределенные атрибуты ячейки
+        self.attrs = None
+
+    def __getitem__(self, key):
+        if key == 'value':
+            return self.value
+        elif key == 'top':
+            return self.top
+        elif self.attrs and key in self.attrs:
+            return self.attrs[key]
+        return self.style[key]
+
+    def __setitem__(self, key, value):
+        if key == 'value':
+            self.value = value
+        elif key == 'top':
+            self.top = value
+        else:
+            if self.attrs is None:
+                self.attrs = dict()
+            self.attrs[key] = value
+
+    def __delitem__(self, key):
+        if self.attrs and key in self.attrs:
+            del self.attrs[key]
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in ('value', 'top') or bool(self.attrs and key in self.attrs) or key in self.style
+
+    def __iter__(self):
+        keys = set(self.style.keys())
+        keys.update(('value', 'top'))
+        if self.attrs:
+            keys.update(self.attrs.keys())
+        return iter(keys)
+
+    def __len__(self):
+        return len(set(self))
+
+    def __bool__(self):
+        return True
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class icRepRecord(collections.abc.MutableMapping):
+    """
+    Текущая запись таблицы запроса.
+    Значения полей не копируются в словарь, а берутся из строки таблицы
+    запроса по общему для всех записей индексу полей.
+    Переход на следующую запись выполняется заменой строки.
+    ВНИМАНИЕ! Присваивание значения полю записи не изменяет таблицу запроса.
+        Значение сохраняется в копии строки до перехода на следующую запись.
+    """
+    __slots__ = ('field_idx', 'row', 'own_row', 'num_rec', 'extra')
+
+    def __init__(self, field_idx, row=None, num_rec=None, extra=None):
+        """
+        Конструктор класса.
+
+        :param field_idx: Словарь индексов полей {имя поля: индекс в строке}.
+        :param row: Строка таблицы запроса.
+        :param num_rec: Индекс записи в таблице запроса.
+        :param extra: Словарь дополнительных ключей записи,
+            присвоенных в блоках кода.
+        """
+        self.field_idx = field_idx
+        self.row = row
+        # Признак собственной (скопированной) строки
+        self.own_row = False
+        self.num_rec = num_rec
+        self.extra = dict() if extra is None else extra
+
+    def setRow(self, row, num_rec):
+        """
+        Перейти на запись таблицы запроса.
+
+        :param row: Строка таблицы запроса.
+        :param num_rec: Индекс записи в таблице запроса.
+        """
+        self.row = row
+        self.own_row = False
+        self.num_rec = num_rec
+
+    def copy(self):
+        """
+        Копия записи. Строка таблицы запроса разделяется копией.
+        """
+        rec = icRepRecord(self.field_idx, self.row, self.num_rec, dict(self.extra))
+        if self.own_row:
+            rec.row = list(self.row)
+            rec.own_row = True
+        return rec
+
+    def __getitem__(self, key):
+        idx = self.field_idx.get(key)
+        if idx is not None and self.row is not None:
+            return self.row[idx]
+        elif key == 'ic_sys_num_rec' and self.num_rec is not None:
+            return self.num_rec
+        return self.extra[key]
+
+    def __setitem__(self, key, value):
+        idx = self.field_idx.get(key)
+        if idx is not None and self.row is not None:
+            if not self.own_row:
+                self.row = list(self.row)
+                self.own_row = True
+            self.row[idx] = value
+        elif key == 'ic_sys_num_rec':
+            self.num_rec = value
+        else:
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        del self.extra[key]
+
+    def __contains__(self, key):
+        if self.row is not None and key in self.field_idx:
+            return True
+        elif key == 'ic_sys_num_rec' and self.num_rec is not None:
+            return True
+        return key in self.extra
+
+    def __iter__(self):
+        if self.row is not None:
+            for key in self.field_idx:
+                yield key
+        if self.num_rec is not None:
+            yield 'ic_sys_num_rec'
+        for key in self.extra:
+            yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+def getSumCellIndex(sheet):
+    """
+    Индекс ячеек листа шаблона с системными функциями суммирования.
+    Индекс вычисляется при компиляции шаблона и сохраняется в нем,
+    чтобы генератор не просматривал все ячейки листа при каждом запуске.
+
+    :param sheet: Лист шаблона отчета.
+    :return: Список кортежей (Строка, Колонка).
+    """
+    sum_cells = list()
+    for row, cells in enumerate(sheet):
+        for col, cell in enumerate(cells):
+            if cell and cell['value'] is not None and REP_SUM_FUNC_RE.search(str(cell['value'])):
+                sum_cells.append((row, col))
+    return sum_cells
+
+
+class icCellProgram(object):
+    """
+    Скомпилированная программа значения ячейки шаблона.
+    Программа представляет собой список частей значения:
+    строк-литералов и функций вычисления тегов вида f(name_space).
+    """
+    __slots__ = ('generator', 'text', 'parts', 'const_value')
+
+    def __init__(self, generator, text, parts):
+        """
+        Конструктор класса.
+
+        :param generator: Генератор отчета, в контексте которого выполняется программа.
+        :param text: Исходный текст значения ячейки.
+        :param parts: Список частей значения.
+        """
+        self.generator = generator
+        self.text = text
+        self.parts = parts
+
+        # Значение ячейки, не содержащей тегов, вычисляется сразу
+        self.const_value = None
+        if not [part for part in parts if not isinstance(part, str)]:
+            self.const_value = u''.join(parts)
+
+    def run(self, cell, record=None, cell_row=None, cell_col=None):
+        """
+        Выполнить программу.
+
+        :param cell: Ячейка.
+        :param record: Словарь, описывающий текущую запись таблицы запроса.
+        :param cell_row: Номер строки ячейки в результирующем отчете.
+        :param cell_col: Номер колонки ячейки в результирующем отчете.
+        :return: Возвращает сгенерированное значение.
+        """
+        if self.const_value is not None:
+            return self.const_value
+
+        generator = self.generator
+        try:
+            # Пространство имен блоков кода и выражений ячейки
+            name_space = {'self': generator, 'cell': cell, 'record': record,
+                          'cell_row': cell_row, 'cell_col': cell_col, 'value': u''}
+            values = []
+            for part in self.parts:
+                if isinstance(part, str):
+                    values.append(part)
+                else:
+                    # ВНИМАНИЕ! В значении ячейки тоже могут быть управляющие коды
+                    value = generator._genValue(part(name_space), record)
+                    name_space['value'] = value
+                    values.append(value)
+
+            if len(values) == 1:
+                return values[0]
+            return u''.join([u'' if value is None else value for value in values])
+        except:
+            # Вывести сообщение об ошибке в лог
+            log.fatal(u'Ошибка генерации текста ячейки <%s> шаблона <%s>.' % (textfunc.toUnicode(self.text),
+                                                                              generator._RepName))
+        return None
+
+
 class icReportGenerator:
     """
     Класс генератора отчета.
@@ -241,10 +530,31 @@ class icReportGenerator:
         # Покоординатная замена значений ячеек
         self._CoordFill = None
 
-        # Словарь форматов ячеек
-        self._cellFmt = {}
-
-    def generate(self, rep_template, query_table, name_space=None, coord_fill=None):
+        # Словарь скомпилированных программ значений ячеек шаблона.
+        # Значения, полученные из данных, не кешируются
+        self._cellProg = {}
+        # Словарь скомпилированных бэндов шаблона
+        self._bandProg = {}
+
+        # Приемник строк отчета в потоковом режиме генерации
+        self._Sink = None
+        # Количество строк, уже переданных в приемник
+        self._RepRowOffset = 0
+
+        # Индекс суммирующих ячеек шаблона.
+        # Список словарей {'row':..., 'col':..., 'sum':..., 'field':..., 'get':...}
+        self._SumCells = []
+        # Суммирующие ячейки шаблона по строкам {Номер строки: [...]}
+        self._SumRows = {}
+        # Пакетный подсчет итогов по колонкам таблицы запроса
+        self._BulkSum = False
+        # Колонки значений суммирования для пакетного подсчета
+        self._SumColumns = {}
+        # Количество просуммированных записей
+        self._SumRecCount = 0
+
+    def generate(self, rep_template, query_table, name_space=None, coord_fill=None, sink=None,
+                 bulk_sum=None, sort_groups=None):
         """
         Генерация отчета.
 
@@ -271,9 +581,31 @@ class icReportGenerator:
                 }.
             ВНИМАНИЕ! Этот словарь может передаваться в таблице запроса
                 ключ __coord_fill__.
+        :param sink: Приемник строк отчета для потоковой генерации.
+            Объект с методом writeRow(i_row, row), например
+            icodsrepfile.icODSReportFile или icrepfile.icExcelXMLReportStream.
+            Если определен, то сгенерированные строки передаются в приемник
+            по окончании генерации каждого бэнда и не накапливаются
+            в структуре отчета. Лист возвращаемого отчета в этом случае пуст.
+        :param bulk_sum: Подсчитывать итоги SUM/AVG пакетно по колонкам
+            таблицы запроса при выводе итоговых ячеек, а не на каждой записи.
+            Если None, то берется из config.BULK_SUM_MODE.
+        :param sort_groups: Отсортировать записи таблицы запроса по полям групп
+            перед генерацией, если в шаблоне определены группы.
+            Сортировка устойчивая, порядок записей внутри группы сохраняется.
+            Если None, то берется из config.SORT_GROUPS_MODE.
         :return: Заполненную структуру отчета.
         """
         try:
+            # Потоковый режим генерации
+            self._Sink = sink
+            self._RepRowOffset = 0
+
+            # Режим подсчета итогов
+            self._BulkSum = config.get_glob_var('BULK_SUM_MODE') if bulk_sum is None else bulk_sum
+            self._SumColumns = dict()
+            self._SumRecCount = 0
+
             # Покоординатная замена значений ячеек
             self._CoordFill = coord_fill
             if query_table and '__coord_fill__' in query_table:
@@ -315,14 +647,33 @@ class icReportGenerator:
                 self._StyleLib = self._Template['style_lib']
             
             self._TemplateSheet = self._Template['sheet']
-            self._TemplateSheet = self._initSumCells(self._TemplateSheet)
+            self._TemplateSheet = self._initSumCells(self._TemplateSheet, self._Template.get('sum_cells', None))
+            # Бэнды и значения ячеек компилируются заново для каждого шаблона
+            self._bandProg = dict()
+            self._cellProg = dict()
 
             # II. Инициализация таблицы запроса
             self._QueryTbl = query_table
-            # Определить количество записей в таблице запроса
-            self._QueryTblRecCount = 0
+            self._QueryData = list()
             if self._QueryTbl and '__data__' in self._QueryTbl:
-                self._QueryTblRecCount = len(self._QueryTbl['__data__'])
+                self._QueryData = self._QueryTbl['__data__']
+            query_fields = list()
+            if self._QueryTbl and '__fields__' in self._QueryTbl:
+                query_fields = list(self._QueryTbl['__fields__'])
+            if sort_groups is None:
+                sort_groups = config.get_glob_var('SORT_GROUPS_MODE')
+            if sort_groups and self._Template['groups']:
+                self._QueryData = self._sortQueryData(self._QueryData, query_fields,
+                                                      self._Template['groups'])
+            if self._BulkSum and not isinstance(self._QueryData, (list, tuple)):
+                # Записи читаются по мере генерации и не могут быть
+                # просуммированы по колонкам
+                self._BulkSum = False
+            # Количество записей определяется по мере их перебора
+            self._QueryTblRecCount = 0
+            # Записи таблицы запроса с границами групп
+            records = self._iterGroupBreaks(self._QueryData, query_fields,
+                                            self._Template['groups'])
 
             # Проинициализировать бенды групп
             for grp in self._Template['groups']:
@@ -341,23 +692,18 @@ class icReportGenerator:
             i = 0
             i_rec = 0
             # Перебор полей таблицы запроса
-            if self._QueryTbl and '__fields__' in self._QueryTbl:
-                for cur_field in self._QueryTbl['__fields__']:
-                    field_idx[cur_field] = i
-                    i += 1
+            for cur_field in query_fields:
+                field_idx[cur_field] = i
+                i += 1
 
+            # Текущая запись - представление строки таблицы запроса
+            self._CurRec = icRepRecord(field_idx)
+            cur_record = next(records, None)
             # Если записи в таблице запроса есть, то ...
-            if self._QueryTblRecCount:
+            if cur_record is not None:
                 # Проинициализировать текущую строку для использования
                 # ее в заголовке отчета
-                rec = self._QueryTbl['__data__'][i_rec]
-                # Заполнить словарь текущей записи
-                for field_name in field_idx.keys():
-                    val = rec[field_idx[field_name]]
-                    # Предгенерация значения данных ячейки
-                    self._CurRec[field_name] = val
-                # Прописать индекс текущей записи
-                self._CurRec['ic_sys_num_rec'] = i_rec
+                self._CurRec.setRow(cur_record[0], i_rec)
 
             # Верхний колонтитул
             if self._Template['upper']:
@@ -365,37 +711,25 @@ class icReportGenerator:
             
             # Вывести в отчет заголовок
             self._genHeader(self._Template['header'])
+            self._flushRows()
 
             # Главный цикл
             # Перебор записей таблицы запроса
-            while i_rec < self._QueryTblRecCount:
+            while cur_record is not None:
                 # Обработка групп
-                # Проверка смены группы в описании всех групп
-                # и найти индекс самой общей смененной группы
-                i_grp_out = -1      # индекс самой общей смененной группы
-                # Флаг начала генерации (примечания групп не выводяться)
-                start_gen = False
-                for i_grp in range(len(self._Template['groups'])):
-                    grp = self._Template['groups'][i_grp]
-                    if grp['old_rec']:
-                        # Проверить условие вывода примечания группы
-                        if self._CurRec[grp['field']] != grp['old_rec'][grp['field']]:
-                            i_grp_out = i_grp
-                            break
-                    else:
-                        i_grp_out = 0
-                        start_gen = True
-                        break
+                # Индекс самой общей смененной группы на границе отрезка
+                i_grp_out = cur_record[1]
                 if i_grp_out != -1:
                     # Вывести примечания
-                    if start_gen is False:
+                    # (в начале генерации примечания групп не выводятся)
+                    if i_rec:
                         for i_grp in range(len(self._Template['groups'])-1, i_grp_out-1, -1):
                             grp = self._Template['groups'][i_grp]
                             self._genGrpFooter(grp)
                     # Вывести заголовки
                     for i_grp in range(i_grp_out, len(self._Template['groups'])):
                         grp = self._Template['groups'][i_grp]
-                        grp['old_rec'] = copy.deepcopy(self._CurRec)
+                        grp['old_rec'] = self._CurRec.copy()
                         self._genGrpHeader(grp)
                     
                 # Область данных
@@ -403,19 +737,15 @@ class icReportGenerator:
 
                 # Увеличить суммы суммирующих ячеек
                 self._sumIterate(self._TemplateSheet, self._CurRec)
+                self._flushRows()
 
                 # Перейти на следующую запись
                 i_rec += 1
-                # Заполнить словарь текущей записи
-                if i_rec < self._QueryTblRecCount:
-                    rec = self._QueryTbl['__data__'][i_rec]
-                    # Заполнить словарь текущей записи
-                    for field_name in field_idx.keys():
-                        val = rec[field_idx[field_name]]
-                        # Предгенерация значения данных ячейки
-                        self._CurRec[field_name] = val
-                    # Прописать индекс текущей записи
-                    self._CurRec['ic_sys_num_rec'] = i_rec
+                cur_record = next(records, None)
+                # Заменить строку текущей записи
+                if cur_record is not None:
+                    self._CurRec.setRow(cur_record[0], i_rec)
+            self._QueryTblRecCount = i_rec
 
             # Вывести примечания после области данных
             for i_grp in range(len(self._Template['groups'])-1, -1, -1):
@@ -429,6 +759,7 @@ class icReportGenerator:
             # Нижний колонтитул
             if self._Template['under']:
                 self._genUnder(self._Template['under'])
+            self._flushRows()
 
             # Параметры страницы
             self._Rep['page_setup'] = self._Template['page_setup']
@@ -443,6 +774,66 @@ class icReportGenerator:
             log.fatal(u'Ошибка генерации отчета.')
             return None
 
+    def _sortQueryData(self, data, fields, groups):
+        """
+        Отсортировать записи таблицы запроса по полям групп.
+
+        :param data: Список записей таблицы запроса.
+        :param fields: Список имен полей таблицы запроса.
+        :param groups: Список описаний групп шаблона.
+        :return: Отсортированный список записей.
+            В случае несравнимых значений возвращается исходный список.
+        """
+        if not fields or not data:
+            # Пустая таблица запроса (см. createEmptyQueryTbl)
+            return data
+
+        grp_idx = [fields.index(grp['field']) for grp in groups]
+        # Пустые значения располагаются в конце группы
+        try:
+            return sorted(data, key=lambda rec: tuple((rec[i] is None, rec[i]) for i in grp_idx))
+        except TypeError:
+            log.warning(u'Отчет <%s>. Не возможно отсортировать записи по полям групп' % self._RepName)
+        return data
+
+    def _iterGroupBreaks(self, data, fields, groups):
+        """
+        Перебор записей таблицы запроса с определением границ групп.
+        Записи разбиваются на отрезки одинаковых значений полей групп
+        за один проход по колонкам группировки, без обращения по индексу.
+        Поэтому записи могут читаться по мере генерации.
+
+        :param data: Записи таблицы запроса (список или итерируемый объект).
+        :param fields: Список имен полей таблицы запроса.
+        :param groups: Список описаний групп шаблона.
+        :return: Генератор кортежей (запись, индекс самой общей смененной группы).
+            Если запись не начинает новый отрезок, то индекс группы -1.
+        """
+        if not groups or not fields:
+            # Нет групп или пустая таблица запроса (см. createEmptyQueryTbl)
+            for rec in data:
+                yield rec, -1
+            return
+
+        get_key = None
+        prev_key = None
+        for i_rec, rec in enumerate(data):
+            if not i_rec:
+                # Индексы полей групп определяются только если записи есть
+                grp_idx = [fields.index(grp['field']) for grp in groups]
+                get_key = operator.itemgetter(*grp_idx)
+            key = get_key(rec)
+            if not i_rec:
+                yield rec, 0
+            elif key != prev_key:
+                if len(grp_idx) == 1:
+                    yield rec, 0
+                else:
+                    yield rec, min(i_grp for i_grp, value in enumerate(key) if value != prev_key[i_grp])
+            else:
+                yield rec, -1
+            prev_key = key
+
     def _genHeader(self, header):
         """
         Сгенерировать заголовок отчета и перенести ее в выходной отчет.
@@ -452,21 +843,8 @@ class icReportGenerator:
         """
         try:
             # log.debug(u'Генерация заголовка')
-            # Добавлять будем в конец отчета,
-            # поэтому опреелить максимальную строчку
-            max_row = len(self._Rep['sheet'])
-            i_row = 0
-            cur_height = 0
-            # Перебрать все ячейки бэнда
-            for row in range(header['row'], header['row'] + header['row_size']):
-                for col in range(header['col'], header['col'] + header['col_size']):
-                    if self._TemplateSheet[row][col]:
-                        self._genCell(self._TemplateSheet, row, col,
-                                      self._Rep, max_row+i_row, col, self._CurRec)
-                        cur_height = self._TemplateSheet[row][col]['height']
-                i_row += 1
-                # Увеличить текущую координату Y
-                self._cur_top += cur_height
+            # Добавлять будем в конец отчета
+            max_row, i_row = self._genBandCells(header, self._CurRec)
             # Прописать область
             self._Rep['header'] = {'row': max_row,
                                    'col': header['col'],
@@ -493,21 +871,8 @@ class icReportGenerator:
             if not footer:
                 return True
 
-            # Добавлять будем в конец отчета,
-            # поэтому опреелить максимальную строчку
-            max_row = len(self._Rep['sheet'])
-            i_row = 0       # Счетчик строк бэнда
-            cur_height = 0
-            # Перебрать все ячейки бэнда
-            for row in range(footer['row'], footer['row'] + footer['row_size']):
-                for col in range(footer['col'], footer['col'] + footer['col_size']):
-                    if self._TemplateSheet[row][col]:
-                        self._genCell(self._TemplateSheet, row, col,
-                                      self._Rep, max_row+i_row, col, self._CurRec)
-                        cur_height = self._TemplateSheet[row][col]['height']
-                i_row += 1
-                # Увеличить текущую координату Y
-                self._cur_top += cur_height
+            # Добавлять будем в конец отчета
+            max_row, i_row = self._genBandCells(footer, self._CurRec)
             # Прописать область
             self._Rep['footer'] = {'row': max_row,
                                    'col': footer['col'],
@@ -528,21 +893,8 @@ class icReportGenerator:
         :return: Возвращает результат выполнения операции True/False.
         """
         try:
-            # Добавлять будем в конец отчета,
-            # поэтому опреелить максимальную строчку
-            max_row = len(self._Rep['sheet'])
-            i_row = 0   # Счетчик строк бэнда
-            cur_height = 0
-            # Перебрать все ячейки бэнда
-            for row in range(detail['row'], detail['row'] + detail['row_size']):
-                for col in range(detail['col'], detail['col'] + detail['col_size']):
-                    if self._TemplateSheet[row][col]:
-                        self._genCell(self._TemplateSheet, row, col,
-                                      self._Rep, max_row+i_row, col, self._CurRec)
-                        cur_height = self._TemplateSheet[row][col]['height']
-                i_row += 1
-                # Увеличить текущую координату Y
-                self._cur_top += cur_height
+            # Добавлять будем в конец отчета
+            max_row, i_row = self._genBandCells(detail, self._CurRec)
             # Прописать область
             if self._Rep['detail'] == {}:
                 self._Rep['detail'] = {'row': max_row,
@@ -570,21 +922,8 @@ class icReportGenerator:
             band = rep_group['header']
             if not band:
                 return False
-            # Добавлять будем в конец отчета,
-            # поэтому опреелить максимальную строчку
-            max_row = len(self._Rep['sheet'])
-            i_row = 0   # Счетчик строк бэнда
-            cur_height = 0
-            # Перебрать все ячейки бэнда
-            for row in range(band['row'], band['row']+band['row_size']):
-                for col in range(band['col'], band['col']+band['col_size']):
-                    if self._TemplateSheet[row][col]:
-                        self._genCell(self._TemplateSheet, row, col,
-                                      self._Rep, max_row+i_row, col, self._CurRec)
-                        cur_height = self._TemplateSheet[row][col]['height']
-                i_row += 1
-                # Увеличить текущую координату Y
-                self._cur_top += cur_height
+            # Добавлять будем в конец отчета
+            max_row, i_row = self._genBandCells(band, self._CurRec)
             # Очистить сумы суммирующих ячеек
             # ВНИМАНИЕ!!! Итоговых ячеек не бывает в заголовках. Поэтому я не обработываю их
             band = rep_group['footer']
@@ -607,21 +946,8 @@ class icReportGenerator:
             band = rep_group['footer']
             if not band:
                 return False
-            # Добавлять будем в конец отчета,
-            # поэтому опреелить максимальную строчку
-            max_row = len(self._Rep['sheet'])
-            i_row = 0   # Счетчик строк бэнда
-            cur_height = 0
-            # Перебрать все ячейки бэнда
-            for row in range(band['row'], band['row']+band['row_size']):
-                for col in range(band['col'], band['col']+band['col_size']):
-                    if self._TemplateSheet[row][col]:
-                        self._genCell(self._TemplateSheet, row, col,
-                                      self._Rep, max_row + i_row, col, rep_group['old_rec'])
-                        cur_height = self._TemplateSheet[row][col]['height']
-                i_row += 1
-                # Увеличить текущую координату Y
-                self._cur_top += cur_height
+            # Добавлять будем в конец отчета
+            max_row, i_row = self._genBandCells(band, rep_group['old_rec'])
             return True
         except:
             # Вывести сообщение об ошибке в лог
@@ -643,21 +969,8 @@ class icReportGenerator:
                 self._Rep['upper'] = upper
                 return True
                 
-            # Добавлять будем в конец отчета,
-            # поэтому опреелить максимальную строчку
-            max_row = len(self._Rep['sheet'])
-            i_row = 0
-            cur_height = 0
-            # Перебрать все ячейки бэнда
-            for row in range(upper['row'], upper['row'] + upper['row_size']):
-                for col in range(upper['col'], upper['col'] + upper['col_size']):
-                    if self._TemplateSheet[row][col]:
-                        self._genCell(self._TemplateSheet, row, col,
-                                      self._Rep, max_row+i_row, col, self._CurRec)
-                        cur_height = self._TemplateSheet[row][col]['height']
-                i_row += 1
-                # Увеличить текущую координату Y
-                self._cur_top += cur_height
+            # Добавлять будем в конец отчета
+            max_row, i_row = self._genBandCells(upper, self._CurRec)
             # Прописать область
             self._Rep['upper'] = copy.deepcopy(upper)
             self._Rep['upper']['row'] = max_row
@@ -683,21 +996,8 @@ class icReportGenerator:
                 self._Rep['under'] = under
                 return True
                 
-            # Добавлять будем в конец отчета,
-            # поэтому опреелить максимальную строчку
-            max_row = len(self._Rep['sheet'])
-            i_row = 0
-            cur_height = 0
-            # Перебрать все ячейки бэнда
-            for row in range(under['row'], under['row'] + under['row_size']):
-                for col in range(under['col'], under['col'] + under['col_size']):
-                    if self._TemplateSheet[row][col]:
-                        self._genCell(self._TemplateSheet, row, col,
-                                      self._Rep, max_row+i_row, col, self._CurRec)
-                        cur_height = self._TemplateSheet[row][col]['height']
-                i_row += 1
-                # Увеличить текущую координату Y
-                self._cur_top += cur_height
+            # Добавлять будем в конец отчета
+            max_row, i_row = self._genBandCells(under, self._CurRec)
             # Прописать область
             self._Rep['under'] = copy.deepcopy(under)
             self._Rep['under']['row'] = max_row
@@ -735,6 +1035,9 @@ class icReportGenerator:
                                                   self._QueryTbl['__sub__'][sub_rep_name]['__variables__'],
                                                   self._QueryTbl['__sub__'][sub_rep_name]['__coord_fill__'])
                     # Вставить результат под-отчета после строки
+                    # ВНИМАНИЕ! В потоковом режиме в листе отчета находятся
+                    # только строки, еще не переданные в приемник
+                    row = max(row - self._RepRowOffset, 0)
                     self._Rep['sheet'] = self._Rep['sheet'][:row]+rep_result['sheet']+self._Rep['sheet'][row:]
             return True
         except:
@@ -742,7 +1045,73 @@ class icReportGenerator:
             log.fatal(u'Ошибка генерации под-отчета <%s> отчета <%s>.' % (sub_rep_name, self._RepName))
             return False
 
-    def _genCell(self, from_sheet, from_row, from_col, to_report, to_row, to_col, record):
+    def _genBandCells(self, band, record):
+        """
+        Перенести все ячейки бэнда в конец выходного отчета.
+
+        :param band: Бэнд шаблона.
+        :param record: Запись.
+        :return: Кортеж (Номер первой строки бэнда в отчете, Количество строк бэнда).
+        """
+        max_row = self._getRepRowCount()
+        band_rows = self._getBandProgram(band)
+        if self._BulkSum:
+            self._bulkSumBand(band)
+        i_row = 0
+        cur_height = 0
+        for row_cells in band_rows:
+            for row, col, cell, program in row_cells:
+                self._genCell(self._TemplateSheet, row, col,
+                              self._Rep, max_row + i_row, col, record, program)
+                cur_height = cell['height']
+            i_row += 1
+            # Увеличить текущую координату Y
+            self._cur_top += cur_height
+        return max_row, i_row
+
+    def _getRepRowCount(self):
+        """
+        Количество сгенерированных строк отчета с учетом строк,
+        уже переданных в приемник в потоковом режиме.
+        """
+        return self._RepRowOffset + len(self._Rep['sheet'])
+
+    def _flushRows(self):
+        """
+        Передать сгенерированные строки отчета в приемник
+        в потоковом режиме генерации.
+        Переданные строки удаляются из листа отчета.
+        """
+        if self._Sink is None:
+            return
+        sheet = self._Rep['sheet']
+        for i_row, row in enumerate(sheet):
+            self._Sink.writeRow(self._RepRowOffset + i_row, row)
+        self._RepRowOffset += len(sheet)
+        del sheet[:]
+
+    def _getBandProgram(self, band):
+        """
+        Скомпилированный бэнд шаблона.
+
+        :param band: Бэнд шаблона.
+        :return: Список строк бэнда. Каждая строка - список кортежей
+            (Строка шаблона, Колонка шаблона, Ячейка шаблона, Программа значения ячейки).
+        """
+        band_key = (band['row'], band['col'], band['row_size'], band['col_size'])
+        if band_key not in self._bandProg:
+            band_rows = list()
+            for row in range(band['row'], band['row'] + band['row_size']):
+                row_cells = list()
+                for col in range(band['col'], band['col'] + band['col_size']):
+                    cell = self._TemplateSheet[row][col]
+                    if cell:
+                        row_cells.append((row, col, cell, self._getCellProgram(cell['value'])))
+                band_rows.append(row_cells)
+            self._bandProg[band_key] = band_rows
+        return self._bandProg[band_key]
+
+    def _genCell(self, from_sheet, from_row, from_col, to_report, to_row, to_col, record, program=None):
         """
         Генерация ячейки из шаблона в выходной отчет.
 
@@ -753,18 +1122,21 @@ class icReportGenerator:
         :param to_row: Координаты ячейки отчета. Строка.
         :param to_col: Координаты ячейки отчета. Столбец.
         :param record: Запись.
+        :param program: Скомпилированная программа значения ячейки.
+            Если не определена, то берется из кеша по значению ячейки.
         :return: Возвращает результат выполнения операции True/False.
         """
         try:
-            cell = copy.deepcopy(from_sheet[from_row][from_col])
+            # Атрибуты ячейки шаблона не копируются, а разделяются
+            cell = icRepCell(from_sheet[from_row][from_col], top=self._cur_top)
 
-            # Коррекция координат ячейки
-            cell['top'] = self._cur_top
             # Генерация текста ячейки
             if self._CoordFill and (to_row, to_col) in self._CoordFill:
                 # Координатные замены
                 fill_val = str(self._CoordFill[(to_row, to_col)])
-                cell['value'] = self._genTxt({'value': fill_val}, record, to_row, to_col)
+                cell['value'] = self._genTxt({'value': fill_val}, record, to_row, to_col, cache=False)
+            elif program is not None:
+                cell['value'] = program.run(cell, record, to_row, to_col)
             else:
                 # Перенести все ячейки из шаблона в выходной отчет
                 cell['value'] = self._genTxt(cell, record, to_row, to_col)
@@ -777,6 +1149,9 @@ class icReportGenerator:
                 cell.update(self.AttrDefault)
                 
             # Установить описание ячейки отчета.
+            # В потоковом режиме часть строк уже передана в приемник
+            if to_report is self._Rep:
+                to_row -= self._RepRowOffset
             if len(to_report['sheet']) <= to_row:
                 # Расширить строки
                 for i_row in range(len(to_report['sheet']), to_row + 1):
@@ -794,7 +1169,7 @@ class icReportGenerator:
             log.fatal(u'Ошибка генерации ячейки шаблона <%s>.' % self._RepName)
             return False
         
-    def _genTxt(self, cell, record=None, cell_row=None, cell_col=None):
+    def _genTxt(self, cell, record=None, cell_row=None, cell_col=None, cache=True):
         """
         Генерация текста.
 
@@ -803,94 +1178,223 @@ class icReportGenerator:
             Формат: { <имя поля> : <значение поля>, ...}
         :param cell_row: Номер строки ячейки в результирующем отчете.
         :param cell_col: Номер колонки ячейки в результирующем отчете.
+        :param cache: Кешировать программу значения?
+            Значения, полученные из данных, не кешируются,
+            иначе кеш растет вместе с объемом данных.
         :return: Возвращает сгенерированное значение.
         """
-        value = u''
-        try:
-            # Проверка на преобразование типов
-            cell_val = cell['value']
-            if cell_val is not None and not isinstance(cell_val, str):
-                cell_val = str(cell_val)
-            if cell_val not in self._cellFmt:
-                parsed_fmt = self.funcTextParse(cell_val)
-                self._cellFmt[cell_val] = parsed_fmt
-            else:
-                parsed_fmt = self._cellFmt[cell_val]
-
-            func_str = []   # Выходной список значений
-            i_sum = 0
-            # Перебрать строки функционала
-            for cur_func in parsed_fmt['func']:
+        program = self._getCellProgram(cell['value'], cache)
+        if program is None:
+            return None
+        return program.run(cell, record, cell_row, cell_col)
 
-                # Функция
-                if re.search(REP_FUNC_PATT, cur_func):
-                    value = self._exec_function(cur_func, locals(), globals())
+    def _genValue(self, value, record=None):
+        """
+        Генерация значения, полученного при выполнении тега.
+        ВНИМАНИЕ! В значении тоже могут быть управляющие коды.
 
-                # Исполняемое выражение
-                elif re.search(REP_EXP_PATT, cur_func):
-                    value = self._exec_expression(cur_func, locals(), globals())
+        :param value: Значение.
+        :param record: Словарь, описывающий текущую запись таблицы запроса.
+        :return: Возвращает сгенерированное значение в строковом виде.
+        """
+        if value is None:
+            return u''
+        if not isinstance(value, str):
+            value = str(value)
+        # Все теги начинаются с <[>
+        if u'[' not in value:
+            return value
+        return self._genTxt({'value': value}, record, cache=False)
+
+    def _getCellProgram(self, cell_val, cache=True):
+        """
+        Получить скомпилированную программу значения ячейки.
+        Программы значений ячеек шаблона кешируются по тексту значения.
 
-                # Ламбда-выражение
-                elif re.search(REP_LAMBDA_PATT, cur_func):
-                    value = self._exec_lambda(cur_func, locals(), globals())
+        :param cell_val: Значение ячейки шаблона.
+        :param cache: Кешировать программу?
+        :return: Объект icCellProgram или None в случае ошибки.
+        """
+        # Проверка на преобразование типов
+        if cell_val is not None and not isinstance(cell_val, str):
+            cell_val = str(cell_val)
+        if cell_val in self._cellProg:
+            return self._cellProg[cell_val]
+
+        program = self._compileCellText(cell_val)
+        if cache:
+            self._cellProg[cell_val] = program
+        return program
+
+    def _compileCellText(self, text):
+        """
+        Скомпилировать значение ячейки шаблона в программу.
+        Вид каждого тега определяется один раз,
+        блоки кода и выражения компилируются в объекты кода.
 
-                # Переменная
-                elif re.search(REP_VAR_PATT, cur_func):
-                    value = self._get_variable(cur_func, locals(), globals())
+        :param text: Значение ячейки шаблона.
+        :return: Объект icCellProgram или None в случае ошибки.
+        """
+        try:
+            parts = list()
+            i_sum = 0
+            for is_func, cur_func in self.funcTextSplit(text):
+                if not is_func:
+                    if cur_func:
+                        parts.append(cur_func)
+                    continue
+                kind = self.getTagKind(cur_func)
+                parts.append(self._compileTag(kind, cur_func, i_sum))
+                if kind == REP_TAG_SYS and cur_func[2:6].lower() in ('sum(', 'avg('):
+                    # Перейти к следующей сумме
+                    i_sum += 1
+            return icCellProgram(self, text, parts)
+        except:
+            log.fatal(u'Ошибка компиляции ячейки <%s> шаблона <%s>.' % (textfunc.toUnicode(text), self._RepName))
+        return None
 
-                # Блок кода
-                elif re.search(REP_EXEC_PATT, cur_func):
-                    value = self._exec_code(cur_func, locals(), globals())
+    def getTagKind(self, cur_func):
+        """
+        Определить вид тега.
 
-                # Системная функция
-                elif re.search(REP_SYS_PATT, cur_func):
-                    # Функция суммирования
-                    if cur_func[2:6].lower() == 'sum(':
-                        value = str(cell['sum'][i_sum]['value'])
-                        i_sum += 1  # Перейти к следующей сумме
-                    # Функция вычисления среднего значения
-                    elif cur_func[2:6].lower() == 'avg(':
-                        if 'ic_sys_num_rec' not in record:
-                            record['ic_sys_num_rec'] = 0
-                        value = str(cell['sum'][i_sum]['value'] / (record['ic_sys_num_rec'] + 1))
-                        i_sum += 1  # Перейти к следующей сумме
-                    elif cur_func[2:-2].lower() == 'n':
-                        if 'ic_sys_num_rec' not in record:
-                            record['ic_sys_num_rec'] = 0
-                        sys_num_rec = record['ic_sys_num_rec']
-                        value = str(sys_num_rec + 1)
-                    else:
-                        # Вывести сообщение об ошибке в лог
-                        log.warning(u'Неизвестная системная функция <%s> шаблона <%s>.' % (textfunc.toUnicode(cur_func),
-                                                                                           self._RepName))
-                        value = ''
-                        
-                # Стиль
-                elif re.search(REP_STYLE_PATT, cur_func):
-                    value = self._set_style(cur_func, locals(), globals())
-
-                # Поле
-                elif re.search(REP_FIELD_PATT, cur_func):
-                    value = self._get_field_value(cur_func, locals(), globals())
-
-                # Под-отчеты
-                elif re.search(REP_SUBREPORT_PATT, cur_func):
-                    value = self._gen_subreport(cur_func, locals(), globals())
+        :param cur_func: Текст тега.
+        :return: Вид тега REP_TAG_... или None, если тег не распознан.
+        """
+        for tag_patt, tag_kind in REP_TAG_KINDS:
+            if tag_patt.search(cur_func):
+                return tag_kind
+        return None
 
-                else:
-                    log.warning(u'Не обрабатываемая функция <%s>' % str(cur_func))
+    def _compileTag(self, kind, cur_func, i_sum=0):
+        """
+        Скомпилировать тег в функцию вычисления значения.
 
-                # ВНИМАНИЕ! В значении ячейки тоже могут быть управляющие коды
-                value = self._genTxt({'value': value}, record)
-                func_str.append(value)
+        :param kind: Вид тега.
+        :param cur_func: Текст тега.
+        :param i_sum: Индекс суммы ячейки для функций SUM/AVG.
+        :return: Функция вида f(name_space), возвращающая значение тега.
+            name_space - пространство имен ячейки.
+        """
+        if kind == REP_TAG_FUNC:
+            return lambda name_space: self._exec_function(cur_func, name_space, None)
+
+        elif kind == REP_TAG_EXP:
+            exp_body = cur_func[2:-2]
+            exp_code = self._compileCode(exp_body, 'eval')
+            if exp_code is None:
+                return lambda name_space: u''
+
+            def _exp(name_space):
+                try:
+                    return eval(exp_code, globals(), name_space)
+                except:
+                    log.fatal(u'Ошибка выполнения исполняемого выражения <%s>' % exp_body)
+                return u''
+            return _exp
+
+        elif kind == REP_TAG_LAMBDA:
+            lambda_body = cur_func[2:-2]
+            try:
+                lambda_func = eval('lambda ' + lambda_body)
+            except:
+                log.fatal(u'Ошибка определения lambda выражения <%s>' % lambda_body)
+                return lambda name_space: u''
+
+            def _lambda(name_space):
+                try:
+                    return str(lambda_func(name_space['record']))
+                except:
+                    log.fatal(u'Ошибка выполнения lambda выражения <%s>' % lambda_body)
+                return u''
+            return _lambda
+
+        elif kind == REP_TAG_VAR:
+            return lambda name_space: self._get_variable(cur_func, name_space, None)
+
+        elif kind == REP_TAG_EXEC:
+            exec_func = cur_func[2:-2].strip()
+            exec_code = self._compileCode(exec_func, 'exec')
+            if exec_code is None:
+                return lambda name_space: u''
+
+            def _exec(name_space):
+                value = u''
+                try:
+                    exec(exec_code, globals(), name_space)
+                    # ВНИМАНИЕ! При выполнении блока кода значение переменной располагается
+                    # в пространстве имен ячейки
+                    value = name_space.get('value', u'')
+                except:
+                    log.fatal(u'Ошибка выполнения блока кода <%s>' % textfunc.toUnicode(exec_func))
+                return str(value)
+            return _exec
+
+        elif kind == REP_TAG_SYS:
+            sys_func = cur_func[2:6].lower()
+            if sys_func == 'sum(':
+                # Функция суммирования
+                return lambda name_space: str(name_space['cell']['sum'][i_sum]['value'])
+            elif sys_func == 'avg(':
+                # Функция вычисления среднего значения
+                def _avg(name_space):
+                    record = name_space['record']
+                    if 'ic_sys_num_rec' not in record:
+                        record['ic_sys_num_rec'] = 0
+                    return str(name_space['cell']['sum'][i_sum]['value'] / (record['ic_sys_num_rec'] + 1))
+                return _avg
+            elif cur_func[2:-2].lower() == 'n':
+                def _num(name_space):
+                    record = name_space['record']
+                    if 'ic_sys_num_rec' not in record:
+                        record['ic_sys_num_rec'] = 0
+                    return str(record['ic_sys_num_rec'] + 1)
+                return _num
+
+            def _unknown_sys(name_space):
+                # Вывести сообщение об ошибке в лог
+                log.warning(u'Неизвестная системная функция <%s> шаблона <%s>.' % (textfunc.toUnicode(cur_func),
+                                                                                   self._RepName))
+                return u''
+            return _unknown_sys
+
+        elif kind == REP_TAG_STYLE:
+            return lambda name_space: self._set_style(cur_func, name_space, None)
+
+        elif kind == REP_TAG_FIELD:
+            field_name = str(cur_func[2:-2])
+
+            def _field(name_space):
+                record = name_space['record']
+                try:
+                    return record[field_name]
+                except KeyError:
+                    log.warning(u'В строке (%s) поле <%s> не найдено' % (textfunc.toUnicode(record),
+                                                                         textfunc.toUnicode(field_name)))
+                return u''
+            return _field
+
+        elif kind == REP_TAG_SUBREPORT:
+            return lambda name_space: self._gen_subreport(cur_func, name_space, None)
+
+        def _unknown(name_space):
+            log.warning(u'Не обрабатываемая функция <%s>' % str(cur_func))
+            # Значение ячейки остается прежним
+            return name_space['value']
+        return _unknown
+
+    def _compileCode(self, code_txt, mode='exec'):
+        """
+        Скомпилировать текст блока кода/выражения.
 
-            # Заполнение формата
-            return self._valueFormat(parsed_fmt['fmt'], func_str)
+        :param code_txt: Текст блока кода/выражения.
+        :param mode: Режим компиляции 'exec' или 'eval'.
+        :return: Объект кода или None в случае ошибки.
+        """
+        try:
+            return compile(code_txt, '<%s>' % self._RepName, mode)
         except:
-            # Вывести сообщение об ошибке в лог
-            log.fatal(u'Ошибка генерации текста ячейки <%s> шаблона <%s>.' % (textfunc.toUnicode(cell['value']),
-                                                                              self._RepName))
-            return None
+            log.fatal(u'Ошибка компиляции <%s> шаблона <%s>' % (textfunc.toUnicode(code_txt), self._RepName))
+        return None
 
     def _exec_function(self, cur_func, locals, globals):
         """
@@ -1100,27 +1604,64 @@ class icReportGenerator:
         """
         return '0'
 
-    def _initSumCells(self, sheet):
+    def _initSumCells(self, sheet, sum_cells=None):
         """
         Выявление и инициализация ячеек с суммами.
+        Суммирующие ячейки индексируются, а их формулы компилируются.
 
         :param sheet: Описание листа отчета.
+        :param sum_cells: Индекс ячеек с суммами, подготовленный при компиляции шаблона
+            (см. getSumCellIndex). Если не определен, то просматриваются все ячейки листа.
         :return: Возвращает описание листа с корректным описанием ячеек с суммами.
             В результате ошибки возвращает старое описание листа.
         """
+        self._SumCells = list()
+        self._SumRows = dict()
         try:
             new_sheet = sheet
-            # Просмотр и коррекция каждой ячейки листа
-            for row in range(len(new_sheet)):
-                for col in range(len(new_sheet[row])):
-                    if new_sheet[row][col]:
-                        new_sheet[row][col] = self._initSumCell(new_sheet[row][col])
+            if sum_cells is None:
+                sum_cells = [(row, col) for row in range(len(new_sheet)) for col in range(len(new_sheet[row]))]
+            # Просмотр и коррекция ячеек листа
+            for row, col in sum_cells:
+                if new_sheet[row][col]:
+                    new_sheet[row][col] = self._initSumCell(new_sheet[row][col])
+                    for cur_sum in new_sheet[row][col]['sum'] or ():
+                        self._indexSumCell(row, col, cur_sum)
             return new_sheet
         except:
             # Вывести сообщение об ошибке в лог
             log.fatal(u'Ошибка инициализации суммирующих ячеек шаблона <%s>.' % self._RepName)
         return sheet
 
+    def _indexSumCell(self, row, col, cur_sum):
+        """
+        Добавить сумму ячейки в индекс суммирующих ячеек.
+        Формула вида {имя поля} компилируется в обращение к полю записи,
+        остальные формулы - в байт-код.
+
+        :param row: Строка ячейки в шаблоне.
+        :param col: Колонка ячейки в шаблоне.
+        :param cur_sum: Словарь суммы IC_REP_SUM ячейки.
+        """
+        formul = cur_sum['formul'].strip()
+        field_match = REP_SUM_FIELD_FORMUL_RE.match(formul)
+        field = field_match.group(1) if field_match else None
+        if field is not None:
+            get_value = lambda record: record[field]
+        else:
+            try:
+                code = compile(formul, '<sum>', 'eval')
+            except:
+                log.warning(u'Ошибка компиляции формулы для подсчета сумм <%s>.' % formul)
+                code = compile('0.0', '<sum>', 'eval')
+            get_value = lambda record: eval(code, globals(), {'record': record, 'self': self})
+
+        # stop - количество записей, учтенных в сумме при пакетном подсчете
+        sum_cell = dict(row=row, col=col, sum=cur_sum, field=field, get=get_value, stop=0)
+        self._SumCells.append(sum_cell)
+        self._SumRows.setdefault(row, list()).append(sum_cell)
+        return sum_cell
+
     def _initSumCell(self, cell):
         """
         Инициализация суммарной ячейки.
@@ -1163,37 +1704,98 @@ class icReportGenerator:
         :return: Возвращает описание листа с корректным описанием ячеек с суммами.
             В результате ошибки возвращает старое описание листа.
         """
+        self._SumRecCount += 1
+        if self._BulkSum:
+            # Суммы подсчитываются при выводе итоговых ячеек
+            return sheet
         try:
-            new_sheet = sheet
-            # Просмотр и коррекция каждой ячейки листа
-            for row in range(len(new_sheet)):
-                for col in range(len(new_sheet[row])):
-                    # Если ячейка определена, то ...
-                    if new_sheet[row][col]:
-                        # Если ячейка суммирующая,
-                        # то выполнить операцию суммирования
-                        if new_sheet[row][col]['sum'] is not None and new_sheet[row][col]['sum'] is not []:
-                            for cur_sum in new_sheet[row][col]['sum']:
-                                try:
-                                    value = eval(cur_sum['formul'], globals(), locals())
-                                except:
-                                    log.warning(u'Ошибка выполнения формулы для подсчета сумм <%s>.' % cur_sum)
-                                    value = 0.0
-                                try:
-                                    if value is None:
-                                        value = 0.0
-                                    else:
-                                        value = float(value)
-                                    cur_sum['value'] += value
-                                except:
-                                    log.warning(u'Ошибка итерации сумм <%s>+<%s>' % (cur_sum['value'], value))
-
-            return new_sheet
+            for sum_cell in self._SumCells:
+                cur_sum = sum_cell['sum']
+                try:
+                    value = sum_cell['get'](record)
+                except:
+                    log.warning(u'Ошибка выполнения формулы для подсчета сумм <%s>.' % cur_sum)
+                    value = 0.0
+                try:
+                    if value is None:
+                        value = 0.0
+                    else:
+                        value = float(value)
+                    cur_sum['value'] += value
+                except:
+                    log.warning(u'Ошибка итерации сумм <%s>+<%s>' % (cur_sum['value'], value))
+            return sheet
         except:
             # Вывести сообщение об ошибке в лог
             log.fatal(u'Ошибка итерации сумм суммирующих ячеек шаблона <%s>.' % self._RepName)
         return sheet
 
+    def _getSumColumn(self, sum_cell):
+        """
+        Колонка значений суммирования по всем записям таблицы запроса.
+        Колонки вычисляются один раз для каждого поля/формулы.
+
+        :param sum_cell: Описание суммирующей ячейки из индекса.
+        :return: Список значений (или массив NumPy, если он доступен).
+        """
+        key = sum_cell['field'] if sum_cell['field'] is not None else sum_cell['sum']['formul']
+        if key in self._SumColumns:
+            return self._SumColumns[key]
+
+        field_idx = self._CurRec.field_idx
+        data = self._QueryData
+        if sum_cell['field'] is not None and sum_cell['field'] in field_idx:
+            i_field = field_idx[sum_cell['field']]
+            values = [rec[i_field] for rec in data]
+        else:
+            values = list()
+            record = icRepRecord(field_idx)
+            for i_rec, rec in enumerate(data):
+                record.setRow(rec, i_rec)
+                try:
+                    values.append(sum_cell['get'](record))
+                except:
+                    log.warning(u'Ошибка выполнения формулы для подсчета сумм <%s>.' % sum_cell['sum'])
+                    values.append(None)
+
+        column = list()
+        for value in values:
+            try:
+                column.append(0.0 if value is None else float(value))
+            except:
+                log.warning(u'Ошибка итерации сумм <%s>' % value)
+                column.append(0.0)
+        if numpy is not None:
+            column = numpy.array(column, dtype=float)
+        self._SumColumns[key] = column
+        return column
+
+    def _bulkSumBand(self, band):
+        """
+        Пакетный подсчет сумм ячеек бэнда по колонкам таблицы запроса.
+        К сумме добавляются значения записей, просуммированных с момента
+        последнего подсчета.
+
+        :param band: Бэнд шаблона.
+        """
+        try:
+            for row in range(band['row'], band['row'] + band['row_size']):
+                for sum_cell in self._SumRows.get(row, ()):
+                    if sum_cell['stop'] >= self._SumRecCount:
+                        continue
+                    column = self._getSumColumn(sum_cell)
+                    start, stop = sum_cell['stop'], self._SumRecCount
+                    if numpy is not None:
+                        sum_cell['sum']['value'] += float(column[start:stop].sum())
+                    else:
+                        value = sum_cell['sum']['value']
+                        for i_rec in range(start, stop):
+                            value += column[i_rec]
+                        sum_cell['sum']['value'] = value
+                    sum_cell['stop'] = stop
+        except:
+            log.fatal(u'Ошибка пакетного подсчета сумм отчета <%s>.' % self._RepName)
+
     def _clearSum(self, sheet, start_row, stop_row):
         """
         Обнуление сумм.
@@ -1205,17 +1807,12 @@ class icReportGenerator:
             В результате ошибки возвращает старое описание листа.
         """
         try:
-            new_sheet = sheet
-            # Просмотр и коррекция каждой ячейки листа
             for row in range(start_row, stop_row):
-                for col in range(len(new_sheet[row])):
-                    # Если ячейка определена, то ...
-                    if new_sheet[row][col]:
-                        # Если ячейка суммирующая, то выполнить операцию обнуления
-                        if new_sheet[row][col]['sum'] is not None and new_sheet[row][col]['sum'] is not []:
-                            for cur_sum in new_sheet[row][col]['sum']:
-                                cur_sum['value'] = 0
-            return new_sheet
+                for sum_cell in self._SumRows.get(row, ()):
+                    sum_cell['sum']['value'] = 0
+                    # Пакетный подсчет начинается с текущей записи
+                    sum_cell['stop'] = self._SumRecCount
+            return sheet
         except:
             # Вывести сообщение об ошибке в лог
             log.error(u'Ошибка обнуления сумм суммирующих ячеек шаблона <%s>.' % self._RepName)
@@ -1225,6 +1822,19 @@ class icReportGenerator:
     def getCurRec(self):
         return self._CurRec
 
+    def funcTextSplit(self, text):
+        """
+        Разобрать строку на последовательность обычных строк и тегов.
+
+        :param text: Разбираемая строка.
+        :return: Список кортежей (Признак тега True/False, Строка).
+        """
+        if not text:
+            return list()
+        # Разбор строки на обычные строки и строки функционала
+        parsed_str = [x for x in REP_ALL_PATT_RE.split(text) if x is not None]
+        return [(any([tag_patt.search(txt) for tag_patt, tag_kind in REP_TAG_KINDS]), txt) for txt in parsed_str]
+
     def funcTextParse(self, text, patterns=ALL_PATTERNS):
         """
         Разобрать строку на формат и исполняемый код.
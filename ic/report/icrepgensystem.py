@@ -33,7 +33,9 @@ from ic.std.utils import txtgen
 
 from ic.report import icreptemplate
 
-__version__ = (0, 1, 1, 2)
+from ic import config
+
+__version__ = (0, 1, 1, 3)
 
 # Константы подсистемы
 DEFAULT_REP_TMPL_FILE = os.path.join(os.path.dirname(__file__), 'new_report_template.ods')
@@ -54,6 +56,122 @@ SQL_SIGNATURE = 'SQL:'
 CODE_SIGNATURE = 'PRG:'
 PY_SIGNATURE = 'PY:'
 
+# Кеш объектов связи с БД (sqlalchemy engine)
+# Словарь {DB URL: Объект связи с БД}
+# Пул соединений сохраняется между генерациями отчетов
+_DB_ENGINE_CACHE = dict()
+
+
+def getDBEngine(db_url):
+    """
+    Получить объект связи с БД (sqlalchemy engine).
+    Объекты связи кешируются по DB URL.
+
+    :param db_url: Connection string в виде url.
+    :return: Объект связи с БД.
+    """
+    db_engine = _DB_ENGINE_CACHE.get(db_url, None)
+    if db_engine is None:
+        db_engine = sqlalchemy.create_engine(db_url)
+        _DB_ENGINE_CACHE[db_url] = db_engine
+    return db_engine
+
+
+class icSQLQueryData(object):
+    """
+    Записи таблицы запроса, читаемые из БД порциями
+    через курсор на стороне сервера.
+    При переборе записи не накапливаются в памяти.
+    Перебор возможен только один раз.
+    Обращение по индексу и определение количества записей
+    загружают все оставшиеся записи в память.
+    """
+
+    def __init__(self, db_connection, connection, sql_result, chunk_size):
+        """
+        Конструктор класса.
+
+        :param db_connection: Объект связи с БД (sqlalchemy engine),
+            освобождаемый при закрытии. Если None, то освобождается только соединение.
+        :param connection: Соединение с БД, в котором выполнен запрос.
+        :param sql_result: Результат выполнения запроса.
+        :param chunk_size: Количество записей, читаемых за один раз.
+        """
+        self._db_connection = db_connection
+        self._connection = connection
+        self._sql_result = sql_result
+        self._chunk_size = chunk_size
+        # Прочитанные, но еще не перебранные записи
+        self._rows = list()
+        # Признак выполненного перебора записей
+        self._is_iterated = False
+
+        # Первая порция читается сразу для проверки наличия данных
+        self._rows = self._fetch()
+
+    def _fetch(self):
+        """
+        Прочитать очередную порцию записей.
+        После чтения последней порции связь с БД закрывается.
+
+        :return: Список записей.
+        """
+        if self._sql_result is None:
+            return list()
+        rows = self._sql_result.fetchmany(self._chunk_size)
+        if len(rows) < self._chunk_size:
+            self.close()
+        return rows
+
+    def _load(self):
+        """
+        Загрузить все оставшиеся записи в память.
+        """
+        if self._is_iterated:
+            raise IndexError(u'Записи таблицы запроса уже перебраны')
+        while self._sql_result is not None:
+            self._rows.extend(self._fetch())
+
+    def close(self):
+        """
+        Закрыть связь с БД.
+        """
+        if self._sql_result is not None:
+            self._sql_result.close()
+            self._sql_result = None
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+        if self._db_connection is not None:
+            self._db_connection.dispose()
+            self._db_connection = None
+
+    def __iter__(self):
+        if self._is_iterated:
+            raise IndexError(u'Записи таблицы запроса уже перебраны')
+        self._is_iterated = True
+        rows = self._rows
+        self._rows = list()
+        try:
+            while rows:
+                for row in rows:
+                    yield row
+                rows = self._fetch()
+        finally:
+            # Связь закрывается и при ошибке или прекращении перебора
+            self.close()
+
+    def __getitem__(self, item):
+        self._load()
+        return self._rows[item]
+
+    def __len__(self):
+        self._load()
+        return len(self._rows)
+
+    def __bool__(self):
+        return bool(self._rows) or self._is_iterated
+
 
 class icReportGeneratorSystem(object):
     """
@@ -390,8 +508,6 @@ class icReportGeneratorSystem(object):
             {'__fields__':имена полей таблицы,'__data__':данные таблицы}
         """
         result = None
-        # Инициализация
-        db_connection = None
         try:
             if not db_url:
                 data_source = report['data_source']
@@ -410,27 +526,32 @@ class icReportGeneratorSystem(object):
 
             log.info(u'Связь с БД <%s>' % db_url)
             # Установить связь с БД
-            db_connection = sqlalchemy.create_engine(db_url)
-            # Освободить БД
-            # db_connection.dispose()
+            db_connection = getDBEngine(db_url)
             log.info(u'SQL <%s>' % textfunc.toUnicode(sql, 'utf-8'))
-            sql_result = db_connection.execute(sql)
-            rows = sql_result.fetchall()
-            cols = rows[0].keys() if rows else []
-
-            # Закрыть связь
-            db_connection.dispose()
-            db_connection = None
+            chunk_size = config.get_glob_var('QUERY_CHUNK_SIZE')
+            if chunk_size:
+                # Записи читаются порциями через курсор на стороне сервера
+                # по мере генерации отчета
+                connection = db_connection.connect().execution_options(stream_results=True)
+                try:
+                    sql_result = connection.execute(sql)
+                    cols = list(sql_result.keys())
+                    # Соединение будет закрыто после чтения последней записи
+                    # или в closeQueryTbl
+                    rows = icSQLQueryData(None, connection, sql_result, chunk_size)
+                except:
+                    connection.close()
+                    raise
+            else:
+                sql_result = db_connection.execute(sql)
+                rows = sql_result.fetchall()
+                cols = rows[0].keys() if rows else []
 
             # ТАБЛИЦА ЗАПРОСА ПРЕДСТАВЛЯЕТСЯ В ВИДЕ СЛОВАРЯ
             # {'__fields__':имена полей таблицы,'__data__':данные таблицы} !!!
-            result = {'__fields__': cols, '__data__': list(rows)}
+            result = {'__fields__': cols, '__data__': rows if chunk_size else list(rows)}
             return result
         except:
-            if db_connection:
-                # Закрыть связь
-                db_connection.dispose()
-
             # Вывести сообщение об ошибке в лог
             log.fatal(u'Ошибка определения таблицы SQL запроса <%s>.' % sql)
             log.error(u'''ВНИМАНИЕ! Если возникает ошибка в модуле:
@@ -445,6 +566,16 @@ class icReportGeneratorSystem(object):
 
         return None
 
+    def closeQueryTbl(self, query_tbl):
+        """
+        Закрыть связь с БД таблицы запроса, читаемой порциями.
+        Вызывается после генерации отчета, в том числе прерванной ошибкой.
+
+        :param query_tbl: Словарь таблицы запроса.
+        """
+        if isinstance(query_tbl, dict) and isinstance(query_tbl.get('__data__', None), icSQLQueryData):
+            query_tbl['__data__'].close()
+
     def _isQueryFunc(self, query):
         """
         Определить представлен запрос в виде функции?
@@ -671,11 +802,12 @@ class icReportGeneratorSystem(object):
         """
         return
 
-    def save(self, report_data=None):
+    def save(self, report_data=None, to_filename=None):
         """
         Сохранить результаты генерации в файл
 
         :param report_data: Сгенерированный отчет.
+        :param to_filename: Имя результирующего файла.
         :return: Имя сохраненного файла или None, если сохранения не произошло.
         """
         return None
@@ -11,15 +11,18 @@ import string
 import copy
 import pickle
 import re
+import time
 
 from ic.std.log import log
 from ic.std.convert import xml2dict
 from ic.std.utils import execfunc
 from ic.std.utils import textfunc
+from ic.std.utils import cachefunc
+from ic.virtual_excel import icprototype
 
 from ic.report import icrepgen
 
-__version__ = (0, 1, 1, 2)
+__version__ = (0, 1, 2, 5)
 
 # Константы
 # Теги шаблона
@@ -46,6 +49,15 @@ ALL_TAGS = [DESCRIPTION_TAG, VAR_TAG, GENERATOR_TAG, DATASRC_TAG, QUERY_TAG, STY
 # Заголовочные теги
 TITLE_TAGS = [DESCRIPTION_TAG, VAR_TAG, GENERATOR_TAG, DATASRC_TAG, QUERY_TAG, STYLELIB_TAG]
 
+# Поиск любого тега в значении ячейки
+ALL_TAGS_RE = re.compile('|'.join([re.escape(tag) for tag in ALL_TAGS]))
+
+# Идентификатор стиля по умолчанию
+DEFAULT_STYLE_ID = 'Default'
+
+# Ключи бэндов в структуре шаблона отчета
+BAND_KEYS = ('header', 'footer', 'detail', 'groups', 'upper', 'under')
+
 # ВНИМАНИЕ: Коэффициенты для преобразования ширины и высоты
 # колонок и строк получены экспериментальным путем. М.б. уточнены.
 IC_XL_COEF_WIDTH = 2
@@ -81,6 +93,11 @@ class icReportTemplate:
         # Полное имя исходного файла шаблона
         self.template_filename = None
 
+        # Файлы, которые используются при разборе шаблона
+        # (библиотеки стилей и т.п.). Их изменение делает
+        # скомпилированный шаблон в кеше недействительным.
+        self._depend_files = list()
+
     def setTemplateFilename(self, template_filename):
         """
         Полное имя исходного файла шаблона.
@@ -149,6 +166,75 @@ class icReportTemplate:
         rtp_create_time = os.path.getmtime(pickle_file_name)
         return xml_create_time > rtp_create_time
         
+    def getCacheKey(self, template_filename, template_name=None):
+        """
+        Ключ кеша скомпилированного шаблона.
+        Ключ определяется содержимым файла шаблона,
+        классом шаблона и версиями парсера и генератора.
+
+        :param template_filename: Имя файла шаблона.
+        :param template_name: Имя шаблона (листа).
+        :return: Строка ключа или None, если файл шаблона не найден.
+        """
+        if not os.path.isfile(template_filename):
+            return None
+        return cachefunc.getFileKey(template_filename, self.__class__.__name__,
+                                    __version__, icrepgen.__version__, template_name)
+
+    def getDependKey(self, filename):
+        """
+        Ключ содержимого файла, используемого при разборе шаблона.
+
+        :param filename: Имя файла.
+        :return: Строка ключа или None, если файл не найден.
+        """
+        if not filename or not os.path.isfile(filename):
+            return None
+        return cachefunc.getFileKey(filename)
+
+    def loadCache(self, cache_key):
+        """
+        Загрузить скомпилированный шаблон из кеша.
+        Шаблон считается недействительным, если изменился
+        какой-либо из используемых при его разборе файлов.
+
+        :param cache_key: Ключ кеша.
+        :return: Скомпилированный шаблон или None, если в кеше его нет.
+        """
+        cache = cachefunc.loadCache(cache_key) if cache_key else None
+        if cache is None:
+            return None
+        rep_template, depends = cache
+        for filename, depend_key in depends:
+            if self.getDependKey(filename) != depend_key:
+                log.debug(u'Изменен файл <%s>, используемый шаблоном' % filename)
+                return None
+        return rep_template
+
+    def saveCache(self, cache_key, rep_template):
+        """
+        Сохранить скомпилированный шаблон в кеше
+        вместе с ключами используемых при его разборе файлов.
+
+        :param cache_key: Ключ кеша.
+        :param rep_template: Скомпилированный шаблон.
+        :return: True/False.
+        """
+        depends = [(filename, self.getDependKey(filename)) for filename in self._depend_files]
+        return cachefunc.saveCache(cache_key, (rep_template, depends))
+
+    def precompile(self, rep_template):
+        """
+        Дополнить разобранный шаблон данными, которые иначе
+        вычисляются генератором при каждом запуске.
+
+        :param rep_template: Разобранный шаблон отчета.
+        :return: Скомпилированный шаблон отчета.
+        """
+        if rep_template:
+            rep_template['sum_cells'] = icrepgen.getSumCellIndex(rep_template['sheet'])
+        return rep_template
+
     def read(self, tmpl_filename, template_name=None):
         """
         Прочитать файл шаблона отчета.
@@ -444,30 +530,86 @@ class icExcelXMLReportTemplate(icReportTemplate):
         # Высота строки по умолчанию
         self._default_row_height = 12.75
 
+        # Атрибуты ячеек, определяемые стилями
+        # Словарь {Идентификатор стиля: Атрибуты}
+        self._style_attrs = dict()
+
     def read(self, tmpl_filename, template_name=None):
         """
         Прочитать файл шаблона отчета.
+        Скомпилированный шаблон берется из кеша по хешу содержимого
+        файла шаблона и используемых им файлов (библиотеки стилей).
+        Если в кеше его нет, то шаблон разбирается и сохраняется в кеше.
+        Из кеша каждый раз загружается новая копия шаблона.
 
         :param tmpl_filename: Файл шаблона отчета.
         :param template_name: Имя шаблона (листа).
         """
-        if self.mustRenew(tmpl_filename, template_name):
+        cache_key = self.getCacheKey(tmpl_filename, template_name)
+        self._rep_template = self.loadCache(cache_key)
+        if self._rep_template is None:
             # Надо обновить шаблон
-            template_data = self.open(tmpl_filename)
-            self._rep_template = self.parse(template_data, template_name)
-            self.save(tmpl_filename, template_name)
-        else:
-            # Можно просто загрузить из Pickle файла
-            self.load(tmpl_filename, template_name)
+            template_data = self.open(tmpl_filename, template_name)
+            self._rep_template = self.precompile(self.parse(template_data, template_name))
+            if self._rep_template is not None and cache_key:
+                self.saveCache(cache_key, self._rep_template)
         return self._rep_template
 
-    def open(self, tmpl_filename):
+    def open(self, tmpl_filename, template_name=None):
         """
         Открыть файл шаблона отчета.
+        Загружается только таблица листа шаблона и используемые в нем стили.
+        Таблицы остальных листов не разбираются.
 
         :param tmpl_filename: Файл шаблона отчета.
+        :param template_name: Имя шаблона (листа). Если None, то первый лист.
+        """
+        template_data, lazy_tables = xml2dict.XmlFile2DictLazy(tmpl_filename)
+        if template_data is None:
+            return None
+        worksheet = self._selectWorksheet(template_data, template_name)
+        if worksheet is not None:
+            for table_attrs, lazy_table in lazy_tables:
+                if any([table_attrs is element for element in worksheet['children']]):
+                    table_attrs['children'] = lazy_table.getChildren()
+            self._selectUsedStyles(template_data)
+        return template_data
+
+    def _selectWorksheet(self, template_data, template_name=None):
+        """
+        Оставить в данных шаблона только лист шаблона.
+
+        :param template_data: Словарь описания шаблона.
+        :param template_name: Имя шаблона (листа). Если None, то первый лист.
+        :return: Описание листа шаблона или None, если лист не найден.
+        """
+        workbook = template_data['children'][0]
+        worksheets = [element for element in workbook['children'] if element['name'] == 'Worksheet']
+        if template_name is None:
+            worksheets = worksheets[:1]
+        else:
+            worksheets = [sheet for sheet in worksheets if sheet.get('Name', None) == template_name][:1]
+        if not worksheets:
+            return None
+        workbook['children'] = [element for element in workbook['children']
+                                if element['name'] != 'Worksheet' or element is worksheets[0]]
+        return worksheets[0]
+
+    def _selectUsedStyles(self, template_data):
         """
-        return xml2dict.XmlFile2Dict(tmpl_filename)
+        Оставить в данных шаблона только стили, используемые в листах.
+
+        :param template_data: Словарь описания шаблона.
+        """
+        workbook = template_data['children'][0]
+        style_ids = set([DEFAULT_STYLE_ID])
+        for element in workbook['children']:
+            if element['name'] == 'Worksheet':
+                icprototype.get_style_ids(element, style_ids)
+        for element in workbook['children']:
+            if element['name'] == 'Styles':
+                element['children'] = [style for style in element['children'] if style.get('ID', None) in style_ids]
+        return template_data
 
     def _normList(self, data_list, element_name, length=None):
         """
@@ -548,8 +690,12 @@ class icExcelXMLReportTemplate(icReportTemplate):
         :param template_name: Имя шаблона(листа), если None то первый лист.
         """
         try:
+            start_time = time.time()
             # Создать первоначальный шаблон
             rep = copy.deepcopy(icrepgen.IC_REP_TMPL)
+            # Атрибуты стилей определяются заново для каждого шаблона
+            self._style_attrs = dict()
+            self._depend_files = list()
 
             # 0. Определение основных структур
             workbook = template_data['children'][0]
@@ -585,32 +731,28 @@ class icExcelXMLReportTemplate(icReportTemplate):
             # Количество колонок без колонки тегов бендов
             col_count = self._getColumnCount(rep_template_rows)
             log.debug(u'Количество колонок: %d' % col_count)
+            log.info(u'Колонка тегов бендов [%s]' % str(self._tag_band_col))
 
-            # II. Определить все ячейки листа
-            used_rows = range(len(rep_template_rows))
+            # II. Определить ячейки листа и бэнды шаблона за один проход по строкам
             used_cols = range(col_count)
 
             self.__cur_band = None  # Тег текущего бенда
-            # Перебор по строкам
-            for cur_row in used_rows:
-                if not self._isTitleBand(rep_template_rows, cur_row):
+            title_row = 0   # Счетчик строк колонтитулов/заголовочных бендов
+
+            # Перебор всех строк в шаблоне
+            for cur_row in range(len(rep_template_rows)):
+                tag = self._getTagBandRow(rep_template_rows, cur_row)
+                if tag not in TITLE_TAGS:
                     # Не колонтитулы, добавить ячейки в общий лист
-                    rep['sheet'].append([])
+                    sheet_row = []
                     for cur_col in used_cols:
                         cell_attr = self._getCellAttr(rep_template_rows, rep_template_cols, styles, cur_row, cur_col)
                         if not self._isTag(cell_attr['value']):
-                            rep['sheet'][-1].append(cell_attr)
+                            sheet_row.append(cell_attr)
                         else:
-                            rep['sheet'][-1].append(None)
+                            sheet_row.append(None)
+                    rep['sheet'].append(sheet_row)
 
-            # III. Определить бэнды в шаблоне
-            # Перебрать все ячейки первой колонки
-            self.__cur_band = None  # Тег текущего бенда
-            title_row = 0   # Счетчик строк колонтитулов/заголовочных бендов
-    
-            # Перебор всех строк в шаблоне
-            for cur_row in range(len(rep_template_rows)):
-                tag = self._getTagBandRow(rep_template_rows, cur_row)
                 # Если это ячейка с определенным тегом, значит новый бенд
                 if tag:
                     # Определить текущий бэнд
@@ -645,6 +787,11 @@ class icExcelXMLReportTemplate(icReportTemplate):
                 tmpl_filename = self.getTemplateFilename()
                 rep['generator'] = os.path.splitext(tmpl_filename)[1].upper() if tmpl_filename else '.ODS'
 
+            log.info(u'Разбор шаблона отчета <%s>. Строк: %d. Колонок: %d. Стилей: %d. Время: %.3f сек.' % (template_name,
+                                                                                                      len(rep_template_rows),
+                                                                                                      col_count,
+                                                                                                      len(self._style_attrs),
+                                                                                                      time.time() - start_time))
             return rep
         except:
             log.fatal(u'Ошибка парсинга шаблона отчета <%s>' % textfunc.toUnicode(template_name))
@@ -658,7 +805,6 @@ class icExcelXMLReportTemplate(icReportTemplate):
 
         :return: True - колонка тегов бендов есть в шаблоне / False - нет.
         """
-        log.info(u'Колонка тегов бендов [%s]' % str(self._tag_band_col))
         return self._tag_band_col is not None
 
     def _getColumnCount(self, rows):
@@ -706,7 +852,6 @@ class icExcelXMLReportTemplate(icReportTemplate):
                             value = None
                         if self._isTag(value):
                             tag_col = max(tag_col, col)
-                        log.debug(u'Поиск индекса тега бенда. Ячейка [%d : %d]. Значение <%s>. Колонка тега бенда [%d]' % (row, col, value, tag_col))
             self._tag_band_col = tag_col
         return self._tag_band_col
         
@@ -741,7 +886,11 @@ class icExcelXMLReportTemplate(icReportTemplate):
         if detail['row_size'] == 1:
             ok = any([bool(cell['value']) for cell in report['sheet'][detail['row']]])
             if not ok:
+                # Лист отчета может разделяться с копией отчета для отката
+                # (см. _defBand), поэтому изменяемые строки копируются
+                report['sheet'] = list(report['sheet'])
                 for i_row in range(detail['row'], detail['row'] + detail['row_size']):
+                    report['sheet'][i_row] = copy.deepcopy(report['sheet'][i_row])
                     for i_col in range(detail['col'], detail['col'] + detail['col_size']):
                         try:
                             report['sheet'][i_row][i_col]['value'] = '[\'%s\']' % (self.FIELD_NAMES[i_col - detail['col']])
@@ -761,8 +910,12 @@ class icExcelXMLReportTemplate(icReportTemplate):
         :return: Описание данных отчета.
         """
         try:
-            # Сделать копию данных отчета для возможного отката.
-            rep = copy.deepcopy(report)
+            # Сделать копию бэндов отчета для возможного отката.
+            # Лист отчета копируется только в строках, которые
+            # изменяются при определении бэнда (см. _normDetail).
+            rep = dict(report)
+            for band_key in BAND_KEYS:
+                rep[band_key] = copy.deepcopy(report[band_key])
             
             log.debug(u'Определение бэнда. Тег: <%s>' % band_tag)
             if band_tag.strip() == HEADER_TAG:
@@ -910,6 +1063,29 @@ class icExcelXMLReportTemplate(icReportTemplate):
             log.fatal(u'Ошибка определения стиля ячейки шаблона отчета')
         return styles['Default']
 
+    def _getStyleAttrs(self, style):
+        """
+        Атрибуты ячейки отчета, определяемые стилем.
+            Атрибуты определяются один раз для каждого стиля и
+            разделяются всеми ячейками этого стиля.
+            ВНИМАНИЕ! Поэтому атрибуты ячеек можно только заменять,
+            но не изменять.
+
+        :param style: Описание стиля.
+        :return: Словарь атрибутов border, font, color, align, format.
+        """
+        style_id = style.get('ID', None)
+        style_attrs = self._style_attrs.get(style_id, None)
+        if style_attrs is None:
+            style_attrs = dict(border=self._getBordersStyle(style),
+                               font=self._getFontStyle(style),
+                               color=self._getColorStyle(style),
+                               align=self._getAlignStyle(style),
+                               format=self._getFmtStyle(style))
+            if style_id is not None:
+                self._style_attrs[style_id] = style_attrs
+        return style_attrs
+
     def _getTypeCell(self, cell):
         """
         Определить тип ячейки.
@@ -1022,20 +1198,8 @@ class icExcelXMLReportTemplate(icReportTemplate):
             # Видимость ячейки
             cell['visible'] = True
     
-            # Обрамление
-            cell['border'] = self._getBordersStyle(cell_style)
-            
-            # Шрифт
-            cell['font'] = self._getFontStyle(cell_style)
-    
-            # Установить цвет текста и фона
-            cell['color'] = self._getColorStyle(cell_style)
-    
-            # Размещение
-            cell['align'] = self._getAlignStyle(cell_style)
-    
-            # Формат вывода текста
-            cell['format'] = self._getFmtStyle(cell_style)
+            # Обрамление, шрифт, цвет текста и фона, размещение и формат вывода текста
+            cell.update(self._getStyleAttrs(cell_style))
             # Генерация текста ячейки
             # Перенести все ячейки из шаблона в выходной отчет
             if template_cell:
@@ -1062,10 +1226,7 @@ class icExcelXMLReportTemplate(icReportTemplate):
         if not value:
             return False
         # Если хотя бы 1 тег есть в ячейке, то все ок
-        for tag in ALL_TAGS:
-            if value.find(tag) != -1:
-                return True
-        return False
+        return ALL_TAGS_RE.search(value) is not None
 
     def _getTagBandRow(self, rows, row):
         """
@@ -1259,6 +1420,7 @@ class icExcelXMLReportTemplate(icReportTemplate):
         try:
             from . import icstylelib
             xml_style_lib_file_name = parse_row[0]['children'][0]['value']
+            self._depend_files.append(xml_style_lib_file_name)
             report['style_lib'] = icstylelib.icXMLRepStyleLib().convert(xml_style_lib_file_name)
         except:
             log.fatal(u'Ошибка в функции _parseStyleLibTag')
@@ -1286,16 +1448,17 @@ class icODSReportTemplate(icExcelXMLReportTemplate):
         """
         icExcelXMLReportTemplate.__init__(self)
 
-    def open(self, tmpl_filename):
+    def open(self, tmpl_filename, template_name=None):
         """
         Открыть файл шаблона отчета.
+        Загружается только лист шаблона и используемые в нем стили.
+        Загруженная книга неполная, поэтому в файл она не сохраняется.
 
         :param tmpl_filename: Файл шаблона отчета.
+        :param template_name: Имя шаблона (листа). Если None, то первый лист.
         """
         v_excel = icexcel.icVExcel()
-        result = v_excel.load(tmpl_filename)
-        v_excel.saveAsXML(tmpl_filename.replace('.ods', '.xml'))
-        return result
+        return v_excel.loadODS(tmpl_filename, sheet_name=template_name, sheet_limit=1, used_styles_only=True)
 
 
 class icXLSReportTemplate(icODSReportTemplate):
@@ -1309,11 +1472,12 @@ class icXLSReportTemplate(icODSReportTemplate):
         """
         icODSReportTemplate.__init__(self)
 
-    def open(self, tmpl_filename):
+    def open(self, tmpl_filename, template_name=None):
         """
         Открыть файл шаблона отчета.
 
         :param tmpl_filename: Файл шаблона отчета.
+        :param template_name: Имя шаблона (листа). Если None, то первый лист.
         """
         try:
             ods_filename = os.path.splitext(tmpl_filename)[0] + '.ods'
@@ -1321,7 +1485,7 @@ class icXLSReportTemplate(icODSReportTemplate):
             log.info(u'Выполнение комманды ОС <%s>' % cmd)
             os.system(cmd)
 
-            return icODSReportTemplate.open(self, ods_filename)
+            return icODSReportTemplate.open(self, ods_filename, template_name)
         except:
             log.fatal(u'Ошибка открытия файла шаблона <%s>' % tmpl_filename)
         return None
@@ -221,7 +221,7 @@ class icRTFReportGeneratorSystem(icrepgensystem.icReportGeneratorSystem):
             #    '__tables__':[
             #        {
             #        '__fields__':(('имя поля1'),...), #Поля
-            #        '__data__':[(значение поля1,...)], #Данные
+            #        '__data__':[(значение поля1,...)], #Данные (список или итерируемый объект строк)
             #        },...
             #        ],
             #    #Циклы генерации
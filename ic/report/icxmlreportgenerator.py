@@ -215,6 +215,7 @@ class icXMLReportGeneratorSystem(icrepgensystem.icReportGeneratorSystem):
         :param report: Шаблон отчета.
         :return: Возвращает сгенерированный отчет или None в случае ошибки.
         """
+        query_tbl = None
         try:
             if report is not None:
                 self._Rep = report
@@ -243,4 +244,7 @@ class icXMLReportGeneratorSystem(icrepgensystem.icReportGeneratorSystem):
         except:
             # Вывести сообщение об ошибке в лог
             log.fatal(u'Ошибка генерации отчета <%s>.' % self._Rep['name'])
+        finally:
+            # Закрыть связь с БД таблицы запроса, читаемой порциями
+            self.closeQueryTbl(query_tbl)
         return None
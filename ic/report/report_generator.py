@@ -15,7 +15,7 @@ from ic.report import icxlsreportgenerator
 # from ic.report import icreportmangenerator
 from ic.report import icrtfreportgenerator
 
-__version__ = (0, 1, 1, 2)
+__version__ = (0, 1, 1, 3)
 
 # Константы подсистемы
 REP_GEN_SYS = None
@@ -31,6 +31,12 @@ _ReportGeneratorSystemTypes = {'.xml': icxmlreportgenerator.icXMLReportGenerator
 # Список расширений источников шаблонов
 SRC_REPORT_EXT = _ReportGeneratorSystemTypes.keys()
 
+# Расширения результирующих файлов систем генерации,
+# которые могут сохранить отчет в указанный файл (save(..., to_filename=...))
+_ReportResultExt = {'.ods': '.ods',
+                    '.xls': '.xls',
+                    }
+
 
 # Функции управления
 def getReportGeneratorSystem(rep_filename, parent=None, bRefresh=True):
@@ -45,7 +51,7 @@ def getReportGeneratorSystem(rep_filename, parent=None, bRefresh=True):
     """
     try:
         # Прочитать шаблон отчета
-        rep = resfunc.loadResourceFile(rep_filename, bRefresh=True)
+        rep = resfunc.loadResourceFile(rep_filename, bRefresh=bRefresh)
         
         global REP_GEN_SYS
 
@@ -99,6 +105,19 @@ def createReportGeneratorSystem(repgen_sys_type, report=None, parent=None):
     return rep_gen_sys
 
 
+def getReportResultExt(repgen_sys_type):
+    """
+    Расширение результирующего файла системы генерации отчетов.
+
+    :param repgen_sys_type: Указание типа системы генерации отчетов.
+        Тип задается расширением файла источника шаблона.
+    :return: Расширение результирующего файла или None,
+        если система генерации не сохраняет отчет в указанный файл.
+    """
+    rep_gen_sys_type = repgen_sys_type[-4:].lower() if isinstance(repgen_sys_type, str) else None
+    return _ReportResultExt.get(rep_gen_sys_type, None)
+
+
 def getCurReportGeneratorSystem(report_browser_dialog=None):
     """
     Возвратить текущую систему генерации.
@@ -3,11 +3,37 @@
 
 """
 Заполнение rtf шаблона.
+
+Шаблон один раз разбирается в дерево узлов (текст, переменная,
+таблица, цикл), которое затем заполняется данными.
+Результат собирается из частей, без перестроения всего текста
+при каждой замене. Скомпилированные шаблоны файлов кешируются.
+
+Данные таблиц (__data__) могут быть любым итерируемым объектом
+(например генератором или курсором запроса). При генерации отчета
+в файл строки таблиц записываются в файл по мере заполнения.
+Данные таблиц, которые разделяются элементами циклов, перед
+генерацией циклов сохраняются в списки.
 """
 
+import os
+import os.path
 import copy
 
-__version__ = (0, 1, 1, 2)
+__version__ = (0, 1, 2, 3)
+
+# Типы узлов скомпилированного шаблона.
+# Текстовый узел представляется просто строкой
+RTF_VAR_NODE = 'var'
+RTF_TABLE_NODE = 'table'
+RTF_LOOP_NODE = 'loop'
+
+# Размер буфера записи файла отчета
+WRITE_BUFFER_SIZE = 2 ** 20
+
+# Кеш скомпилированных шаблонов файлов
+# Словарь {Полное имя файла шаблона: (время изменения, размер, дерево шаблона)}
+_RTF_TEMPLATE_CACHE = dict()
 
 tblDct = {'__fields__': (('n_lot',), ('predmet_lot',), ('cena_lot',)),
           '__name__': 'P1',
@@ -192,22 +218,141 @@ repTest = '''
 '''
 
 
-def _gen_table(table, templ):
+def _strip_groups(templ):
     """
-    Генерирует таблицу по шаблону и табличным данным.
+    Убрать из шаблона блока первую и последнюю неполные группы.
+    """
+    n = templ.find('}')
+    # Убираем первую группу из шаблона
+    if n != -1:
+        templ = templ[n+1:]
+
+    n = templ.rfind('{')
+    # Убираем последнюю группу из шаблона
+    if n != -1:
+        templ = templ[:n]
+    return templ
+
+
+def compile_rtf(rep):
+    """
+    Разобрать шаблон в дерево узлов.
+
+    :type rep: C{string}
+    :param rep: Шаблон.
+    :rtype: C{list}
+    :return: Список узлов. Узел - строка текста или кортеж:
+        (RTF_VAR_NODE, имя переменной),
+        (RTF_TABLE_NODE, имя таблицы, дерево шаблона строки),
+        (RTF_LOOP_NODE, имя цикла, дерево шаблона элемента цикла, исходный текст цикла).
+        Не закрытые таблицы и циклы, а также непарные теги
+        их окончания остаются в тексте как есть.
+    """
+    tree = []
+    # Начало текста, еще не добавленного в дерево
+    last = 0
+    # Открытый блок: (тип, начало тега, конец тега, имя)
+    block = None
+    p2 = -1
+
+    while 1:
+        p1, p2, var = findNextVar(rep, p2+1)
+
+        if not var:
+            break
+
+        if block is None:
+            if var[:2] == 'D1':
+                block = (RTF_TABLE_NODE, p1, p2, var[3:])
+            elif var[:4] == 'LOOP':
+                block = (RTF_LOOP_NODE, p1, p2, var[5:])
+            elif var[:7] != 'ENDLOOP' and var != '1D':
+                # Переменная
+                if p1 > last:
+                    tree.append(rep[last:p1])
+                tree.append((RTF_VAR_NODE, var))
+                last = p2 + 1
+
+        elif block[0] == RTF_TABLE_NODE:
+            if var[:2] == 'D1':
+                # Начало другой таблицы
+                block = (RTF_TABLE_NODE, p1, p2, var[3:])
+            elif var == '1D':
+                node_type, beg_tag, end_tag, name = block
+                if beg_tag > last:
+                    tree.append(rep[last:beg_tag])
+                tree.append((RTF_TABLE_NODE, name, compile_rtf(_strip_groups(rep[end_tag+2:p1]))))
+                last = p2 + 1
+                block = None
+
+        elif var[:7] == 'ENDLOOP' and var[8:] == block[3]:
+            node_type, beg_tag, end_tag, name = block
+            if beg_tag > last:
+                tree.append(rep[last:beg_tag])
+            tree.append((RTF_LOOP_NODE, name, compile_rtf(_strip_groups(rep[end_tag+2:p1])), rep[beg_tag:p2+1]))
+            last = p2 + 1
+            block = None
+
+    if last < len(rep):
+        tree.append(rep[last:])
+    return tree
+
+
+def get_rtf_template(tmpl_filename):
+    """
+    Скомпилированный шаблон файла.
+    Шаблон компилируется заново только при изменении файла.
+
+    :param tmpl_filename: Имя файла шаблона.
+    :return: Дерево шаблона.
     """
-    txt = ''
+    tmpl_filename = os.path.abspath(tmpl_filename)
+    stat = os.stat(tmpl_filename)
+    cache = _RTF_TEMPLATE_CACHE.get(tmpl_filename, None)
+    if cache and cache[0] == stat.st_mtime and cache[1] == stat.st_size:
+        return cache[2]
+
+    f = open(tmpl_filename, 'rt')
+    rep = f.read()
+    f.close()
+
+    tree = compile_rtf(rep)
+    _RTF_TEMPLATE_CACHE[tmpl_filename] = (stat.st_mtime, stat.st_size, tree)
+    return tree
+
+
+def _render_table(table, tree, write):
+    """
+    Заполнить таблицу по дереву шаблона строки и табличным данным.
+    Каждая строка выводится сразу после заполнения.
+    """
+    fields = [col[0] for col in table['__fields__']]
     for r in table['__data__']:
         replDct = {}
-        for indx, col in enumerate(table['__fields__']):
-            replDct[col[0]] = str(r[indx])
-            
-        txt += parse_rtf(None, templ, replDct)
+        for indx, field in enumerate(fields):
+            replDct[field] = str(r[indx])
+
+        render_rtf(None, tree, write, replDct)
+
 
-    return txt
+def _gen_table(table, templ, write=None):
+    """
+    Генерирует таблицу по шаблону и табличным данным.
+
+    :param write: Функция вывода строк таблицы.
+        Если не определена, то возвращается текст таблицы.
+    """
+    if isinstance(templ, str):
+        templ = compile_rtf(templ)
+    if write is not None:
+        _render_table(table, templ, write)
+        return ''
+    txt = []
+    _render_table(table, templ, txt.append)
+    return ''.join(txt)
 
 
-def doTableByName(data, templ, name):
+def doTableByName(data, templ, name, write=None):
     """
     Генерация по имени таблицы.
     """
@@ -215,169 +360,146 @@ def doTableByName(data, templ, name):
     
     for tbl in data['__tables__']:
         if tbl['__name__'] == name:
-            return _gen_table(tbl, templ)
+            return _gen_table(tbl, templ, write)
 
     return ''
 
 
-def doTableByIdx(data, templ, idx):
+def doTableByIdx(data, templ, idx, write=None):
     """
     Генерация по индексу таблицы.
     """
     if len(data['__tables__']) > idx:
         tbl = data['__tables__'][idx]
-        return _gen_table(tbl, templ)
+        return _gen_table(tbl, templ, write)
 
     return ''
 
 
-def parse_rtf(data, rep, replace_dict=None, idx_loop=None, idx_key=None):
+def _materialize_tables(tables):
+    """
+    Сохранить в списки данные таблиц, заданные однократно
+    итерируемыми объектами (генераторами, курсорами).
+    Таблицы родительских данных разделяются всеми элементами цикла
+    и перебираются несколько раз.
+
+    :param tables: Список таблиц.
+    """
+    for tbl in tables:
+        if '__data__' in tbl and not isinstance(tbl['__data__'], (list, tuple)):
+            tbl['__data__'] = list(tbl['__data__'])
+
+
+def render_rtf(data, tree, write, replace_dict=None, idx_key=None):
     """
+    Заполнить дерево шаблона данными.
+
+    :param data: Данные отчета.
+    :param tree: Дерево шаблона (см. compile_rtf).
+    :param write: Функция вывода текста.
+    :param replace_dict: Словарь значений переменных.
+        Если не определен, то берутся переменные данных.
+    :param idx_key: Ключ индекса. Если определен, то в первую очередь
+        ищутся переменные и таблицы с именами <имя>_<ключ>.
     """
-    p2 = 0
-        
     if not replace_dict:
         replace_dict = data['__variables__']
 
     if data and '__tables__' not in data:
         data['__tables__'] = []
-        
-    bTableBeg = False
-    tBegTag = 0
-    tEndTag = 0
-    tName = None
-    
-    bLoopBeg = False
-    lBegTag = 0
-    lEndTag = 0
-    lName = None
+
+    if data and data['__tables__'] and data.get('__loop__', None):
+        if any([not isinstance(node, str) and node[0] == RTF_LOOP_NODE for node in tree]):
+            _materialize_tables(data['__tables__'])
 
     indx = 0
-    
-    if idx_loop and idx_key:
-        varKey = '%s_%s' % (idx_loop, idx_key)
-    else:
-        varKey = ''
-    
-    # --- Разбираем шаблон
-    while 1:
-        p1, p2, var = findNextVar(rep, p2+1)
-    
-        if not var:
-            break
-            
-        if var[:2] == 'D1' and not bLoopBeg:
-            bTableBeg = True
-            tBegTag = p1
-            tEndTag = p2
-            
-            if varKey:
-                tName = var[3:] +'_' + idx_key
+
+    for node in tree:
+        if isinstance(node, str):
+            write(node)
+
+        elif node[0] == RTF_VAR_NODE:
+            var = node[1]
+            if idx_key:
+                v = var+'_'+str(idx_key)
+                if v not in replace_dict:
+                    v = var
             else:
-                tName = var[3:]
+                v = var
 
-        elif var[:4] == 'LOOP' and not bLoopBeg:
-            bLoopBeg = True
-            lBegTag = p1
-            lEndTag = p2
-            lName = var[5:]
+            if v in replace_dict:
+                write(str(replace_dict[v]).replace('\n', '\\line '))
+
+        elif node[0] == RTF_TABLE_NODE:
+            if idx_key:
+                tName = node[1] + '_' + idx_key
+            else:
+                tName = node[1]
 
-        elif var[:7] == 'ENDLOOP':
-            loop_name = var[8:]
-            
-            if loop_name == lName:
-                # Выделяем повторяющуюся часть
-                templ = rep[lEndTag+2:p1]
-                txt = ''
-                
-                n = templ.find('}')
-                # Убираем первую группу из шаблона
-                if n != -1:
-                    templ = templ[n+1:]
-                
-                n = templ.rfind('{')
-                # Убираем последнюю группу из шаблона
-                if n != -1:
-                    templ = templ[:n]
-
-                lst = getLoopList(data, lName)
-                txt = ''
-                if lst:
-                    for sp in lst:
-                        txt += parse_rtf(sp, templ)
-                else:
-                    # Если список не определен просто запустить генерацию
-                    # чтобы стереть все теги из текста
-                    txt += parse_rtf({'__variables__': {}}, templ)
-                    
-                # Вставляем текст
-                if txt:
-                    rep = rep[:lBegTag] + txt + rep[p2+1:]
-                    p2 = lBegTag + 1
-                    
-                bLoopBeg = False
-        
-        elif var == '1D' and not bLoopBeg:
-            # Выделяем табличную часть
-            templ = rep[tEndTag+2:p1]
-            txt = ''
-            
-            n = templ.find('}')
-            # Убираем первую группу из шаблона
-            if n != -1:
-                templ = templ[n+1:]
-            
-            n = templ.rfind('{')
-            # Убираем последнюю группу из шаблона
-            if n != -1:
-                templ = templ[:n]
-            
             # Генерируем таблицу
             if tName:
-                txt = doTableByName(data, templ, tName)
+                doTableByName(data, node[2], tName, write)
             else:
-                txt = doTableByIdx(data, templ, indx)
+                doTableByIdx(data, node[2], indx, write)
                 indx += 1
 
-            # Вставляем таблицу
-            rep = rep[:tBegTag] + txt + rep[p2+1:]
-            p2 = tBegTag + 1
-            bTableBeg = False
+        else:
+            # Признак вывода текста цикла
+            is_write = []
 
-        #   Вставляем переменные
-        elif not bTableBeg and not bLoopBeg:
-            
-            if varKey:
-                v = var+'_'+str(idx_key)
-                if v not in replace_dict.keys():
-                    v = var
-            else:
-                v = var
-                
-            if v in replace_dict.keys():
-                replTxt = str(replace_dict[v]).replace('\n', '\line ')
-                rep = rep[:p1] + replTxt + rep[p2+1:]
-                p2 = p1 + len(str(replace_dict[v])) + 1
+            def write_loop(txt):
+                if txt:
+                    is_write.append(True)
+                    write(txt)
+
+            lst = getLoopList(data, node[1])
+            if lst:
+                for sp in lst:
+                    render_rtf(sp, node[2], write_loop)
             else:
-                rep = rep[:p1] + rep[p2+1:]
-                p2 = p1 + 1
-    
-    return rep
+                # Если список не определен просто запустить генерацию
+                # чтобы стереть все теги из текста
+                render_rtf({'__variables__': {}}, node[2], write_loop)
+
+            # Если текста цикла нет, то цикл остается в тексте как есть
+            if not is_write:
+                write(node[3])
+
+
+def parse_rtf(data, rep, replace_dict=None, idx_loop=None, idx_key=None):
+    """
+    Заполнить шаблон данными.
+
+    :param data: Данные отчета.
+    :param rep: Шаблон.
+    :param replace_dict: Словарь значений переменных.
+    :return: Заполненный шаблон.
+    """
+    txt = []
+    render_rtf(data, compile_rtf(rep), txt.append, replace_dict,
+               idx_key if idx_loop and idx_key else None)
+    return ''.join(txt)
 
 
 def genRTFReport(data, rep_filename, tmpl_filename):
     """
     Создает rtf отчет по шаблону.
+    Текст отчета записывается в файл по мере заполнения шаблона,
+    поэтому полный текст отчета в памяти не строится.
+    Запись производится во временный файл той же папки, который
+    переименовывается только после успешной генерации.
     """
-    f = open(tmpl_filename, 'rt')
-    rep = f.read()
-    f.close()
-
-    rep = parse_rtf(data, rep)
-    
-    f = open(rep_filename, 'wt')
-    f.write(rep)
-    f.close()
+    tree = get_rtf_template(tmpl_filename)
+
+    tmp_filename = '%s.%d.tmp' % (rep_filename, os.getpid())
+    try:
+        with open(tmp_filename, 'wt', buffering=WRITE_BUFFER_SIZE) as f:
+            render_rtf(data, tree, f.write)
+        os.replace(tmp_filename, rep_filename)
+        tmp_filename = None
+    finally:
+        if tmp_filename and os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
 
 
 def test():
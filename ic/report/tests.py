@@ -0,0 +1,503 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Модуль тестов генератора отчетов.
+"""
+
+import copy
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from ic import config
+from ic.virtual_excel import icods
+from . import icrepgen
+from . import icrepfile
+from . import icodsrepfile
+from . import icreptemplate
+from . import rtf_report
+
+try:
+    import sqlalchemy
+    from . import icrepgensystem
+except ImportError:
+    # Для работы с БД необходимы SQLAlchemy и wxPython
+    icrepgensystem = None
+
+__version__ = (0, 1, 1, 2)
+
+
+def _cell(value):
+    """
+    Ячейка шаблона отчета.
+
+    :param value: Значение ячейки.
+    """
+    return {'merge_row': 1, 'merge_col': 1, 'width': 20.0, 'height': 12.75, 'visible': True,
+            'border': ({'style': 0, 'weight': 1}, None, None, None),
+            'font': {'name': 'Arial', 'size': 10, 'style': 'regular'},
+            'color': {'text': (0, 0, 0), 'background': None},
+            'align': {'align_txt': (0, 4), 'wrap_txt': False},
+            'format': None, 'value': value, 'sum': None}
+
+
+def _band(row):
+    """
+    Бэнд шаблона отчета из одной строки.
+
+    :param row: Номер строки.
+    """
+    return {'row': row, 'col': 0, 'row_size': 1, 'col_size': 3}
+
+
+def _groupTemplate():
+    """
+    Шаблон отчета с группой по полю g.
+    """
+    sheet = [[_cell('Report [&title&]'), _cell('[#1+2#]'), _cell(None)],
+             [_cell('Group [\'g\']'), _cell(None), _cell(None)],
+             [_cell('[^N^]'), _cell('[\'name\']'), _cell('[\'amt\']')],
+             [_cell('Sum [^SUM({amt})^]'), _cell(None), _cell(None)],
+             [_cell('Total [^SUM({amt})^]'), _cell(None), _cell(None)]]
+    return {'name': 'test', 'description': '', 'variables': {'title': 'T'}, 'generator': '.ODS',
+            'data_source': None, 'query': None, 'style_lib': None,
+            'header': _band(0), 'detail': _band(2), 'footer': _band(4),
+            'groups': [{'header': _band(1), 'footer': _band(3), 'field': 'g', 'old_rec': None}],
+            'upper': {}, 'under': {}, 'sheet': sheet, 'args': {},
+            'page_setup': copy.deepcopy(icrepgen.IC_REP_PAGESETUP)}
+
+
+def _queryTbl(count=5):
+    """
+    Таблица запроса.
+
+    :param count: Количество записей.
+    """
+    return {'__fields__': ('g', 'name', 'amt'),
+            '__data__': [('A' if i < 2 else 'B', 'n%d' % i, i) for i in range(count)]}
+
+
+def _values(rep):
+    """
+    Значения ячеек листа отчета.
+    """
+    return [[cell['value'] if cell else None for cell in row] for row in rep['sheet']]
+
+
+class icReportGeneratorTests(unittest.TestCase):
+    """
+    Тесты генератора отчетов.
+    """
+    def test_group_empty_query(self):
+        """
+        Генерация отчета с группами по пустой таблице запроса.
+        Выводятся только заголовок и примечание отчета.
+        """
+        for sort_groups in (False, True):
+            rep = icrepgen.icReportGenerator().generate(_groupTemplate(), {'__fields__': (), '__data__': []},
+                                                        sort_groups=sort_groups)
+            self.assertIsNotNone(rep)
+            self.assertEqual(_values(rep), [['Report T', '3', ''], ['Total 0', '', '']])
+
+    def test_group(self):
+        """
+        Генерация отчета с группами.
+        """
+        rep = icrepgen.icReportGenerator().generate(_groupTemplate(), _queryTbl())
+        self.assertEqual([row[0] for row in _values(rep)],
+                         ['Report T', 'Group A', '1', '2', 'Sum 1.0', 'Group B', '3', '4', '5', 'Sum 9.0', 'Total 10.0'])
+
+    def test_cell_program_cache(self):
+        """
+        Кешируются только программы значений ячеек шаблона.
+        Значения из данных и покоординатные замены не кешируются.
+        """
+        generator = icrepgen.icReportGenerator()
+        template = _groupTemplate()
+        texts = set(cell['value'] for row in template['sheet'] for cell in row)
+        for prefix in ('x', 'y'):
+            query_tbl = {'__fields__': ('g', 'name', 'amt'),
+                         '__data__': [('A', '%s[%d]' % (prefix, i), i) for i in range(50)]}
+            coord_fill = {(3, 1): '%s[#1+1#]' % prefix}
+            rep = generator.generate(_groupTemplate(), query_tbl, coord_fill=coord_fill)
+            self.assertEqual(_values(rep)[3][1], prefix + '2')
+            self.assertEqual(set(generator._cellProg.keys()), texts)
+
+
+class icReportTemplateCacheTests(unittest.TestCase):
+    """
+    Тесты кеша скомпилированных шаблонов.
+    """
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        self.cache_path = config.get_glob_var('CACHE_PATH')
+        config.set_glob_var('CACHE_PATH', os.path.join(self.tmp_path, 'cache'))
+
+    def tearDown(self):
+        config.set_glob_var('CACHE_PATH', self.cache_path)
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+    def _writeStyleLibTemplate(self):
+        """
+        Записать шаблон, ссылающийся на библиотеку стилей.
+
+        :return: Имя файла шаблона, имя файла библиотеки стилей.
+        """
+        src_filename = os.path.join(os.path.dirname(__file__), 'new_report_template.xml')
+        with open(src_filename, encoding='utf-8') as src_file:
+            src = src_file.read()
+        style_lib_filename = os.path.join(self.tmp_path, 'style_lib.xml')
+        with open(style_lib_filename, 'w', encoding='utf-8') as style_lib_file:
+            style_lib_file.write(src)
+        # Строку источника данных заменить на строку библиотеки стилей
+        empty_cell = '    <Cell ss:StyleID="s23"><NamedCell ss:Name="Print_Area"/></Cell>\n'
+        old_row = empty_cell * 5 + '    <Cell ss:StyleID="s24"><Data ss:Type="String">[data_source]</Data>'
+        self.assertIn(old_row, src)
+        new_row = '    <Cell ss:StyleID="s23"><Data ss:Type="String">%s</Data></Cell>\n' % style_lib_filename
+        new_row += empty_cell * 4 + '    <Cell ss:StyleID="s24"><Data ss:Type="String">[style_lib]</Data>'
+        src = src.replace(old_row, new_row)
+        tmpl_filename = os.path.join(self.tmp_path, 'template.xml')
+        with open(tmpl_filename, 'w', encoding='utf-8') as tmpl_file:
+            tmpl_file.write(src)
+        return tmpl_filename, style_lib_filename
+
+    def test_style_lib_changed(self):
+        """
+        Изменение библиотеки стилей делает шаблон в кеше недействительным.
+        """
+        tmpl_filename, style_lib_filename = self._writeStyleLibTemplate()
+        template = icreptemplate.icExcelXMLReportTemplate()
+        rep = template.read(tmpl_filename)
+        self.assertIsNotNone(rep)
+        cache_key = template.getCacheKey(tmpl_filename)
+        self.assertIsNotNone(template.loadCache(cache_key))
+
+        with open(style_lib_filename, 'a', encoding='utf-8') as style_lib_file:
+            style_lib_file.write('\n<!-- changed -->\n')
+        self.assertIsNone(template.loadCache(cache_key))
+        # Шаблон разбирается заново и кеш обновляется
+        self.assertIsNotNone(icreptemplate.icExcelXMLReportTemplate().read(tmpl_filename))
+        self.assertIsNotNone(template.loadCache(cache_key))
+
+
+class icReportTemplateParseTests(unittest.TestCase):
+    """
+    Тесты разбора шаблона.
+    """
+    def test_def_band_rollback(self):
+        """
+        При ошибке определения бэнда лист отчета не изменяется.
+        """
+        template = icreptemplate.icExcelXMLReportTemplate()
+        report = _groupTemplate()
+        report['sheet'][2] = [_cell(None), _cell(None), _cell(None)]
+        report['detail'] = {}
+        # Лист шаблона не определен, поэтому определение бэнда завершается ошибкой
+        rep = template._defBand(icreptemplate.DETAIL_TAG, 2, 3, 0, report)
+        self.assertIs(rep, report)
+        self.assertEqual([cell['value'] for cell in report['sheet'][2]], [None, None, None])
+
+    @unittest.skipIf(getattr(icods, 'odf', None) is None, 'ODFpy is not installed')
+    def test_ods_open(self):
+        """
+        Открытие ODS шаблона не перезаписывает XML файл рядом с ним.
+        """
+        tmp_path = tempfile.mkdtemp()
+        try:
+            tmpl_filename = os.path.join(tmp_path, 'template.ods')
+            shutil.copyfile(os.path.join(os.path.dirname(__file__), 'new_report_template.ods'), tmpl_filename)
+            xml_filename = os.path.join(tmp_path, 'template.xml')
+            with open(xml_filename, 'wt') as xml_file:
+                xml_file.write('<Workbook/>')
+
+            data = icreptemplate.icODSReportTemplate().open(tmpl_filename)
+            self.assertIsNotNone(data)
+            self.assertEqual(sorted(os.listdir(tmp_path)), ['template.ods', 'template.xml'])
+            with open(xml_filename, 'rt') as xml_file:
+                self.assertEqual(xml_file.read(), '<Workbook/>')
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+# Шаблон RTF отчета с циклом и таблицей
+RTF_LOOP_TEMPLATE = 'A #LOOP_L# {x}  j=#J#  {t} #D1_P1# {r} n=#n# {e} #1D# {y}  #ENDLOOP_L# Z'
+
+
+# Шаблон RTF отчета с переменными, вложенными в цикл таблицами и пустым циклом
+RTF_SAMPLE_TEMPLATE = ('{\\rtf1\\ansi {\\b #name_torg#} \\par #form_torg# \\par #izveschen_url#  #unknown# \\par\n'
+                       '#LOOP_L# {\\pard} {\\i #VAR_L#} \\par '
+                       '#D1_P1# {\\trowd} #n_lot# | #predmet_lot# | #cena_lot# {\\row} #1D#  '
+                       '#D1_P2# {\\trowd} #n_lot#: #cena_lot# {\\row} #1D# {\\pard}  #ENDLOOP_L# \\par\n'
+                       '#LOOP_I# {\\pard} i=#I#  #VAR_LG# {\\pard}  #ENDLOOP_I# \\par '
+                       '#LOOP_X# {\\pard} x #ENDLOOP_X#  #VAR_LG#}')
+
+# Результат заполнения RTF_SAMPLE_TEMPLATE данными rtf_report.DataDct
+# прежним движком последовательной замены тегов в тексте шаблона
+RTF_SAMPLE_REPORT = ('{\\rtf1\\ansi {\\b Имя торгов} \\par Тип торгов\\line hjkfdshjkhjksfadhlkhfsa\\line '
+                     'sfdjhjkhfajkhfjdskhfhks\\line     GGGGGGGGGGGGGGGGGg\\line  \\par www.abakan.ru   \\par\n'
+                     ' {\\i Слот 1} \\par  1 | лот 1.1 | 200.0  2 | лот 1.2 | 210.0  3 | лот 1.3 | 220.0  '
+                     '4 | лот 1.4 | 300.0    1: 500.0  2: 510.0  3: 520.0   '
+                     '{\\i Слот 2} \\par  1 | лот 3.1 | 200.0  2 | лот 3.2 | 210.0  3 | лот 3.3 | 220.0  '
+                     '4 | лот 3.4 | 300.0    1: 500.0  2: 510.0  3: 520.0   \\par\n'
+                     ' i=1  Общий текст  i=2  Общий текст  i=3  Общий текст  \\par  x   Общий текст}')
+
+def _rtfLoopData(rows):
+    """
+    Данные RTF отчета с таблицей, разделяемой элементами цикла.
+
+    :param rows: Данные таблицы.
+    """
+    return {'__variables__': {},
+            '__tables__': [{'__name__': 'P1', '__fields__': (('n',),), '__data__': rows}],
+            '__loop__': {'L': [{'__variables__': {'J': 1}}, {'__variables__': {'J': 2}}]}}
+
+
+class icRTFReportTests(unittest.TestCase):
+    """
+    Тесты генерации RTF отчета.
+    """
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+    def test_loop_iterator_table(self):
+        """
+        Таблица, заданная генератором, выводится в каждом элементе цикла.
+        """
+        expected = rtf_report.parse_rtf(_rtfLoopData([(1,), (2,)]), RTF_LOOP_TEMPLATE)
+        self.assertEqual(expected.count('n=1'), 2)
+        result = rtf_report.parse_rtf(_rtfLoopData((row for row in [(1,), (2,)])), RTF_LOOP_TEMPLATE)
+        self.assertEqual(result, expected)
+
+    def test_old_substitution(self):
+        """
+        Разбор шаблона в дерево и его заполнение дают тот же текст, что и прежний движок замены тегов.
+        """
+        self.assertEqual(rtf_report.parse_rtf(copy.deepcopy(rtf_report.DataDct), RTF_SAMPLE_TEMPLATE),
+                         RTF_SAMPLE_REPORT)
+
+        tree = rtf_report.compile_rtf(RTF_SAMPLE_TEMPLATE)
+        for i in range(2):
+            # Дерево шаблона не изменяется при заполнении и может использоваться повторно
+            result = list()
+            rtf_report.render_rtf(copy.deepcopy(rtf_report.DataDct), tree, result.append)
+            self.assertEqual(''.join(result), RTF_SAMPLE_REPORT)
+
+        tmpl_filename = os.path.join(self.tmp_path, 'template.rtf')
+        with open(tmpl_filename, 'wt') as tmpl_file:
+            tmpl_file.write(RTF_SAMPLE_TEMPLATE)
+        rep_filename = os.path.join(self.tmp_path, 'report.rtf')
+        rtf_report.genRTFReport(copy.deepcopy(rtf_report.DataDct), rep_filename, tmpl_filename)
+        with open(rep_filename, 'rt') as rep_file:
+            self.assertEqual(rep_file.read(), RTF_SAMPLE_REPORT)
+
+    def test_error_removes_partial_file(self):
+        """
+        При ошибке генерации файл отчета не создается.
+        """
+        tmpl_filename = os.path.join(self.tmp_path, 'template.rtf')
+        with open(tmpl_filename, 'wt') as tmpl_file:
+            tmpl_file.write(RTF_LOOP_TEMPLATE)
+        rep_filename = os.path.join(self.tmp_path, 'report.rtf')
+
+        def rows():
+            yield (1,)
+            raise ValueError('Query error')
+
+        self.assertRaises(ValueError, rtf_report.genRTFReport, _rtfLoopData(rows()), rep_filename, tmpl_filename)
+        self.assertEqual(os.listdir(self.tmp_path), ['template.rtf'])
+
+        rtf_report.genRTFReport(_rtfLoopData([(1,), (2,)]), rep_filename, tmpl_filename)
+        with open(rep_filename, 'rt') as rep_file:
+            self.assertEqual(rep_file.read(), rtf_report.parse_rtf(_rtfLoopData([(1,), (2,)]), RTF_LOOP_TEMPLATE))
+        self.assertEqual(sorted(os.listdir(self.tmp_path)), ['report.rtf', 'template.rtf'])
+
+
+class icRowSink(object):
+    """
+    Приемник строк отчета, собирающий строки в список.
+    """
+    def __init__(self, rows):
+        """
+        Конструктор.
+
+        :param rows: Список, в который добавляются пары (номер строки, строка).
+        """
+        self.rows = rows
+
+    def writeRow(self, i_row, row):
+        """
+        Записать строку отчета.
+        """
+        self.rows.append((i_row, row))
+
+
+class icReportSinkTests(unittest.TestCase):
+    """
+    Тесты потоковой генерации отчета в приемник строк.
+    """
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+    def _generate(self, sink=None):
+        """
+        Сгенерировать отчет с группами.
+
+        :param sink: Приемник строк отчета.
+        """
+        return icrepgen.icReportGenerator().generate(_groupTemplate(), _queryTbl(), sink=sink)
+
+    def test_rows(self):
+        """
+        Приемник получает те же строки, что и лист отчета без приемника.
+        """
+        rows = list()
+        sink = icRowSink(rows)
+        rep = self._generate(sink)
+        self.assertEqual([i_row for i_row, row in rows], list(range(len(rows))))
+        self.assertEqual(rep['sheet'], [])
+        self.assertEqual(_values({'sheet': [row for i_row, row in rows]}), _values(self._generate()))
+
+    def test_xml_file(self):
+        """
+        Потоковая запись XMLSS файла совпадает с записью по листу отчета.
+        """
+        stream_filename = os.path.join(self.tmp_path, 'stream.xml')
+        sink = icrepfile.icExcelXMLReportStream()
+        sink.write(stream_filename, self._generate(sink))
+        filename = os.path.join(self.tmp_path, 'report.xml')
+        icrepfile.icExcelXMLReportFile().write(filename, self._generate())
+
+        with open(stream_filename, 'rb') as stream_file, open(filename, 'rb') as rep_file:
+            self.assertEqual(stream_file.read(), rep_file.read())
+
+    def test_ods_file(self):
+        """
+        Потоковая запись ODS файла совпадает с записью по листу отчета.
+        """
+        stream_filename = os.path.join(self.tmp_path, 'stream.ods')
+        sink = icodsrepfile.icODSReportFile()
+        sink.write(stream_filename, self._generate(sink))
+        filename = os.path.join(self.tmp_path, 'report.ods')
+        icodsrepfile.icODSReportFile().write(filename, self._generate())
+
+        with zipfile.ZipFile(stream_filename) as stream_zip, zipfile.ZipFile(filename) as rep_zip:
+            self.assertEqual(stream_zip.namelist(), rep_zip.namelist())
+            for name in ('content.xml', 'styles.xml'):
+                self.assertEqual(stream_zip.read(name), rep_zip.read(name))
+
+
+@unittest.skipIf(icrepgensystem is None, 'icrepgensystem dependencies are not installed')
+class icSQLQueryDataTests(unittest.TestCase):
+    """
+    Тесты чтения таблицы запроса из БД порциями.
+    """
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        self.db_url = 'sqlite:///' + os.path.join(self.tmp_path, 'test.db')
+        db_connection = sqlalchemy.create_engine(self.db_url)
+        with db_connection.begin() as connection:
+            connection.execute(sqlalchemy.text('CREATE TABLE tst (n INTEGER, name VARCHAR(10))'))
+            for i in range(5):
+                connection.execute(sqlalchemy.text('INSERT INTO tst VALUES (%d, \'n%d\')' % (i, i)))
+        db_connection.dispose()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+    def _query(self, sql, chunk_size=2):
+        """
+        Выполнить запрос так же, как это делает система генерации отчетов.
+
+        :param sql: Текст SQL запроса.
+        :param chunk_size: Количество записей, читаемых за один раз.
+        """
+        db_connection = sqlalchemy.create_engine(self.db_url)
+        connection = db_connection.connect().execution_options(stream_results=True)
+        sql_result = connection.execute(sqlalchemy.text(sql))
+        return icrepgensystem.icSQLQueryData(db_connection, connection, sql_result, chunk_size)
+
+    def test_len_index(self):
+        """
+        Количество записей и обращение по индексу.
+        """
+        rows = self._query('SELECT n, name FROM tst ORDER BY n')
+        self.assertTrue(rows)
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(tuple(rows[0]), (0, 'n0'))
+        self.assertEqual(tuple(rows[-1]), (4, 'n4'))
+        # После чтения последней порции связь с БД закрыта
+        self.assertIsNone(rows._sql_result)
+        # Загруженные записи можно перебрать
+        self.assertEqual([row[0] for row in rows], [0, 1, 2, 3, 4])
+
+    def test_iterate(self):
+        """
+        Перебор записей возможен только один раз.
+        """
+        rows = self._query('SELECT n, name FROM tst ORDER BY n')
+        self.assertEqual([tuple(row) for row in rows], [(i, 'n%d' % i) for i in range(5)])
+        self.assertIsNone(rows._sql_result)
+        self.assertRaises(IndexError, list, rows)
+        self.assertRaises(IndexError, len, rows)
+
+    def test_empty(self):
+        """
+        Пустой результат запроса.
+        """
+        rows = self._query('SELECT n, name FROM tst WHERE n < 0')
+        self.assertFalse(rows)
+        self.assertIsNone(rows._sql_result)
+        self.assertEqual(len(rows), 0)
+        self.assertEqual(list(rows), [])
+
+    def test_stop_iteration(self):
+        """
+        При прекращении перебора связь с БД закрывается.
+        """
+        rows = self._query('SELECT n, name FROM tst ORDER BY n')
+        row_iter = iter(rows)
+        self.assertEqual(tuple(next(row_iter)), (0, 'n0'))
+        self.assertIsNotNone(rows._connection)
+        row_iter.close()
+        self.assertIsNone(rows._sql_result)
+        self.assertIsNone(rows._connection)
+
+    def test_sql_query_table(self):
+        """
+        Таблица запроса системы генерации отчетов.
+        Соединения возвращаются в пул после генерации и при ошибках.
+        """
+        chunk_size = config.get_glob_var('QUERY_CHUNK_SIZE')
+        config.set_glob_var('QUERY_CHUNK_SIZE', 2)
+        system = icrepgensystem.icReportGeneratorSystem()
+        try:
+            db_connection = icrepgensystem.getDBEngine(self.db_url)
+            self.assertIs(icrepgensystem.getDBEngine(self.db_url), db_connection)
+
+            query_tbl = system._getSQLQueryTable(None, self.db_url, sqlalchemy.text('SELECT n, name FROM tst ORDER BY n'))
+            self.assertEqual(list(query_tbl['__fields__']), ['n', 'name'])
+            row_iter = iter(query_tbl['__data__'])
+            self.assertEqual(tuple(next(row_iter)), (0, 'n0'))
+            self.assertEqual(db_connection.pool.checkedout(), 1)
+            system.closeQueryTbl(query_tbl)
+            self.assertEqual(db_connection.pool.checkedout(), 0)
+
+            self.assertIsNone(system._getSQLQueryTable(None, self.db_url, sqlalchemy.text('SELECT * FROM no_table')))
+            self.assertEqual(db_connection.pool.checkedout(), 0)
+        finally:
+            config.set_glob_var('QUERY_CHUNK_SIZE', chunk_size)
+            icrepgensystem._DB_ENGINE_CACHE.pop(self.db_url).dispose()
+
+
+if __name__ == '__main__':
+    unittest.main()
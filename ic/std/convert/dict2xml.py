@@ -11,35 +11,100 @@
 
 import sys
 import time
+import gzip
 from xml.sax import saxutils
 
-__version__ = (1, 1, 1, 4)
+__version__ = (1, 1, 2, 1)
 
 # Удалять 'Cyr' из имен шрифтов для Linux систем
 # т.к. в Linux все шрифты unicode
 FONT_NAME_CYRILIC_DEL = not bool(sys.platform[:3].lower == 'win')
 
+# Размер буфера записи XML файла
+WRITE_BUFFER_SIZE = 2 ** 20
+# Расширение сжатых XML файлов
+GZIP_FILE_EXT = '.gz'
+# Максимальное количество закешированных значений атрибутов
+QUOTE_ATTR_CACHE_SIZE = 4096
 
-def dict2XmlssFile(data, xml_filename, encoding='utf-8'):
+# Атрибуты ячейки, из-за которых ячейка записывается даже без значения
+SIGNIFICANT_CELL_ATTR_NAMES = ('StyleID', 'MergeAcross', 'MergeDown', 'Formula')
+
+# Соответствие атрибутов ячейки и данных ячейки атрибутам XML в порядке записи
+CELL_XML_ATTR_NAMES = (('Index', 'ss:Index'), ('StyleID', 'ss:StyleID'),
+                       ('MergeAcross', 'ss:MergeAcross'), ('MergeDown', 'ss:MergeDown'),
+                       ('Formula', 'ss:Formula'))
+DATA_XML_ATTR_NAMES = (('Type', 'ss:Type'), ('Name', 'ss:Name'), ('xmlns', 'xmlns'))
+
+
+def open_xml_file(xml_filename, compress=None):
+    """
+    Открыть XML файл для записи.
+    Файл открывается в двоичном режиме с большим буфером записи.
+    Перекодирование текста производит генератор XML.
+
+    :param xml_filename: Имя xml файла.
+    :param compress: Сжимать файл gzip?
+        Если не определено, то файл сжимается, если
+        имя файла имеет расширение .gz.
+    :return: Объект файла.
+    """
+    if compress is None:
+        compress = xml_filename.lower().endswith(GZIP_FILE_EXT)
+    xml_file = open(xml_filename, 'wb', buffering=WRITE_BUFFER_SIZE)
+    if compress:
+        try:
+            return gzip.GzipFile(fileobj=xml_file, mode='wb', compresslevel=6)
+        except:
+            xml_file.close()
+            raise
+    return xml_file
+
+
+def close_xml_file(xml_file):
+    """
+    Закрыть XML файл, открытый функцией open_xml_file.
+
+    :param xml_file: Объект файла.
+    """
+    if isinstance(xml_file, gzip.GzipFile):
+        # GzipFile не закрывает переданный ему файл
+        base_file = xml_file.fileobj
+        try:
+            xml_file.close()
+        finally:
+            base_file.close()
+    else:
+        xml_file.close()
+
+
+def dict2XmlssFile(data, xml_filename, encoding='utf-8', compress=None):
     """
     Функция конвертирования.
+
+    :param data: Словарь данных XML.
+    :param xml_filename: Имя xml файла.
+    :param encoding: Кодировка XML файла.
+    :param compress: Сжимать файл gzip?
+        Если не определено, то файл сжимается, если
+        имя файла имеет расширение .gz.
     """
     xml_file = None
     try:
         # Начать запись
-        xml_file = open(xml_filename, 'wt', encoding=encoding)
+        xml_file = open_xml_file(xml_filename, compress)
         xml_writer = icDict2XmlssWriter(data, xml_file, encoding=encoding)
         xml_writer.startDocument()
         xml_writer.setBook()
 
         # Закончить запись
         xml_writer.endDocument()
-        xml_file.close()
+        close_xml_file(xml_file)
 
         return xml_filename
     except:
         if xml_file:
-            xml_file.close()
+            close_xml_file(xml_file)
         raise
 
 
@@ -66,33 +131,64 @@ class icDICT2XMLWriter(saxutils.XMLGenerator):
 
         self.time_start = 0
 
+        # Буфер записи.
+        # Содержимое буфера записывается в файл одной строкой
+        # по окончании каждой строки таблицы
+        self._buffer = []
+        # Кеш значений атрибутов в кавычках
+        self._quoted_attrs = {}
+
     def _my_write(self, text):
         if not isinstance(text, str):
             # ВНИМАНИЕ! Записываться в файл должен только unicode иначе падает
             # при сохранении русских букв
             text = str(text)   # self._encoding)
-        
-        try: 
-            self._out.write(text)
-        except AttributeError:
-            self._write(text)
+        self._buffer.append(text)
 
-    def _startElement(self, name, attrs, auto_close=False):
-        self._my_write('<' + name)
-        for (name, value) in attrs.items():
-            # ВНИМАНИЕ! Записываться в файл должен только unicode иначе падает
-            # при сохранении русских букв
-            if sys.platform[:3].lower() == 'win':
-                txt = ' %s=%s' % (name, saxutils.quoteattr(value))
-            else:
-                txt = u' %s=%s' % (name, saxutils.quoteattr(value))
-            if isinstance(txt, str):
-                # txt = txt.encode(self._encoding)
-                self._my_write(txt)
+    def flushBuffer(self):
+        """
+        Записать содержимое буфера в файл.
+        """
+        if self._buffer:
+            self._write(''.join(self._buffer))
+            self._buffer = []
+
+    def characters(self, content):
+        """
+        Текст тега.
+        """
+        if content:
+            if not isinstance(content, str):
+                content = str(content, self._encoding)
+            self._my_write(saxutils.escape(content))
+
+    def endDocument(self):
+        """
+        Конец документа.
+        """
+        self.flushBuffer()
+        saxutils.XMLGenerator.endDocument(self)
+
+    def _quoteAttr(self, value):
+        """
+        Значение атрибута в кавычках.
+        Значения атрибутов (идентификаторы стилей, типы данных и т.п.)
+        часто повторяются, поэтому результат кешируется.
+        """
+        quoted_value = self._quoted_attrs.get(value, None)
+        if quoted_value is None:
+            if len(self._quoted_attrs) >= QUOTE_ATTR_CACHE_SIZE:
+                self._quoted_attrs.clear()
+            quoted_value = self._quoted_attrs[value] = saxutils.quoteattr(value)
+        return quoted_value
 
-        if auto_close:
-            self._my_write('/')
-        self._my_write('>')
+    def _startElement(self, name, attrs, auto_close=False):
+        # ВНИМАНИЕ! Записываться в файл должен только unicode иначе падает
+        # при сохранении русских букв
+        self._my_write('<%s%s%s>' % (name,
+                                     ''.join([' %s=%s' % (attr_name, self._quoteAttr(value))
+                                              for attr_name, value in attrs.items()]),
+                                     '/' if auto_close else ''))
 
     def _endElement(self, name, auto_close=False):
         if not auto_close:
@@ -536,46 +632,59 @@ class icDict2XmlssWriter(icDICT2XMLWriter):
                 # ВНИМАНИЕ!!! Проверка на пропуск пустых ячеек
                 # т.к. они выкинуться то надо учитывать смещение
                 # индекса последующих ячеек
-                if bool(set(cell.keys()) & set(['StyleID', 'MergeAcross', 'MergeDown', 'Formula'])) or \
-                   (not empty_data):
+                if self.isSignificantCell(cell) or (not empty_data):
                     prev_idx = cur_idx
             self.setCell(cell)
 
         self.endElementLevel('Row')
+        # Строка полностью сформирована в буфере
+        self.flushBuffer()
 
     def setCell(self, data=None):
         """
         Начало ячейки.
         """
-        attrs = {}
-        if 'Index' in data:
-            attrs['ss:Index'] = str(data['Index'])
-        if 'StyleID' in data:
-            attrs['ss:StyleID'] = str(data['StyleID'])
-        if 'MergeAcross' in data:
-            attrs['ss:MergeAcross'] = str(data['MergeAcross'])
-        if 'MergeDown' in data:
-            attrs['ss:MergeDown'] = str(data['MergeDown'])
-        if 'Formula' in data:
-            attrs['ss:Formula'] = str(data['Formula'])
-
-        empty_data = self.isEmptyData(data)
-        if bool(set(data.keys()) & set(['StyleID', 'MergeAcross', 'MergeDown', 'Formula'])) or \
-           (not empty_data):
+        self._my_write(self._renderCell(data))
 
-            self.startElementLevel('Cell', attrs, not bool(data['children']))
+    def _renderCell(self, data):
+        """
+        Сформировать ячейку одной строкой.
 
-            if data['children']:
-                # Данные ячейки
-                if not empty_data:
-                    cell_data = [element for element in data['children'] if element['name'] == 'Data']
-                    self.setData(cell_data[0])
-                # Именование ячейки
-                named_cell = [element for element in data['children'] if element['name'] == 'NamedCell']
-                if named_cell:
-                    self.setNamedCell(named_cell[0])
+        :param data: Атрибуты ячейки.
+        :return: Текст ячейки или пустая строка, если ячейка не записывается.
+        """
+        empty_data = self.isEmptyData(data)
+        if not (self.isSignificantCell(data) or (not empty_data)):
+            return ''
 
-            self.endElementLevel('Cell', not bool(data['children']))
+        attrs = ''.join([' %s=%s' % (xml_name, self._quoteAttr(str(data[name])))
+                         for name, xml_name in CELL_XML_ATTR_NAMES if name in data])
+        break_line = self.break_line
+        if not data['children']:
+            return '\n%s<Cell%s/>\n%s' % (break_line, attrs, break_line)
+
+        parts = ['\n', break_line, '<Cell', attrs, '>']
+        child_break_line = break_line + '  '
+        # Данные ячейки
+        if not empty_data:
+            cell_data = [element for element in data['children'] if element['name'] == 'Data']
+            parts.append(self._renderData(cell_data[0], child_break_line))
+        # Именование ячейки
+        named_cell = [element for element in data['children'] if element['name'] == 'NamedCell']
+        if named_cell:
+            parts.append(self._renderNamedCell(named_cell[0], child_break_line))
+        parts.append('\n%s</Cell>' % break_line)
+        return ''.join(parts)
+
+    def isSignificantCell(self, data):
+        """
+        Проверка на наличие у ячейки атрибутов, из-за которых
+        ячейка записывается даже без значения.
+        """
+        for attr_name in SIGNIFICANT_CELL_ATTR_NAMES:
+            if attr_name in data:
+                return True
+        return False
 
     def isEmptyData(self, data):
         """
@@ -593,36 +702,44 @@ class icDict2XmlssWriter(icDICT2XMLWriter):
         """
         Начало данных ячейки.
         """
-        value = data['value']
+        self._my_write(self._renderData(data, self.break_line))
 
-        attrs = {}
-        if 'Type' in data:
-            attrs['ss:Type'] = data['Type']
-        if 'Name' in data:
-            attrs['ss:Name'] = data['Name']
-        if 'xmlns' in data:
-            attrs['xmlns'] = data['xmlns']
+    def _renderData(self, data, break_line):
+        """
+        Сформировать данные ячейки одной строкой.
 
-        self.startElement('Data', attrs, not bool(value))
+        :param data: Атрибуты данных ячейки.
+        :param break_line: Отступ тега.
+        """
+        value = data['value']
+        attrs = ''.join([' %s=%s' % (xml_name, self._quoteAttr(str(data[name])))
+                         for name, xml_name in DATA_XML_ATTR_NAMES if name in data])
+        start_tag = '\n%s<Data%s%s' % (break_line, attrs, '>' if value else '/>')
 
         if not isinstance(value, str):
             value = str(value)  # , self._encoding)
         if value:
-            value = saxutils.escape(value)
-            self.characters(value)
-
-        self.endElement('Data', not bool(value))
+            # ВНИМАНИЕ! Значение экранируется повторно так же,
+            # как это делал вызов self.characters
+            value = saxutils.escape(saxutils.escape(value))
+            return start_tag + value + '</Data>'
+        return start_tag
 
     def setNamedCell(self, data=None):
         """
         Именованная ячейка.
         """
-        attrs = {}
-        if 'Name' in data:
-            attrs['ss:Name'] = data['Name']
+        self._my_write(self._renderNamedCell(data, self.break_line))
 
-        self.startElement('NamedCell', attrs, True)
-        self.endElement('NamedCell', True)
+    def _renderNamedCell(self, data, break_line):
+        """
+        Сформировать именованную ячейку одной строкой.
+
+        :param data: Атрибуты именованной ячейки.
+        :param break_line: Отступ тега.
+        """
+        attrs = ' ss:Name=%s' % self._quoteAttr(str(data['Name'])) if 'Name' in data else ''
+        return '\n%s<NamedCell%s/>' % (break_line, attrs)
 
     def setWorksheetOptions(self, data=None):
         """
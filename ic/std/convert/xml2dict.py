@@ -11,11 +11,19 @@
 
 # Подключение библиотек
 import sys
+import gc
 
 from xml.sax import xmlreader
 import xml.sax.handler
+import xml.parsers.expat
 
-__version__ = (1, 1, 1, 3)
+__version__ = (1, 1, 2, 1)
+
+# Размер блока чтения XML файла (такой же как у SAX анализатора)
+READ_BLOCK_SIZE = 2 ** 16
+
+# Имена элементов, содержимое которых может загружаться отложенно
+LAZY_ELEMENT_NAMES = ('Table',)
 
 
 # Описания функций
@@ -28,29 +36,267 @@ def XmlFile2Dict(xml_filename, encoding='utf-8'):
     :return: Функция возвращает заполненный словарь,
         или None в случае ошибки.
     """
-    xml_file = None
     try:
-        xml_file = open(xml_filename, 'rt', encoding=encoding)
-
-        input_source = xmlreader.InputSource()
-        input_source.setByteStream(xml_file)
+        xml_parser = icXML2DICTExpatReader(encoding=encoding)
+        return xml_parser.parseFile(xml_filename)
+    except:
+        info = str(sys.exc_info()[1])
+        print('Error read file <%s> : %s.' % (xml_filename, info))
+        return None
 
-        xml_reader = xml.sax.make_parser()
-        xml_parser = icXML2DICTReader(encoding=encoding)
-        xml_reader.setContentHandler(xml_parser)
 
-        # включаем опцию namespaces
-        xml_reader.setFeature(xml.sax.handler.feature_namespaces, 1)
-        xml_reader.parse(input_source)
-        xml_file.close()
+def XmlFile2DictLazy(xml_filename, encoding='utf-8', lazy_element_names=LAZY_ELEMENT_NAMES):
+    """
+    Функция конвертации файлов Excel в xml формате в словарь Python
+    с отложенной загрузкой содержимого элементов (по умолчанию таблиц листов).
+    Атрибуты таких элементов загружаются сразу, а список дочерних
+    элементов остается пустым.
 
-        return xml_parser.getData()
+    :param xml_filename: Имя xml файла.
+    :param encoding: Кодировка XML файла.
+    :param lazy_element_names: Имена элементов с отложенной загрузкой содержимого.
+    :return: Функция возвращает кортеж (заполненный словарь,
+        список пар (атрибуты элемента, объект отложенной загрузки icXMLLazyElement)),
+        или (None, None) в случае ошибки.
+    """
+    try:
+        xml_parser = icXML2DICTExpatReader(encoding=encoding, lazy_element_names=lazy_element_names)
+        data = xml_parser.parseFile(xml_filename)
+        return data, xml_parser.getLazyElements()
     except:
-        if xml_file:
-            xml_file.close()
         info = str(sys.exc_info()[1])
         print('Error read file <%s> : %s.' % (xml_filename, info))
-        return None
+        return None, None
+
+
+# Описания классов
+class icXML2DICTExpatReader(object):
+    """
+    Анализатор файлов Excel-xml формата на основе expat.
+    Формирует такую же структуру словаря, как icXML2DICTReader,
+    но без промежуточного слоя SAX.
+    Пространства имен отбрасываются: имена элементов и атрибутов
+    берутся без префиксов, объявления пространств имен не сохраняются.
+    """
+    def __init__(self, encoding='utf-8', lazy_element_names=None):
+        """
+        Конструктор.
+
+        :param encoding: Кодировка XML файла.
+        :param lazy_element_names: Имена элементов с отложенной загрузкой содержимого.
+        """
+        # Выходной словарь
+        self._data = {'name': 'Excel', 'children': []}
+        # Текущий заполняемый узел
+        self._cur_path = [self._data]
+
+        # Части текущего анализируемого значения
+        self._cur_value = None
+
+        # Кодировка
+        self.encoding = encoding
+
+        # Кеш имен без префиксов пространств имен
+        self._local_names = dict()
+
+        # Отложенная загрузка
+        self._lazy_element_names = lazy_element_names or ()
+        self._lazy_elements = list()
+        # Блоки загруженного текста XML в кодировке UTF-8,
+        # смещение первого блока от начала текста и
+        # начало текущего элемента с отложенной загрузкой
+        self._xml_blocks = list()
+        self._xml_offset = 0
+        self._lazy_qname = None
+        self._lazy_start = -1
+
+        self._parser = None
+
+    def getData(self):
+        """
+        Выходной словарь.
+        """
+        return self._data
+
+    def getLazyElements(self):
+        """
+        Список пар (атрибуты элемента, объект отложенной загрузки).
+        """
+        return self._lazy_elements
+
+    def _createParser(self):
+        """
+        Создать анализатор expat.
+        """
+        # Текст всегда передается анализатору в кодировке UTF-8
+        parser = xml.parsers.expat.ParserCreate('utf-8')
+        parser.StartElementHandler = self.startElement
+        parser.EndElementHandler = self.endElement
+        parser.CharacterDataHandler = self.characters
+        return parser
+
+    def parseFile(self, xml_filename):
+        """
+        Разобрать XML файл.
+
+        :param xml_filename: Имя xml файла.
+        :return: Выходной словарь.
+        """
+        # Сборка мусора на время разбора отключается,
+        # т.к. создается большое количество словарей, не образующих циклов
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            with open(xml_filename, 'rt', encoding=self.encoding) as xml_file:
+                self._parser = self._createParser()
+                while True:
+                    block = xml_file.read(READ_BLOCK_SIZE)
+                    if not block:
+                        break
+                    block = block.encode('utf-8')
+                    if self._lazy_element_names:
+                        self._xml_blocks.append(block)
+                    self._parser.Parse(block, False)
+                self._parser.Parse(b'', True)
+        finally:
+            if gc_enabled:
+                gc.enable()
+        self._parser = None
+        self._xml_blocks = list()
+        self._xml_offset = 0
+        return self._data
+
+    def parseString(self, xml_text):
+        """
+        Разобрать XML текст.
+
+        :param xml_text: XML текст в кодировке UTF-8.
+        :return: Выходной словарь.
+        """
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            self._parser = self._createParser()
+            if self._lazy_element_names:
+                self._xml_blocks.append(xml_text)
+            self._parser.Parse(xml_text, True)
+        finally:
+            if gc_enabled:
+                gc.enable()
+        self._parser = None
+        self._xml_blocks = list()
+        self._xml_offset = 0
+        return self._data
+
+    def _getLocalName(self, qname):
+        """
+        Имя без префикса пространства имен.
+        Для объявлений пространств имен возвращается None.
+        """
+        if qname == 'xmlns' or qname.startswith('xmlns:'):
+            local_name = None
+        else:
+            local_name = qname.rpartition(':')[2]
+        self._local_names[qname] = local_name
+        return local_name
+
+    def characters(self, content):
+        """
+        Данные.
+        """
+        if content.strip():
+            if self._cur_value is None:
+                self._cur_value = [content]
+            else:
+                self._cur_value.append(content)
+
+    def startElement(self, qname, attrs):
+        """
+        Разбор начала тега.
+        """
+        local_names = self._local_names
+        name = local_names[qname] if qname in local_names else self._getLocalName(qname)
+        cur_node = {'name': name, 'children': []}
+        self._cur_path[-1]['children'].append(cur_node)
+        self._cur_path.append(cur_node)
+
+        for attr_qname, attr_value in attrs.items():
+            attr_name = local_names[attr_qname] if attr_qname in local_names else self._getLocalName(attr_qname)
+            if attr_name is not None:
+                cur_node[attr_name] = attr_value
+
+        if name in self._lazy_element_names and len(self._cur_path) > 2:
+            # Содержимое элемента не разбирается до конца элемента
+            self._lazy_qname = qname
+            self._lazy_start = self._parser.CurrentByteIndex
+            self._dropXMLBlocks(self._lazy_start)
+            self._parser.StartElementHandler = None
+            self._parser.CharacterDataHandler = None
+            self._parser.EndElementHandler = self._endLazyElement
+
+    def endElement(self, qname):
+        """
+        Разбор закрывающего тега.
+        """
+        # Сохранить проанализированное значение
+        if self._cur_value is not None:
+            self._cur_path[-1]['value'] = ''.join(self._cur_value)
+            self._cur_value = None
+
+        del self._cur_path[-1]
+
+    def _dropXMLBlocks(self, offset):
+        """
+        Освободить блоки текста XML, которые полностью находятся до указанного смещения.
+
+        :param offset: Смещение от начала текста.
+        """
+        while self._xml_blocks and self._xml_offset + len(self._xml_blocks[0]) <= offset:
+            self._xml_offset += len(self._xml_blocks[0])
+            del self._xml_blocks[0]
+
+    def _endLazyElement(self, qname):
+        """
+        Разбор закрывающего тега внутри элемента с отложенной загрузкой.
+        """
+        if qname != self._lazy_qname:
+            return
+
+        xml_text = b''.join(self._xml_blocks)
+        start = self._lazy_start - self._xml_offset
+        end = xml_text.index(b'>', self._parser.CurrentByteIndex - self._xml_offset) + 1
+        self._lazy_elements.append((self._cur_path[-1], icXMLLazyElement(xml_text[start:end])))
+        self._xml_blocks = [xml_text[end:]]
+        self._xml_offset += end
+
+        self._lazy_qname = None
+        self._parser.StartElementHandler = self.startElement
+        self._parser.CharacterDataHandler = self.characters
+        self._parser.EndElementHandler = self.endElement
+        self.endElement(qname)
+
+
+class icXMLLazyElement(object):
+    """
+    Элемент с отложенной загрузкой содержимого.
+    Хранит XML текст элемента и разбирает его при каждом запросе
+    дочерних элементов, поэтому каждый раз возвращаются новые словари.
+    """
+    def __init__(self, xml_text):
+        """
+        Конструктор.
+
+        :param xml_text: XML текст элемента в кодировке UTF-8.
+        """
+        self.xml_text = xml_text
+
+    def getChildren(self):
+        """
+        Загрузить список дочерних элементов.
+        """
+        xml_parser = icXML2DICTExpatReader()
+        data = xml_parser.parseString(self.xml_text)
+        return data['children'][0]['children']
 
 
 # Описания классов
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Модуль функций кеша скомпилированных ресурсов.
+
+Скомпилированные ресурсы (шаблоны отчетов, ресурсные файлы и т.п.)
+хранятся в папке кеша в формате Pickle.
+Ключом ресурса является хеш содержимого исходного файла и версии
+компилятора, поэтому кеш не зависит от имени и времени изменения
+исходного файла и может разделяться несколькими процессами.
+
+Запись в кеш атомарна: файл сначала пишется во временный файл
+той же папки, а затем переименовывается.
+Размер кеша ограничен. При превышении удаляются файлы,
+которые дольше всего не использовались.
+"""
+
+import os
+import os.path
+import pickle
+import hashlib
+import tempfile
+
+from ic.std.log import log
+
+__version__ = (0, 1, 1, 1)
+
+# Расширение файлов кеша
+CACHE_FILE_EXT = '.pkl'
+# Расширение временных файлов кеша
+CACHE_TMP_FILE_EXT = '.tmp'
+
+# Папка кеша по умолчанию
+DEFAULT_CACHE_PATH = os.path.join(os.environ.get('HOME', os.path.dirname(__file__)), '.icreport', 'cache')
+# Максимальный размер кеша в байтах по умолчанию
+DEFAULT_CACHE_MAX_SIZE = 256 * 1024 * 1024
+
+# Размер блока чтения файла при вычислении хеша
+READ_BLOCK_SIZE = 2 ** 20
+
+
+def getCachePath():
+    """
+    Папка кеша.
+
+    :return: Путь до папки кеша или None, если кеш не используется.
+    """
+    try:
+        from ic import config
+        return config.get_glob_var('CACHE_PATH')
+    except:
+        return DEFAULT_CACHE_PATH
+
+
+def getCacheMaxSize():
+    """
+    Максимальный размер кеша в байтах.
+    """
+    try:
+        from ic import config
+        return config.get_glob_var('CACHE_MAX_SIZE')
+    except:
+        return DEFAULT_CACHE_MAX_SIZE
+
+
+def _newHash(*salt):
+    """
+    Создать объект хеша, проинициализированный дополнительными данными ключа.
+
+    :param salt: Дополнительные данные ключа (версия компилятора и т.п.).
+    """
+    content_hash = hashlib.sha1()
+    for item in salt:
+        content_hash.update(str(item).encode('utf-8'))
+        content_hash.update(b'\0')
+    return content_hash
+
+
+def getContentKey(content, *salt):
+    """
+    Ключ кеша по содержимому.
+
+    :param content: Содержимое исходного ресурса (str или bytes).
+    :param salt: Дополнительные данные ключа (версия компилятора и т.п.).
+    :return: Строка ключа.
+    """
+    content_hash = _newHash(*salt)
+    content_hash.update(content.encode('utf-8') if isinstance(content, str) else content)
+    return content_hash.hexdigest()
+
+
+def getFileKey(filename, *salt):
+    """
+    Ключ кеша по содержимому файла.
+
+    :param filename: Полное имя исходного файла.
+    :param salt: Дополнительные данные ключа (версия компилятора и т.п.).
+    :return: Строка ключа или None в случае ошибки.
+    """
+    try:
+        content_hash = _newHash(*salt)
+        with open(filename, 'rb') as src_file:
+            block = src_file.read(READ_BLOCK_SIZE)
+            while block:
+                content_hash.update(block)
+                block = src_file.read(READ_BLOCK_SIZE)
+        return content_hash.hexdigest()
+    except:
+        log.fatal(u'Ошибка вычисления ключа кеша файла <%s>' % filename)
+    return None
+
+
+def getCacheFilename(key, cache_path=None):
+    """
+    Имя файла кеша по ключу.
+
+    :param key: Ключ кеша.
+    :param cache_path: Папка кеша. Если не определена, то берется из конфигурации.
+    :return: Полное имя файла кеша или None, если кеш не используется.
+    """
+    if cache_path is None:
+        cache_path = getCachePath()
+    if not cache_path or not key:
+        return None
+    return os.path.join(cache_path, key + CACHE_FILE_EXT)
+
+
+def loadCache(key, cache_path=None):
+    """
+    Загрузить объект из кеша.
+    Время изменения файла кеша обновляется, чтобы
+    часто используемые файлы не удалялись при очистке.
+
+    :param key: Ключ кеша.
+    :param cache_path: Папка кеша. Если не определена, то берется из конфигурации.
+    :return: Объект или None, если объекта в кеше нет.
+    """
+    cache_filename = getCacheFilename(key, cache_path)
+    if not cache_filename or not os.path.isfile(cache_filename):
+        return None
+    try:
+        with open(cache_filename, 'rb') as cache_file:
+            obj = pickle.load(cache_file)
+        try:
+            os.utime(cache_filename, None)
+        except OSError:
+            # Файл может быть уже удален другим процессом
+            pass
+        log.debug(u'Загрузка из кеша <%s>' % cache_filename)
+        return obj
+    except:
+        log.fatal(u'Ошибка загрузки из кеша <%s>' % cache_filename)
+    return None
+
+
+def saveCache(key, obj, cache_path=None, max_size=None):
+    """
+    Сохранить объект в кеше.
+
+    :param key: Ключ кеша.
+    :param obj: Сохраняемый объект.
+    :param cache_path: Папка кеша. Если не определена, то берется из конфигурации.
+    :param max_size: Максимальный размер кеша в байтах.
+        Если не определен, то берется из конфигурации.
+    :return: True/False.
+    """
+    cache_filename = getCacheFilename(key, cache_path)
+    if not cache_filename:
+        return False
+    cache_path = os.path.dirname(cache_filename)
+    tmp_filename = None
+    try:
+        if not os.path.exists(cache_path):
+            os.makedirs(cache_path, exist_ok=True)
+        tmp_file, tmp_filename = tempfile.mkstemp(suffix=CACHE_TMP_FILE_EXT, dir=cache_path)
+        with os.fdopen(tmp_file, 'wb') as cache_file:
+            pickle.dump(obj, cache_file, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_filename, cache_filename)
+        tmp_filename = None
+    except:
+        log.fatal(u'Ошибка сохранения в кеше <%s>' % cache_filename)
+        return False
+    finally:
+        if tmp_filename and os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+
+    shrinkCache(cache_path, max_size)
+    return True
+
+
+def shrinkCache(cache_path=None, max_size=None):
+    """
+    Ограничить размер кеша.
+    Удаляются файлы, которые дольше всего не использовались.
+
+    :param cache_path: Папка кеша. Если не определена, то берется из конфигурации.
+    :param max_size: Максимальный размер кеша в байтах.
+        Если не определен, то берется из конфигурации.
+    :return: Количество удаленных файлов.
+    """
+    if cache_path is None:
+        cache_path = getCachePath()
+    if max_size is None:
+        max_size = getCacheMaxSize()
+    if not cache_path or not max_size or not os.path.isdir(cache_path):
+        return 0
+
+    cache_files = list()
+    total_size = 0
+    for entry in os.scandir(cache_path):
+        if entry.name.endswith(CACHE_FILE_EXT):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            cache_files.append((stat.st_mtime, stat.st_size, entry.path))
+            total_size += stat.st_size
+    if total_size <= max_size:
+        return 0
+
+    count = 0
+    for mtime, size, cache_filename in sorted(cache_files):
+        try:
+            os.remove(cache_filename)
+            count += 1
+        except OSError:
+            # Файл уже удален другим процессом
+            pass
+        total_size -= size
+        if total_size <= max_size:
+            break
+    log.debug(u'Из кеша <%s> удалено файлов: %d' % (cache_path, count))
+    return count
+
+
+def clearCache(cache_path=None):
+    """
+    Очистить кеш.
+
+    :param cache_path: Папка кеша. Если не определена, то берется из конфигурации.
+    """
+    return shrinkCache(cache_path, max_size=-1)
@@ -12,8 +12,9 @@ import pickle
 from ic.std.log import log
 
 from . import textfunc
+from . import cachefunc
 
-__version__ = (0, 1, 1, 2)
+__version__ = (0, 1, 2, 1)
 
 # Протокол хранения сериализованных объектов модулем cPickle
 # ВНИМАНИЕ!!! PICKLE_PROTOCOL = 1,2 использовать нельзя - ресурсы не востанавливаются
@@ -22,6 +23,9 @@ PICKLE_PROTOCOL = 0
 # Буфер транслированных ресурсных файлов
 Buff_readAndEvalFile = {}
 
+# Дополнительные данные ключа кеша транслированных ресурсных файлов
+RESOURCE_CACHE_SALT = 'resource'
+
 
 def loadResourceFile(filename, replace_dict={}, bRefresh=False, *arg, **kwarg):
     """
@@ -43,40 +47,9 @@ def loadResourceFile(filename, replace_dict={}, bRefresh=False, *arg, **kwarg):
             log.debug(u' '*3+u'[b] '+u'Возвращение файла <%s> из буфера' % filename)
             return Buff_readAndEvalFile[filename]
 
-        nm = os.path.basename(filename)
-        pt = nm.find('.')
-        if pt >= 0:
-            filepcl = os.path.join(os.path.dirname(filename), nm[:pt] + '_pkl' + nm[pt:])
-        else:
-            filepcl = os.path.join(os.path.dirname(filename), nm +'_pkl')
-
-        # Проверяем нужно ли компилировать данную структуру по следующим признакам:
-        # наличие скомпилированного файла, по времени последней модификации.
-        try:
-            if (os.path.isfile(filepcl) and not os.path.isfile(filename)) or \
-                    (os.path.getmtime(filename) < os.path.getmtime(filepcl)):
-                # Пытаеся прочитать сохраненную структуру если время последней
-                # модификации текстового представления меньше, времени
-                # последней модификации транслированного варианта.
-                fpcl = None
-                try:
-                    fpcl = open(filepcl, 'rb')
-                    obj = pickle.load(fpcl)
-                    fpcl.close()
-                    # Сохраняем объект в буфере
-                    Buff_readAndEvalFile[filename] = obj
-                    log.debug('\t[+] Загрузка из файла <%s>' % filepcl)
-                    return obj
-                except IOError:
-                    log.error('\t[-] Ошибка открытия файла <%s>' % filepcl)
-                except:
-                    if fpcl:
-                        fpcl.close()
-        except:
-            pass
-        # Пытаемся прочитать cPickle, если не удается считаем, что в файле
-        # хранится текст. Читаем его, выполняем, полученный объект сохраняем
-        # на диске для последующего использования
+        # Пытаемся прочитать Pickle, если не удается считаем, что в файле
+        # хранится текст. Читаем его и выполняем. Полученный объект
+        # сохраняем в кеше по хешу текста для последующего использования
         if os.path.isfile(filename):
             try:
                 fpcl = open(filename, 'rb')
@@ -96,16 +69,17 @@ def loadResourceFile(filename, replace_dict={}, bRefresh=False, *arg, **kwarg):
         for key in replace_dict:
             txt = txt.replace(key, replace_dict[key])
 
-        # Выполняем
-        obj = eval(txt)
+        # Проверяем есть ли в кеше транслированный вариант
+        cache_key = cachefunc.getContentKey(txt, RESOURCE_CACHE_SALT)
+        obj = cachefunc.loadCache(cache_key)
+        if obj is None:
+            # Выполняем
+            obj = eval(txt)
+            # Сохраняем транслированный вариант
+            log.debug('Сохранение в кеше транслированного файла <%s>' % filename)
+            cachefunc.saveCache(cache_key, obj)
         # Сохраняем объект в буфере
         Buff_readAndEvalFile[filename] = obj
-
-        # Сохраняем транслированный вариант
-        fpcl = open(filepcl, 'wb')
-        log.debug('Создание файла <%s> в PICKLE формате' % filepcl)
-        pickle.dump(obj, fpcl)  # , PICKLE_PROTOCOL)
-        fpcl.close()
     except IOError:
         log.error('\t[*] Ошибка открытия файла <%s>' % filename)
         obj = None
@@ -26,6 +26,13 @@ LOG_FILENAME = os.path.join(PROFILE_PATH,
 # Определять адресацию внутри объединенной ячейки как ошибку
 DETECT_MERGE_CELL_ERROR = False
 
+# Потоковое чтение ODS файлов (без построения полного DOM документа)
+ODS_STREAM_LOAD = True
+
+# Отложенная загрузка таблиц листов XML файлов.
+# Таблицы разбираются при первом обращении к ним
+XML_LAZY_LOAD = False
+
 
 def get_cfg_var(name):
     """
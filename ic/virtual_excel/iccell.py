@@ -222,9 +222,16 @@ class icVCell(icprototype.icVIndexedPrototype):
                 del self._attributes['MergeDown']
 
         # ВНИМАНИЕ!!!
-        # После объединения необходимо почистить словарь объединенных ячеек
-        # table=self.get_parent_by_name('Table')
-        # table._merge_cells=None
+        # После объединения необходимо обновить индекс объединенных ячеек.
+        # Номера следующих ячеек строки тоже изменились
+        table = self.get_parent_by_name('Table')
+        if table is not None:
+            table_index = table.getIndex()
+            table_index.resetRowIndex(self._parent.get_attributes())
+            if self._row_idx > 0 and self._col_idx > 0:
+                table_index.refreshRowMerges(range(self._row_idx, self._row_idx + max(down, 0) + 1))
+            else:
+                table_index.resetMerges()
 
     def _delMergeArreaCells(self, row, column, merge_down, merge_across):
         """
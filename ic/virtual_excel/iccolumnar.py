@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Компактное поколоночное хранение данных таблицы листа.
+
+Таблица в виде дерева словарей занимает порядка килобайта на ячейку.
+Упакованная таблица хранит значения ячеек по колонкам в списках,
+типы и стили значений в виде типизированных массивов номеров
+во внутренних справочниках, а объединения, формулы и
+нестандартные ячейки в разреженных таблицах.
+
+Упакованная таблица после упаковки не изменяется, поэтому
+может разделяться несколькими таблицами (клонами листа).
+При распаковке всегда создаются новые словари атрибутов.
+"""
+
+import array
+import copy
+
+try:
+    from . import icprototype
+except ImportError:
+    # Для запуска тестов
+    import icprototype
+
+__version__ = (0, 1, 2, 2)
+
+# Атрибуты ячейки, которые хранятся в упакованном виде
+PACKED_CELL_ATTR_NAMES = ('name', 'children', 'Index', 'StyleID', 'MergeAcross', 'MergeDown', 'Formula')
+# Атрибуты данных ячейки, которые хранятся в упакованном виде
+PACKED_DATA_ATTR_NAMES = ('name', 'children', 'value', 'Type')
+
+# Код отсутствующей ячейки
+NONE_CELL_CODE = 0
+# Код ячейки без данных
+EMPTY_CELL_CODE = 1
+# Код ячейки, которая хранится в таблице нестандартных ячеек
+EXTRA_CELL_CODE = 2
+
+# Тип элементов массивов кодов
+CODE_ARRAY_TYPE = 'I'
+
+
+def is_packed_cell(cell_attrs):
+    """
+    Проверка можно ли хранить ячейку в упакованном виде.
+
+    :param cell_attrs: Атрибуты ячейки.
+    """
+    for name in cell_attrs:
+        if name not in PACKED_CELL_ATTR_NAMES:
+            return False
+    children = cell_attrs.get('children', None)
+    if not children:
+        return True
+    if len(children) > 1:
+        return False
+    data = children[0]
+    if data.get('name', None) != 'Data' or 'Type' not in data or data.get('children', None):
+        return False
+    for name in data:
+        if name not in PACKED_DATA_ATTR_NAMES:
+            return False
+    return True
+
+
+class icVColumnarColumn(object):
+    """
+    Колонка упакованной таблицы.
+    """
+    __slots__ = ('values', 'types', 'styles')
+
+    def __init__(self, row_count):
+        """
+        Конструктор.
+
+        :param row_count: Количество строк таблицы.
+        """
+        # Значения ячеек
+        self.values = [None] * row_count
+        # Коды типов значений
+        self.types = array.array(CODE_ARRAY_TYPE, [NONE_CELL_CODE]) * row_count
+        # Коды идентификаторов стилей
+        self.styles = array.array(CODE_ARRAY_TYPE, [0]) * row_count
+
+
+class icVColumnarTable(object):
+    """
+    Упакованная таблица листа.
+    """
+    def __init__(self):
+        """
+        Конструктор.
+        """
+        # Атрибуты таблицы (без дочерних элементов)
+        self.attrs = dict()
+        # Дочерние элементы таблицы, кроме строк (описания колонок)
+        self.elements = list()
+        # Количество строк
+        self.row_count = 0
+        # Признаки наличия элементов строк
+        self.rows = bytearray()
+        # Словарь номер строки:дополнительные атрибуты строки
+        self.row_attrs = dict()
+        # Словарь номер колонки:колонка
+        self.columns = dict()
+        # Справочники типов значений и идентификаторов стилей
+        self.types = [None, None, None]
+        self._type_codes = dict()
+        self.style_ids = [None]
+        self._style_codes = dict()
+        # Разреженные таблицы (номер строки, номер колонки):...
+        self.merges = dict()
+        self.formulas = dict()
+        self.extra_cells = dict()
+
+    def _getTypeCode(self, value_type):
+        """
+        Код типа значения.
+        """
+        code = self._type_codes.get(value_type, None)
+        if code is None:
+            code = self._type_codes[value_type] = len(self.types)
+            self.types.append(value_type)
+        return code
+
+    def _getStyleCode(self, style_id):
+        """
+        Код идентификатора стиля.
+        """
+        if style_id is None:
+            return 0
+        code = self._style_codes.get(style_id, None)
+        if code is None:
+            code = self._style_codes[style_id] = len(self.style_ids)
+            self.style_ids.append(style_id)
+        return code
+
+    def _getColumn(self, col):
+        """
+        Колонка по номеру. Если колонки нет, то она создается.
+        """
+        column = self.columns.get(col, None)
+        if column is None:
+            column = self.columns[col] = icVColumnarColumn(self.row_count)
+        return column
+
+    def pack(self, table_attrs):
+        """
+        Упаковать данные таблицы.
+        Атрибуты таблицы не изменяются и не разделяются с упакованной таблицей.
+
+        :param table_attrs: Атрибуты таблицы.
+        :return: Объект упакованной таблицы.
+        """
+        self.attrs = dict([(name, value) for name, value in table_attrs.items() if name != 'children'])
+        rows = list()
+        i_row = 0
+        for element in table_attrs['children']:
+            if element['name'] == 'Row':
+                i_row = int(element['Index']) if 'Index' in element else i_row + 1
+                rows.append((i_row, element))
+            else:
+                self.elements.append(icprototype.copy_attributes(element))
+
+        self.row_count = max([i for i, row in rows]) if rows else 0
+        self.rows = bytearray(self.row_count)
+        for i_row, row in rows:
+            self.rows[i_row - 1] = 1
+            row_attrs = dict([(name, value) for name, value in row.items()
+                              if name not in ('name', 'children', 'Index')])
+            if row_attrs:
+                self.row_attrs[i_row] = row_attrs
+            self._packRowCells(i_row, row.get('children', ()))
+        return self
+
+    def _packRowCells(self, i_row, cells):
+        """
+        Упаковать ячейки строки.
+
+        :param i_row: Номер строки.
+        :param cells: Список атрибутов ячеек.
+        """
+        idx = i_row - 1
+        i_col = 0
+        for cell in cells:
+            i_col = int(cell['Index']) if 'Index' in cell else i_col + 1
+            column = self._getColumn(i_col)
+            if is_packed_cell(cell):
+                data = cell['children'][0] if cell.get('children', None) else None
+                if data is None:
+                    column.types[idx] = EMPTY_CELL_CODE
+                else:
+                    column.types[idx] = self._getTypeCode(data['Type'])
+                    column.values[idx] = data.get('value', None)
+                column.styles[idx] = self._getStyleCode(cell.get('StyleID', None))
+                if 'MergeAcross' in cell or 'MergeDown' in cell:
+                    self.merges[(i_row, i_col)] = (cell.get('MergeAcross', None), cell.get('MergeDown', None))
+                if 'Formula' in cell:
+                    self.formulas[(i_row, i_col)] = cell['Formula']
+            else:
+                column.types[idx] = EXTRA_CELL_CODE
+                self.extra_cells[(i_row, i_col)] = icprototype.copy_attributes(cell)
+            if 'MergeAcross' in cell:
+                i_col += int(cell['MergeAcross'])
+
+    def unpack(self, table_attrs=None):
+        """
+        Распаковать данные таблицы в форму дерева словарей.
+
+        :param table_attrs: Атрибуты таблицы, в которые производится распаковка.
+            Если не определены, то создаются новые.
+        :return: Атрибуты таблицы.
+        """
+        if table_attrs is None:
+            table_attrs = dict()
+        for name, value in self.attrs.items():
+            table_attrs.setdefault(name, value)
+        children = [icprototype.copy_attributes(element) for element in self.elements]
+
+        columns = sorted(self.columns.items())
+        prev_row = 0
+        for idx in range(self.row_count):
+            if not self.rows[idx]:
+                continue
+            i_row = idx + 1
+            row = {'name': 'Row', 'children': []}
+            if i_row != prev_row + 1:
+                row['Index'] = str(i_row)
+            row.update(self.row_attrs.get(i_row, ()))
+            prev_row = i_row
+
+            next_col = 1
+            for i_col, column in columns:
+                code = column.types[idx]
+                if code == NONE_CELL_CODE:
+                    continue
+                if code == EXTRA_CELL_CODE:
+                    cell = icprototype.copy_attributes(self.extra_cells[(i_row, i_col)])
+                    cell.pop('Index', None)
+                else:
+                    cell = {'name': 'Cell', 'children': []}
+                    style_code = column.styles[idx]
+                    if style_code:
+                        cell['StyleID'] = self.style_ids[style_code]
+                    merge = self.merges.get((i_row, i_col), None)
+                    if merge:
+                        if merge[0] is not None:
+                            cell['MergeAcross'] = merge[0]
+                        if merge[1] is not None:
+                            cell['MergeDown'] = merge[1]
+                    if (i_row, i_col) in self.formulas:
+                        cell['Formula'] = self.formulas[(i_row, i_col)]
+                    if code != EMPTY_CELL_CODE:
+                        cell['children'].append({'name': 'Data',
+                                                 'value': column.values[idx],
+                                                 'Type': self.types[code],
+                                                 'children': []})
+                if i_col != next_col:
+                    cell['Index'] = str(i_col)
+                next_col = i_col + 1
+                if 'MergeAcross' in cell:
+                    next_col += int(cell['MergeAcross'])
+                row['children'].append(cell)
+            children.append(row)
+
+        table_attrs['children'] = children
+        return table_attrs
+
+    def replaceStyleIDs(self, style_id_map):
+        """
+        Копия упакованной таблицы с замененными идентификаторами стилей.
+        Данные колонок разделяются с оригиналом, заменяется только
+        справочник идентификаторов стилей.
+
+        :param style_id_map: Словарь замены старый идентификатор стиля:новый идентификатор стиля.
+        :return: Объект упакованной таблицы.
+        """
+        packed_table = copy.copy(self)
+        packed_table.style_ids = [style_id_map.get(style_id, style_id) if style_id is not None else None
+                                  for style_id in self.style_ids]
+        packed_table._style_codes = dict()
+        packed_table.attrs = dict(self.attrs)
+        if 'StyleID' in packed_table.attrs:
+            packed_table.attrs['StyleID'] = style_id_map.get(packed_table.attrs['StyleID'],
+                                                             packed_table.attrs['StyleID'])
+        packed_table.elements = [icprototype.replace_style_ids(icprototype.copy_attributes(element),
+                                                               style_id_map) for element in self.elements]
+        packed_table.row_attrs = dict([(i_row, icprototype.replace_style_ids(dict(row_attrs), style_id_map))
+                                       for i_row, row_attrs in self.row_attrs.items()])
+        packed_table.extra_cells = dict([(address, icprototype.replace_style_ids(icprototype.copy_attributes(cell),
+                                                                                 style_id_map))
+                                         for address, cell in self.extra_cells.items()])
+        return packed_table
+
+    def getCellCount(self):
+        """
+        Количество упакованных ячеек.
+        """
+        return sum([len(column.types) - column.types.count(NONE_CELL_CODE) for column in self.columns.values()])
+
+
+class icVLazyTable(object):
+    """
+    Таблица с отложенной загрузкой.
+    Дочерние элементы таблицы загружаются при распаковке.
+    """
+    def __init__(self, load_children):
+        """
+        Конструктор.
+
+        :param load_children: Функция загрузки списка дочерних элементов таблицы.
+            При каждом вызове должна возвращать новые словари атрибутов.
+        """
+        self._load_children = load_children
+
+    def unpack(self, table_attrs=None):
+        """
+        Загрузить данные таблицы.
+
+        :param table_attrs: Атрибуты таблицы, в которые производится загрузка.
+            Если не определены, то создаются новые.
+        :return: Атрибуты таблицы.
+        """
+        if table_attrs is None:
+            table_attrs = dict()
+        table_attrs['children'] = self._load_children()
+        return table_attrs
+
+    def replaceStyleIDs(self, style_id_map):
+        """
+        Упакованная копия таблицы с замененными идентификаторами стилей.
+
+        :param style_id_map: Словарь замены старый идентификатор стиля:новый идентификатор стиля.
+        :return: Объект упакованной таблицы.
+        """
+        return pack_table(self.unpack()).replaceStyleIDs(style_id_map)
+
+
+def pack_table(table_attrs):
+    """
+    Упаковать таблицу.
+
+    :param table_attrs: Атрибуты таблицы.
+    :return: Объект упакованной таблицы.
+    """
+    return icVColumnarTable().pack(table_attrs)
@@ -8,14 +8,20 @@ import copy
 try:
     from . import icprototype
     from . import icworkbook
+    from . import icworksheet
+    from . import icstyle
+    from . import iccolumnar
     from . import icods
-    # from . import config
+    from . import config
 except ImportError:
     # Для запуска тестов
     import icprototype
     import icworkbook
+    import icworksheet
+    import icstyle
+    import iccolumnar
     import icods
-    # import config
+    import config
 
 try:
     # Если Virtual Excel работает в окружении icReport
@@ -61,10 +67,21 @@ class icVExcel(icprototype.icVPrototype):
         # Список групповых операций с листами
         self._worksheet_list_clipboard = []
 
+        # Индексы таблиц листов
+        self._table_indexes = {}
+        # Индексы стилей книг
+        self._styles_indexes = {}
+        # Упакованные таблицы листов
+        self._packed_tables = {}
+
     def _regWorkbook(self, xml_filename=None, workbook_data=None):
         """
         Зарегистрировать книгу как открытую.
         """
+        old_workbook_data = self._workbooks.get(xml_filename, None)
+        if old_workbook_data is not None and old_workbook_data is not workbook_data:
+            # Книга перезагружена. Старые данные больше не используются
+            self._releaseData(old_workbook_data)
         self._workbooks[xml_filename] = workbook_data
 
     def _unregWorkbook(self, xml_filename=None):
@@ -82,10 +99,205 @@ class icVExcel(icprototype.icVPrototype):
             self._workbooks[new_xml_filename] = self._workbooks[old_xml_filename]
             del self._workbooks[old_xml_filename]
 
+    def _releaseData(self, data):
+        """
+        Освободить упакованные таблицы и индексы таблиц и стилей
+        удаляемых данных (листа, книги).
+
+        :param data: Удаляемые данные.
+        """
+        if not data:
+            return
+        name = data.get('name', None)
+        if name == 'Table':
+            packed = self._packed_tables.get(id(data), None)
+            if packed is not None and packed[0] is data:
+                del self._packed_tables[id(data)]
+            table_index = self._table_indexes.get(id(data), None)
+            if table_index is not None and table_index.attrs is data:
+                del self._table_indexes[id(data)]
+                table_index.attrs = None
+            return
+        elif name == 'Styles':
+            styles_index = self._styles_indexes.get(id(data), None)
+            if styles_index is not None and styles_index.attrs is data:
+                del self._styles_indexes[id(data)]
+            return
+        for child in data.get('children', None) or ():
+            self._releaseData(child)
+
+    def _releaseClipboard(self):
+        """
+        Освободить данные не вставленного листа из буфера обмена.
+        """
+        for key, worksheet_data in self._worksheet_clipboard.items():
+            if isinstance(key, tuple):
+                self._releaseData(worksheet_data)
+        self._worksheet_clipboard = dict()
+
+    def getTableIndex(self, table_attrs):
+        """
+        Индекс строк, колонок и ячеек таблицы.
+
+        :param table_attrs: Атрибуты таблицы.
+        """
+        if self._packed_tables:
+            self.unpackTable(table_attrs)
+        table_index = self._table_indexes.get(id(table_attrs), None)
+        if table_index is None or table_index.attrs is not table_attrs:
+            table_index = icworksheet.icVTableIndex(table_attrs)
+            self._table_indexes[id(table_attrs)] = table_index
+        return table_index
+
+    def packTable(self, table_attrs):
+        """
+        Упаковать таблицу в компактное поколоночное представление.
+        Дочерние элементы таблицы освобождаются.
+        Таблица автоматически распаковывается при обращении к ней
+        через объекты Virtual Excel, при получении данных и перед сохранением.
+
+        :param table_attrs: Атрибуты таблицы.
+        :return: Объект упакованной таблицы.
+        """
+        packed = self._packed_tables.get(id(table_attrs), None)
+        if packed is not None and packed[0] is table_attrs:
+            return packed[1]
+
+        packed_table = iccolumnar.pack_table(table_attrs)
+        table_attrs['children'] = []
+        self._packed_tables[id(table_attrs)] = (table_attrs, packed_table)
+        # Индекс таблицы больше не действителен
+        table_index = self._table_indexes.pop(id(table_attrs), None)
+        if table_index is not None:
+            table_index.attrs = None
+        return packed_table
+
+    def unpackTable(self, table_attrs):
+        """
+        Распаковать таблицу, если она была упакована.
+
+        :param table_attrs: Атрибуты таблицы.
+        :return: True - таблица распакована, False - таблица не была упакована.
+        """
+        packed = self._packed_tables.get(id(table_attrs), None)
+        if packed is None or packed[0] is not table_attrs:
+            return False
+        del self._packed_tables[id(table_attrs)]
+        packed[1].unpack(table_attrs)
+        return True
+
+    def unpackAll(self):
+        """
+        Распаковать все упакованные таблицы.
+        """
+        for table_attrs, packed_table in list(self._packed_tables.values()):
+            self.unpackTable(table_attrs)
+
+    def _findWorksheetTableData(self, xml_filename=None, sheet_name=None):
+        """
+        Найти данные таблицы указанного листа.
+
+        :param xml_filename: Имя XML файла книги. Если не определено,
+        то имеется ввиду активная книга.
+        :param sheet_name: Имя листа в указанной книге. Если не указано,
+        то имеется ввиду первый лист.
+        """
+        xml_filename = self._unificXMLFileName(xml_filename)
+        sheet_name = self._unicode2str(sheet_name)
+
+        worksheet_data = self._findWorksheetData(xml_filename, sheet_name)
+        if worksheet_data is None:
+            return None
+        tables = [element for element in worksheet_data['children'] if element['name'] == 'Table']
+        if tables:
+            return tables[0]
+        return None
+
+    def cloneTable(self, table_attrs):
+        """
+        Клон таблицы.
+        Упакованная копия данных таблицы отдается клону. Исходная таблица
+        не изменяется, поэтому ранее полученные объекты ее строк и ячеек
+        остаются действительными. Если исходная таблица уже упакована,
+        то ее упакованные данные разделяются с клоном.
+        Словари атрибутов клона создаются только при первом обращении к нему.
+
+        :param table_attrs: Атрибуты таблицы.
+        :return: Атрибуты таблицы-клона.
+        """
+        packed = self._packed_tables.get(id(table_attrs), None)
+        if packed is not None and packed[0] is table_attrs:
+            packed_table = packed[1]
+        else:
+            packed_table = iccolumnar.pack_table(table_attrs)
+        new_table_attrs = dict([(name, value) for name, value in table_attrs.items() if name != 'children'])
+        new_table_attrs['children'] = []
+        self._packed_tables[id(new_table_attrs)] = (new_table_attrs, packed_table)
+        return new_table_attrs
+
+    def _copyWorksheetData(self, worksheet_data):
+        """
+        Копия данных листа. Таблица листа копируется при первом обращении.
+
+        :param worksheet_data: Данные листа.
+        :return: Данные копии листа.
+        """
+        new_worksheet_data = dict(worksheet_data)
+        new_worksheet_data['children'] = [self.cloneTable(element) if element['name'] == 'Table'
+                                          else icprototype.copy_attributes(element)
+                                          for element in worksheet_data['children']]
+        return new_worksheet_data
+
+    def packWorksheet(self, sheet_name=None, xml_filename=None):
+        """
+        Упаковать таблицу листа в компактное поколоночное представление.
+        Используется для экономии памяти при работе с большими листами,
+        которые в данный момент не редактируются.
+
+        :param sheet_name: Имя листа. Если не указано, то имеется ввиду первый лист.
+        :param xml_filename: Имя XML файла книги. Если не определено,
+        то имеется ввиду активная книга.
+        :return: Объект упакованной таблицы или None в случае ошибки.
+        """
+        table_data = self._findWorksheetTableData(xml_filename, sheet_name)
+        if table_data is None:
+            log.warning(u'Таблица листа <%s> не найдена' % sheet_name)
+            return None
+        return self.packTable(table_data)
+
+    def unpackWorksheet(self, sheet_name=None, xml_filename=None):
+        """
+        Распаковать таблицу листа.
+
+        :param sheet_name: Имя листа. Если не указано, то имеется ввиду первый лист.
+        :param xml_filename: Имя XML файла книги. Если не определено,
+        то имеется ввиду активная книга.
+        :return: True - таблица распакована, False - таблица не была упакована.
+        """
+        table_data = self._findWorksheetTableData(xml_filename, sheet_name)
+        if table_data is None:
+            return False
+        return self.unpackTable(table_data)
+
+    def getStylesIndex(self, styles_attrs):
+        """
+        Индекс стилей книги.
+
+        :param styles_attrs: Атрибуты стилей.
+        """
+        styles_index = self._styles_indexes.get(id(styles_attrs), None)
+        if styles_index is None or styles_index.attrs is not styles_attrs:
+            styles_index = icstyle.icVStylesIndex(styles_attrs)
+            self._styles_indexes[id(styles_attrs)] = styles_index
+        return styles_index
+
     def createNew(self):
         """
         Новый.
         """
+        if not any([workbook_data is self._data for workbook_data in self._workbooks.values()]):
+            # Данные незарегистрированной книги больше не используются
+            self._releaseData(self._data)
         # Данные
         self._data = {'name': 'Excel', 'children': []}
 
@@ -133,9 +345,14 @@ class icVExcel(icprototype.icVPrototype):
             log.error('convertXLS2XML function')
             return False
 
-    def loadXML(self, xml_filename=None):
+    def loadXML(self, xml_filename=None, lazy=None):
         """
         Загрузить из XML файла.
+
+        :param xml_filename: Имя XML файла.
+        :param lazy: Отложенная загрузка таблиц листов.
+            Таблицы разбираются при первом обращении к ним.
+            Если не определено, то берется из конфигурации (XML_LAZY_LOAD).
         """
         if xml_filename:
             self.SpreadsheetFileName = os.path.abspath(xml_filename)
@@ -143,24 +360,38 @@ class icVExcel(icprototype.icVPrototype):
             if not os.path.exists(self.SpreadsheetFileName) and os.path.exists(xls_file_name):
                 if not self.convertXLS2XML(xls_file_name):
                     return None
-        self._data = xml2dict.XmlFile2Dict(self.SpreadsheetFileName, encoding=self.encoding)
+
+        if lazy is None:
+            lazy = config.get_cfg_var('XML_LAZY_LOAD')
+        load_lazy = getattr(xml2dict, 'XmlFile2DictLazy', None)
+        if lazy and load_lazy:
+            self._data, lazy_tables = load_lazy(self.SpreadsheetFileName, encoding=self.encoding)
+            for table_attrs, lazy_table in lazy_tables or ():
+                self._packed_tables[id(table_attrs)] = (table_attrs, iccolumnar.icVLazyTable(lazy_table.getChildren))
+        else:
+            self._data = xml2dict.XmlFile2Dict(self.SpreadsheetFileName, encoding=self.encoding)
 
         # Зарегистрировать открытую книгу
         self._regWorkbook(self.SpreadsheetFileName, self._data)
 
         return self._data
 
-    def loadODS(self, ods_filename=None):
+    def loadODS(self, ods_filename=None, sheet_name=None, row_limit=None, sheet_limit=None, used_styles_only=False):
         """
         Загрузить из ODS файла.
 
         :param ods_filename: Полное имя ODS файла.
+        :param sheet_name: Имя листа, если необходимо загрузить только его.
+        :param row_limit: Количество первых строк, загружаемых из каждого листа.
+        :param sheet_limit: Количество первых листов, загружаемых из файла.
+        :param used_styles_only: Загружать только стили, используемые в загруженных листах.
         """
         if ods_filename:
             self.SpreadsheetFileName = os.path.abspath(ods_filename)
         
             ods = icods.icODS()
-            self._data = ods.load(ods_filename)
+            self._data = ods.load(ods_filename, sheet_name=sheet_name, row_limit=row_limit,
+                                  sheet_limit=sheet_limit, used_styles_only=used_styles_only)
         
             # Зарегистрировать открытую книгу
             self._regWorkbook(self.SpreadsheetFileName, self._data)
@@ -231,7 +462,9 @@ class icVExcel(icprototype.icVPrototype):
         if os.path.exists(ods_filename):
             # Если файл существует, то удалить его
             os.remove(ods_filename)
-            
+
+        # Упакованные таблицы сохраняются в виде дерева словарей
+        self.unpackAll()
         ods = icods.icODS()
         return ods.save(ods_filename, self._data)
 
@@ -255,6 +488,9 @@ class icVExcel(icprototype.icVPrototype):
             self._reregWorkbook(self.SpreadsheetFileName, xml_filename.strip())
             self.SpreadsheetFileName = xml_filename.strip()
 
+        # Упакованные таблицы сохраняются в виде дерева словарей
+        self.unpackAll()
+
         work_book = self.getActiveWorkbook()
 
         # Установить ExpandedRowCount и ExpandedColumnCount если нобходимо
@@ -294,7 +530,10 @@ class icVExcel(icprototype.icVPrototype):
     def getData(self):
         """
         Данные.
+        Упакованные таблицы перед этим распаковываются.
         """
+        if self._packed_tables:
+            self.unpackAll()
         return self._data
 
     def get_attributes(self):
@@ -361,6 +600,7 @@ class icVExcel(icprototype.icVPrototype):
         if xml_file_name is None:
             xml_file_name = self.SpreadsheetFileName
 
+        self._releaseData(self._workbooks.get(xml_file_name, None))
         self._unregWorkbook(xml_file_name)
 
         # Если активная книга - закрываемая, то поменять активную книгу
@@ -498,9 +738,9 @@ class icVExcel(icprototype.icVPrototype):
         styles_data = self._getWorkbookStyles(xml_filename)
         if worksheet_data:
             # Сделать копию
-            self._worksheet_clipboard = dict()
-            self._worksheet_clipboard[(xml_filename, sheet_name)] = copy.deepcopy(worksheet_data)
-            self._worksheet_clipboard['styles'] = copy.deepcopy(styles_data)
+            self._releaseClipboard()
+            self._worksheet_clipboard[(xml_filename, sheet_name)] = self._copyWorksheetData(worksheet_data)
+            self._worksheet_clipboard['styles'] = icprototype.copy_attributes(styles_data)
             self._is_cut_worksheet = False
             return self._worksheet_clipboard[(xml_filename, sheet_name)]
         return None
@@ -522,11 +762,11 @@ class icVExcel(icprototype.icVPrototype):
         styles_data = self._getWorkbookStyles(xml_filename)
         if worksheet_data:
             # Сделать копию
-            self._worksheet_clipboard = dict()
-            self._worksheet_clipboard[(xml_filename, sheet_name)] = copy.deepcopy(worksheet_data)
-            self._worksheet_clipboard['styles'] = copy.deepcopy(styles_data)
+            self._releaseClipboard()
+            self._worksheet_clipboard[(xml_filename, sheet_name)] = self._copyWorksheetData(worksheet_data)
+            self._worksheet_clipboard['styles'] = icprototype.copy_attributes(styles_data)
             self._is_cut_worksheet = True
-            return self._worksheet_clipboard[[(xml_filename, sheet_name)]]
+            return self._worksheet_clipboard[(xml_filename, sheet_name)]
         return None
 
     def delWorksheet(self, xml_filename=None, sheet_name=None):
@@ -554,6 +794,7 @@ class icVExcel(icprototype.icVPrototype):
             if data['name'] == 'Worksheet':
                 if sheet_name is None:
                     # Если имя листа не определено, то просто удалить первый попавшийся лист
+                    self._releaseData(data)
                     del workbook_data['children'][i]
                     result = True
                     break
@@ -561,6 +802,7 @@ class icVExcel(icprototype.icVPrototype):
                     # Если имя листа определено, то проверить на соответствие имен листов
                     if data['Name'] == sheet_name:
                         log.info(u'Удаление книги <%s>' % sheet_name)
+                        self._releaseData(data)
                         del workbook_data['children'][i]
                         result = True
                         break
@@ -589,11 +831,13 @@ class icVExcel(icprototype.icVPrototype):
                 if sheet_name_ is None:
                     # Если имя листа не определено, то просто первый попавшийся лист
                     if not not_del_first:
+                        self._releaseData(data)
                         del workbook_data['children'][i]
                     not_del_first = False
                 else:
                     # Если имя листа определено, то проверить на соответствие имен листов
                     if data['Name'] != sheet_name_:
+                        self._releaseData(data)
                         del workbook_data['children'][i]
 
         return True
@@ -652,9 +896,9 @@ class icVExcel(icprototype.icVPrototype):
         """
         try:
             workbook_styles = [data for data in workbook_data['children'] if data['name'] == 'Styles'][0]
-            if style not in workbook_styles['children']:
-                workbook_styles_id = [data['ID'] for data in workbook_styles['children'] if data['name'] == 'Style']
-
+            # Стили книги по идентификаторам
+            workbook_styles_id = self.getStylesIndex(workbook_styles).update().styles
+            if workbook_styles_id.get(style['ID'], None) != style:
                 new_style_id = self._genNewStyleID(style['ID'], workbook_styles_id)
                 style['ID'] = new_style_id
                 workbook_styles['children'].append(style)
@@ -679,11 +923,31 @@ class icVExcel(icprototype.icVPrototype):
         if old_style_id == new_style_id:
             # Идентификаторы равны - замены не требуется
             return data
-        if 'StyleID' in data and data['StyleID'] == old_style_id:
-            data['StyleID'] = new_style_id
+        return self._replaceStyleIDs(data, {old_style_id: new_style_id})
+
+    def _replaceStyleIDs(self, data, style_id_map):
+        """
+        Заменить идентификаторы стилей в вставляемых данных по таблице замены.
+        В упакованных таблицах заменяется только справочник стилей.
+
+        :param data: Данные для вставки.
+        :param style_id_map: Словарь замены старый идентификатор стиля:новый идентификатор стиля.
+        :return: Возвращает данные с поправленными стилями.
+        """
+        if not style_id_map:
+            return data
+        packed = self._packed_tables.get(id(data), None)
+        if packed is not None and packed[0] is data:
+            if 'StyleID' in data:
+                data['StyleID'] = style_id_map.get(data['StyleID'], data['StyleID'])
+            self._packed_tables[id(data)] = (data, packed[1].replaceStyleIDs(style_id_map))
+            return data
+
+        if 'StyleID' in data:
+            data['StyleID'] = style_id_map.get(data['StyleID'], data['StyleID'])
         if 'children' in data and data['children']:
-            for i, child in enumerate(data['children']):
-                data['children'][i] = self._replaceStyleID(child, old_style_id, new_style_id)
+            for child in data['children']:
+                self._replaceStyleIDs(child, style_id_map)
         return data
 
     def _genNewWorksheetName(self, worksheet_name, worksheet_names):
@@ -734,10 +998,14 @@ class icVExcel(icprototype.icVPrototype):
         worksheet_data['Name'] = self._genNewWorksheetName(sheet_name, sheet_names)
         # Вставить стили
         if 'styles' in self._worksheet_clipboard:
-            for i, style in enumerate(self._worksheet_clipboard['styles']['children']):
+            # Таблица замены идентификаторов стилей применяется за один проход
+            style_id_map = dict()
+            for style in self._worksheet_clipboard['styles']['children']:
                 old_style_id = style['ID']
                 new_style_id = self._pasteStyleIntoWorkbook(style, workbook_data)
-                worksheet_data = self._replaceStyleID(worksheet_data, old_style_id, new_style_id)
+                if new_style_id != old_style_id:
+                    style_id_map[old_style_id] = new_style_id
+            worksheet_data = self._replaceStyleIDs(worksheet_data, style_id_map)
         # Вставить данные
         workbook_data['children'].append(worksheet_data)
 
@@ -867,6 +1135,21 @@ class icVExcel(icprototype.icVPrototype):
         cell = table.getCell(row, column)
         return cell.setValue(value)
 
+    def setCellValues(self, sheet_name, row, column, values, style_id=None, xml_filename=None):
+        """
+        Записать двумерный блок значений начиная с ячейки (row, column).
+
+        :param values: Двумерная последовательность значений:
+            список строк, массив NumPy или объект, поддерживающий буферный протокол.
+        :param style_id: Идентификатор общего стиля ячеек блока.
+        :return: Количество записанных ячеек.
+        """
+        if xml_filename is not None:
+            self.activeWorkbook(xml_filename)
+        work_book = self.getActiveWorkbook()
+        work_sheet = work_book.findWorksheet(sheet_name)
+        return work_sheet.setValues(row, column, values, style_id)
+
     def setCellStyle(self, sheet_name, row, col, alignment=None,
                      left_border=None, right_border=None, top_border=None, bottom_border=None,
                      font=None, interior=None, number_format=None, xml_filename=None):
@@ -4,8 +4,16 @@
 import os.path
 import re
 import uuid
+import zipfile
+import xml.etree.ElementTree
 
-# from . import config
+try:
+    from . import config
+    from . import icprototype
+except ImportError:
+    # Для запуска тестов
+    import config
+    import icprototype
 
 try:
     # Если Virtual Excel работает в окружении icReport
@@ -25,7 +33,7 @@ try:
 except ImportError:
     log.error(u'Ошибка импорта ODFpy')
 
-__version__ = (0, 1, 2, 1)
+__version__ = (0, 1, 2, 2)
 
 DIMENSION_CORRECT = 35
 DEFAULT_STYLE_ID = 'Default'
@@ -55,6 +63,117 @@ DEFAULT_XML_MARGIN_BOTTOM = 0.787401575
 DEFAULT_XML_MARGIN_LEFT = 0.787401575
 DEFAULT_XML_MARGIN_RIGHT = 0.787401575
 
+# Пространства имен ODS, используемые при потоковом чтении
+ODS_OFFICE_NS = 'urn:oasis:names:tc:opendocument:xmlns:office:1.0'
+ODS_TABLE_NS = 'urn:oasis:names:tc:opendocument:xmlns:table:1.0'
+
+ODS_AUTOMATIC_STYLES_TAG = '{%s}automatic-styles' % ODS_OFFICE_NS
+ODS_STYLES_TAG = '{%s}styles' % ODS_OFFICE_NS
+ODS_MASTER_STYLES_TAG = '{%s}master-styles' % ODS_OFFICE_NS
+ODS_SPREADSHEET_TAG = '{%s}spreadsheet' % ODS_OFFICE_NS
+ODS_TABLE_TAG = '{%s}table' % ODS_TABLE_NS
+ODS_TABLE_NAME_ATTR = '{%s}name' % ODS_TABLE_NS
+ODS_COLUMN_TAG = '{%s}table-column' % ODS_TABLE_NS
+ODS_ROW_TAG = '{%s}table-row' % ODS_TABLE_NS
+
+
+class icODSXMLElement(object):
+    """
+    Элемент ODS документа, прочитанный потоковым парсером.
+    Повторяет интерфейс элементов ODFpy, используемый при чтении ODS файла.
+    """
+    # Кеш полных имен тегов по типам элементов ODFpy
+    _tags = {}
+
+    def __init__(self, element):
+        """
+        Конструктор.
+
+        :param element: Элемент xml.etree.ElementTree.
+        """
+        self.element = element
+
+        namespace, local_name = element.tag[1:].split('}', 1) if element.tag[0] == '{' else ('', element.tag)
+        self.qname = (namespace, local_name)
+        self.tagName = local_name
+
+        # Атрибуты элемента по именам в стиле ODFpy. Заполняются при первом обращении
+        self._attr_values = None
+
+    @property
+    def attributes(self):
+        """
+        Атрибуты элемента в виде словаря {(пространство имен, имя): значение}.
+        """
+        return dict([(tuple(name[1:].split('}', 1)) if name[0] == '{' else ('', name), value)
+                     for name, value in self.element.attrib.items()])
+
+    def hasAttribute(self, attr_name):
+        """
+        Имеется в элементе атрибут с таким именем (в стиле ODFpy)?
+        """
+        return self.getAttribute(attr_name) is not None
+
+    @property
+    def childNodes(self):
+        """
+        Дочерние узлы: строки текста и элементы.
+        """
+        nodes = list()
+        if self.element.text:
+            nodes.append(self.element.text)
+        for child in self.element:
+            nodes.append(icODSXMLElement(child))
+            if child.tail:
+                nodes.append(child.tail)
+        return nodes
+
+    def getAttribute(self, attr_name):
+        """
+        Значение атрибута по имени в стиле ODFpy (без пространства имен и дефисов).
+
+        :return: Значение атрибута или None, если атрибут не определен.
+        """
+        if self._attr_values is None:
+            self._attr_values = dict()
+            for name, value in self.element.attrib.items():
+                self._attr_values.setdefault(name[name.find('}') + 1:].replace('-', ''), value)
+        return self._attr_values.get(attr_name, None)
+
+    def getElementsByType(self, element_type):
+        """
+        Найти все элементы (включая текущий) указанного типа ODFpy.
+
+        :param element_type: Функция ODFpy, создающая элемент.
+        """
+        tag = self._tags.get(element_type, None)
+        if tag is None:
+            qname = element_type(check_grammar=False).qname
+            tag = '{%s}%s' % qname
+            self._tags[element_type] = tag
+        return [icODSXMLElement(element) for element in self.element.iter(tag)]
+
+    def __str__(self):
+        return ''.join([str(child) for child in self.childNodes])
+
+
+class icODSXMLDocument(object):
+    """
+    Стили ODS документа, прочитанные потоковым парсером.
+    Повторяет интерфейс документа ODFpy, используемый при чтении ODS файла.
+    """
+    def __init__(self, automatic_styles, styles, master_styles):
+        """
+        Конструктор.
+
+        :param automatic_styles: Элемент автоматических стилей.
+        :param styles: Элемент стилей.
+        :param master_styles: Элемент стилей страниц.
+        """
+        self.automaticstyles = icODSXMLElement(automatic_styles)
+        self.styles = icODSXMLElement(styles)
+        self.masterstyles = icODSXMLElement(master_styles)
+
 
 class icODS(object):
     """
@@ -75,6 +194,25 @@ class icODS(object):
 
         # Индекс генерации имен стилей
         self._style_name_idx = 0
+
+        # Автоматические стили колонок и строк по ширине/высоте.
+        # Для каждой ширины/высоты создается только один стиль
+        self._column_styles_ = {}
+        self._row_styles_ = {}
+
+        # Автоматические стили в виде словаря {имя стиля: ODS стиль}
+        self._automatic_styles_ = None
+
+        # Имя единственного читаемого листа
+        self._sheet_name = None
+        # Ограничение количества читаемых строк листа
+        self._row_limit = None
+        # Ограничение количества читаемых листов
+        self._sheet_limit = None
+        # Количество прочитанных листов
+        self._sheet_count = 0
+        # Читать только стили, используемые в прочитанных листах
+        self._used_styles_only = False
         
     def save(self, filename, data_dict=None):
         """
@@ -89,6 +227,8 @@ class icODS(object):
 
         self.ods_document = None
         self._styles_ = {}
+        self._column_styles_ = {}
+        self._row_styles_ = {}
         
         workbooks = data_dict.get('children', None)
         if not workbooks:
@@ -618,11 +758,14 @@ class icODS(object):
 
         if width:
             width = self._dimension_xml2ods(width)
-            # Создать автоматические стили дбя ширин колонок
-            ods_col_style = odf.style.Style(name=self._genColumnStyleName(), family='table-column')
-            ods_col_properties = odf.style.TableColumnProperties(columnwidth=width, breakbefore='auto')
-            ods_col_style.addElement(ods_col_properties)
-            self.ods_document.automaticstyles.addElement(ods_col_style)
+            ods_col_style = self._column_styles_.get(width, None)
+            if ods_col_style is None:
+                # Создать автоматические стили дбя ширин колонок
+                ods_col_style = odf.style.Style(name=self._genColumnStyleName(), family='table-column')
+                ods_col_properties = odf.style.TableColumnProperties(columnwidth=width, breakbefore='auto')
+                ods_col_style.addElement(ods_col_properties)
+                self.ods_document.automaticstyles.addElement(ods_col_style)
+                self._column_styles_[width] = ods_col_style
             
             kwargs['stylename'] = ods_col_style
         else:
@@ -658,12 +801,17 @@ class icODS(object):
         style_name = u''
         if height:
             height = self._dimension_xml2ods(height)
-            # Создать автоматические стили дбя высот строк
-            style_name = self._genRowStyleName()
-            ods_row_style = odf.style.Style(name=style_name, family='table-row')
-            ods_row_properties = odf.style.TableRowProperties(rowheight=height, breakbefore='auto')
-            ods_row_style.addElement(ods_row_properties)
-            self.ods_document.automaticstyles.addElement(ods_row_style)
+            ods_row_style = self._row_styles_.get(height, None)
+            if ods_row_style is None:
+                # Создать автоматические стили дбя высот строк
+                style_name = self._genRowStyleName()
+                ods_row_style = odf.style.Style(name=style_name, family='table-row')
+                ods_row_properties = odf.style.TableRowProperties(rowheight=height, breakbefore='auto')
+                ods_row_style.addElement(ods_row_properties)
+                self.ods_document.automaticstyles.addElement(ods_row_style)
+                self._row_styles_[height] = ods_row_style
+            else:
+                style_name = ods_row_style.getAttribute('name')
             
             kwargs['stylename'] = ods_row_style
         else:
@@ -693,14 +841,16 @@ class icODS(object):
         # Ячейки
         i = 1
         cells = self.getChildrenByName(data_dict, 'Cell')
-        for i_cell, cell in enumerate(cells):
+        # Стиль, определенный в предыдущих ячейках
+        prev_style_id = None
+        for cell in cells:
             # Учет индекса ячейки
             idx = int(cell.get('Index', i))
             if idx > i:
                 kwargs = dict()
                 kwargs['numbercolumnsrepeated'] = (idx-i)
 
-                style_id = self._find_prev_style(cells[:i_cell])
+                style_id = prev_style_id
                 if style_id:
                     kwargs['stylename'] = self._styles_.get(style_id, None)
                     
@@ -721,28 +871,19 @@ class icODS(object):
                 kwargs = dict()
                 kwargs['numbercolumnsrepeated'] = merge
 
-                style_id = self._find_prev_style(cells[:i_cell])
+                style_id = prev_style_id
                 if style_id:
                     kwargs['stylename'] = self._styles_.get(style_id, None)
                 
                 ods_cell = odf.table.CoveredTableCell(**kwargs)
                 ods_row.addElement(ods_cell)
                 i += merge
+
+            if 'StyleID' in cell:
+                prev_style_id = cell.get('StyleID', None)
             
         return ods_row
 
-    def _find_prev_style(self, cells):
-        """
-        Поиск стиля определенного в предыдущей ячейке.
-
-        :param cells: Список предыдущих ячеек.
-        :return: Идентификатор исокмого стиля или None если стиль не определен.
-        """
-        for cell in reversed(cells):
-            if 'StyleID' in cell:
-                return cell.get('StyleID', None)
-        return None
-        
     def getCellValue(self, data_dict):
         """
         Получить значение ячейки.
@@ -992,11 +1133,18 @@ class icODS(object):
                 ods_data = odf.text.P(text=value)
         return ods_data
         
-    def load(self, filename):
+    def load(self, filename, sheet_name=None, row_limit=None, sheet_limit=None, used_styles_only=False):
         """
         Загрузить из ODS файла.
 
         :param filename: Имя ODS файла.
+        :param sheet_name: Имя листа, если необходимо прочитать только его.
+            None - читать все листы.
+        :param row_limit: Количество первых строк, читаемых из каждого листа.
+            None - читать все строки.
+        :param sheet_limit: Количество первых листов, читаемых из файла.
+            None - читать все листы.
+        :param used_styles_only: Читать только стили, используемые в прочитанных листах.
         :return: Словарь данных или None в случае ошибки.
         """
         if not os.path.exists(filename):
@@ -1004,8 +1152,20 @@ class icODS(object):
             log.warning(u'Файл <%s> не существует' % filename)
             return None
         else:
+            self._sheet_name = sheet_name
+            self._row_limit = row_limit
+            self._sheet_limit = sheet_limit
+            self._sheet_count = 0
+            self._used_styles_only = used_styles_only
+            self._automatic_styles_ = None
             try:
-                return self._loadODS(filename)
+                if config.get_cfg_var('ODS_STREAM_LOAD'):
+                    data = self._loadODSStream(filename)
+                else:
+                    data = self._loadODS(filename)
+                if used_styles_only:
+                    self._readUsedStyles(data)
+                return data
             except:
                 log.fatal(u'Ошибка открытия файла <%s>' % filename)
                 raise                
@@ -1025,7 +1185,134 @@ class icODS(object):
             workbook_data = self.readWorkbook(ods_workbooks[0])
             self.xmlss_data['children'].append(workbook_data)
         return self.xmlss_data
-    
+
+    def _loadODSStream(self, filename):
+        """
+        Загрузить из ODS файла потоковым парсером.
+        content.xml разбирается последовательно, прочитанные строки
+        сразу удаляются из дерева элементов, поэтому полный документ
+        в памяти не строится.
+
+        :param filename: Имя ODS файла.
+        :return: Словарь данных или None в случае ошибки.
+        """
+        self.xmlss_data = {'name': 'Calc', 'children': []}
+        with zipfile.ZipFile(filename) as ods_file:
+            # Стили документа находятся в styles.xml,
+            # автоматические стили ячеек, строк и колонок в начале content.xml
+            names = ods_file.namelist()
+            if 'styles.xml' in names:
+                with ods_file.open('styles.xml') as styles_file:
+                    styles_root = xml.etree.ElementTree.parse(styles_file).getroot()
+            else:
+                styles_root = xml.etree.ElementTree.Element('document-styles')
+            automatic_styles = xml.etree.ElementTree.Element(ODS_AUTOMATIC_STYLES_TAG)
+            styles = styles_root.find(ODS_STYLES_TAG)
+            master_styles = styles_root.find(ODS_MASTER_STYLES_TAG)
+            self.ods_document = icODSXMLDocument(automatic_styles,
+                                                 styles if styles is not None else xml.etree.ElementTree.Element(ODS_STYLES_TAG),
+                                                 master_styles if master_styles is not None else xml.etree.ElementTree.Element(ODS_MASTER_STYLES_TAG))
+
+            workbook_data = None
+            table_data = None
+            worksheet_data = None
+            ods_row_idx = 0
+            column_count = 0
+            parents = list()
+            with ods_file.open('content.xml') as content_file:
+                for event, element in xml.etree.ElementTree.iterparse(content_file, events=('start', 'end')):
+                    if event == 'start':
+                        parents.append(element)
+                        if element.tag == ODS_TABLE_TAG and self._isReadWorksheet(element.get(ODS_TABLE_NAME_ATTR)):
+                            if workbook_data is None:
+                                # В content.xml нет автоматических стилей
+                                workbook_data = {'name': 'Workbook', 'children': [self._readWorkbookStyles()]}
+                            worksheet_data, table_data = self._startWorksheet(icODSXMLElement(element))
+                            ods_row_idx = 0
+                            column_count = 0
+                        continue
+
+                    parents.pop()
+                    if element.tag == ODS_AUTOMATIC_STYLES_TAG:
+                        # Автоматические стили content.xml предшествуют
+                        # автоматическим стилям styles.xml как при загрузке ODFpy
+                        automatic_styles.extend(list(element))
+                        styles_automatic_styles = styles_root.find(ODS_AUTOMATIC_STYLES_TAG)
+                        if styles_automatic_styles is not None:
+                            automatic_styles.extend(list(styles_automatic_styles))
+                        if workbook_data is None:
+                            workbook_data = {'name': 'Workbook', 'children': [self._readWorkbookStyles()]}
+                    elif element.tag == ODS_COLUMN_TAG:
+                        if table_data is not None:
+                            table_data['children'].append(self.readColumn(icODSXMLElement(element)))
+                            column_count += 1
+                    elif element.tag == ODS_ROW_TAG:
+                        if table_data is not None and not self._isRowLimit(len(table_data['children']) - column_count):
+                            row_data = self.readRow(icODSXMLElement(element), table_data, worksheet_data, ods_row_idx)
+                            table_data['children'].append(row_data)
+                        ods_row_idx += 1
+                    elif element.tag == ODS_TABLE_TAG:
+                        if table_data is not None:
+                            self._stopWorksheet(worksheet_data, table_data)
+                            workbook_data['children'].append(worksheet_data)
+                            worksheet_data = None
+                            table_data = None
+                            self._sheet_count += 1
+                            if self._sheet_name is not None or self._isSheetLimit():
+                                # Нужные листы прочитаны
+                                break
+                    elif element.tag == ODS_SPREADSHEET_TAG:
+                        break
+                    else:
+                        continue
+
+                    # Освободить память, занятую прочитанным элементом
+                    element.clear()
+                    if parents:
+                        parents[-1].remove(element)
+
+            if workbook_data is None:
+                # В content.xml нет автоматических стилей
+                workbook_data = {'name': 'Workbook', 'children': [self._readWorkbookStyles()]}
+            self.xmlss_data['children'].append(workbook_data)
+        return self.xmlss_data
+
+    def _isReadWorksheet(self, name):
+        """
+        Необходимо читать лист с указанным именем?
+        """
+        if self._isSheetLimit():
+            return False
+        return self._sheet_name is None or self._sheet_name == name
+
+    def _isSheetLimit(self):
+        """
+        Прочитано ограничиваемое количество листов?
+        """
+        return self._sheet_limit is not None and self._sheet_count >= self._sheet_limit
+
+    def _isRowLimit(self, row_count):
+        """
+        Прочитано ограничиваемое количество строк листа?
+
+        :param row_count: Количество прочитанных строк.
+        """
+        return self._row_limit is not None and row_count >= self._row_limit
+
+    def _findAutomaticStyle(self, style_name):
+        """
+        Найти автоматический стиль по имени.
+        Словарь автоматических стилей строится при первом обращении.
+
+        :param style_name: Имя стиля.
+        :return: ODS стиль или None, если стиль не найден.
+        """
+        if self._automatic_styles_ is None:
+            self._automatic_styles_ = dict()
+            for ods_style in self.ods_document.automaticstyles.getElementsByType(odf.style.Style):
+                self._automatic_styles_.setdefault(ods_style.getAttribute('name'), ods_style)
+        return self._automatic_styles_.get(style_name, None)
+
     def readWorkbook(self, ods_element=None):
         """
         Прочитать из ODS файла данные о книге.
@@ -1034,14 +1321,17 @@ class icODS(object):
         """
         data = {'name': 'Workbook', 'children': []}
         
-        styles_data = self.readStyles()
+        styles_data = self._readWorkbookStyles()
         data['children'].append(styles_data)
         
         ods_tables = ods_element.getElementsByType(odf.table.Table)
         if ods_tables:
             for ods_table in ods_tables:
+                if not self._isReadWorksheet(ods_table.getAttribute('name')):
+                    continue
                 worksheet_data = self.readWorksheet(ods_table)
                 data['children'].append(worksheet_data)
+                self._sheet_count += 1
         
         return data
 
@@ -1067,11 +1357,39 @@ class icODS(object):
         # log.debug(u'Числовые стили <%s>' % result)
         return result
         
-    def readStyles(self, ods_element=None):
+    def _readWorkbookStyles(self):
+        """
+        Прочитать стили книги.
+        Если читаются только используемые стили, то они читаются
+        после листов (см. _readUsedStyles), а пока список стилей пустой.
+        """
+        if self._used_styles_only:
+            return {'name': 'Styles', 'children': []}
+        return self.readStyles()
+
+    def _readUsedStyles(self, data):
+        """
+        Прочитать стили, используемые в прочитанных листах книг.
+
+        :param data: Словарь данных.
+        """
+        for workbook_data in data['children']:
+            style_names = set([DEFAULT_STYLE_ID])
+            for element in workbook_data['children']:
+                if element['name'] == 'Worksheet':
+                    icprototype.get_style_ids(element, style_names)
+            for element in workbook_data['children']:
+                if element['name'] == 'Styles':
+                    element['children'] = self.readStyles(style_names=style_names)['children']
+        return data
+
+    def readStyles(self, ods_element=None, style_names=None):
         """
         Прочитать из ODS файла данные о стилях.
 
         :param ods_element: ODS элемент соответствующий стилям книги Excel.
+        :param style_names: Множество имен читаемых стилей.
+            None - читать все стили.
         """
         data = {'name': 'Styles', 'children': []}
         ods_styles = self.ods_document.automaticstyles.getElementsByType(odf.style.Style) + \
@@ -1086,6 +1404,8 @@ class icODS(object):
         # log.debug('STYLES <%s>' % ods_styles)
         
         for ods_style in ods_styles:
+            if style_names is not None and ods_style.getAttribute('name') not in style_names:
+                continue
             style = self.readStyle(ods_style)
             data['children'].append(style)
                         
@@ -1424,27 +1744,57 @@ class icODS(object):
 
         :param ods_element: ODS элемент соответствующий листу.
         """
-        data = {'name': 'Worksheet', 'children': []}
-        name = ods_element.getAttribute('name')
+        data, table = self._startWorksheet(ods_element)
 
-        # log.debug('WORKSHEET: <%s : %s>' % (type(name), name))
-        
-        data['Name'] = name
-        
-        table = {'name': 'Table', 'children': []}
-        
         # Колонки
         ods_columns = ods_element.getElementsByType(odf.table.TableColumn)
         for ods_column in ods_columns:
             column_data = self.readColumn(ods_column)
             table['children'].append(column_data)
+        column_count = len(table['children'])
             
         # Строки
         ods_rows = ods_element.getElementsByType(odf.table.TableRow)
         for i, ods_row in enumerate(ods_rows):
+            if self._isRowLimit(len(table['children']) - column_count):
+                break
             row_data = self.readRow(ods_row, table, data, i)
             table['children'].append(row_data)
-      
+
+        self._stopWorksheet(data, table)
+        return data
+
+    def _startWorksheet(self, ods_element):
+        """
+        Начать чтение листа.
+
+        :param ods_element: ODS элемент соответствующий листу.
+        :return: Кортеж (словарь листа, словарь таблицы листа).
+        """
+        data = {'name': 'Worksheet', 'children': []}
+        name = ods_element.getAttribute('name')
+
+        # log.debug('WORKSHEET: <%s : %s>' % (type(name), name))
+        
+        data['Name'] = name
+        
+        table = {'name': 'Table', 'children': []}
+        return data, table
+
+    def _stopWorksheet(self, data, table):
+        """
+        Завершить чтение листа.
+
+        :param data: Словарь листа.
+        :param table: Словарь таблицы листа.
+        """
+        if self._row_limit is not None:
+            # Повторяющиеся строки могли превысить ограничение
+            rows = [element for element in table['children'] if element['name'] == 'Row']
+            if len(rows) > self._row_limit:
+                table['children'] = [element for element in table['children']
+                                     if element['name'] != 'Row'] + rows[:self._row_limit]
+
         data['children'].append(table)
         
         # Параметры страницы
@@ -1452,7 +1802,6 @@ class icODS(object):
         worksheet_options = self.readWorksheetOptions(ods_pagelayouts)
         if worksheet_options:
             data['children'].append(worksheet_options)
-        
         return data
     
     def readWorksheetOptions(self, ods_page_layouts):
@@ -1609,10 +1958,8 @@ class icODS(object):
         if style_name:
             # Определение ширины колонки
             column_width = None
-            ods_styles = self.ods_document.automaticstyles.getElementsByType(odf.style.Style)
-            find_style = [ods_style for ods_style in ods_styles if ods_style.getAttribute('name') == style_name]
-            if find_style:
-                ods_style = find_style[0]
+            ods_style = self._findAutomaticStyle(style_name)
+            if ods_style is not None:
                 ods_column_properties = ods_style.getElementsByType(odf.style.TableColumnProperties)
                 if ods_column_properties:
                     ods_column_property = ods_column_properties[0]
@@ -1721,10 +2068,8 @@ class icODS(object):
         if style_name:
             # Определение высоты строки
             row_height = None
-            ods_styles = self.ods_document.automaticstyles.getElementsByType(odf.style.Style)
-            find_style = [ods_style for ods_style in ods_styles if ods_style.getAttribute('name') == style_name]
-            if find_style:
-                ods_style = find_style[0]
+            ods_style = self._findAutomaticStyle(style_name)
+            if ods_style is not None:
                 ods_row_properties = ods_style.getElementsByType(odf.style.TableRowProperties)
                 if ods_row_properties:
                     ods_row_property = ods_row_properties[0]
@@ -1806,6 +2151,8 @@ class icODS(object):
         :param attr_name: Имя атрибута.
         :return: True/False.
         """
+        if isinstance(ods_element, icODSXMLElement):
+            return ods_element.hasAttribute(attr_name)
         return attr_name in [attr[-1].replace('-', '') for attr in ods_element.attributes.keys()]
         
     def readCell(self, ods_element=None, index=None):
@@ -1,11 +1,67 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-__version__ = (0, 1, 2, 1)
+__version__ = (0, 1, 2, 2)
 
 PROTOTYPE_ATTR_NAMES = ('name', 'children', 'crc', 'value')
 
 
+def copy_attributes(attrs):
+    """
+    Копия дерева атрибутов.
+    Копируются только словари атрибутов и списки дочерних элементов,
+    значения атрибутов разделяются с оригиналом.
+    Работает значительно быстрее copy.deepcopy.
+
+    :param attrs: Словарь атрибутов элемента.
+    :return: Копия словаря атрибутов.
+    """
+    new_attrs = dict(attrs)
+    children = attrs.get('children', None)
+    if children:
+        new_attrs['children'] = [copy_attributes(child) for child in children]
+    elif children is not None:
+        new_attrs['children'] = []
+    return new_attrs
+
+
+def replace_style_ids(attrs, style_id_map):
+    """
+    Заменить идентификаторы стилей в дереве атрибутов за один проход.
+
+    :param attrs: Словарь атрибутов элемента.
+    :param style_id_map: Словарь замены старый идентификатор стиля:новый идентификатор стиля.
+    :return: Словарь атрибутов элемента.
+    """
+    if 'StyleID' in attrs:
+        attrs['StyleID'] = style_id_map.get(attrs['StyleID'], attrs['StyleID'])
+    children = attrs.get('children', None)
+    if children:
+        for child in children:
+            replace_style_ids(child, style_id_map)
+    return attrs
+
+
+def get_style_ids(attrs, style_ids=None):
+    """
+    Собрать идентификаторы стилей, используемые в дереве атрибутов.
+
+    :param attrs: Словарь атрибутов элемента.
+    :param style_ids: Множество, в которое добавляются идентификаторы стилей.
+        Если не определено, то создается новое.
+    :return: Множество идентификаторов стилей.
+    """
+    if style_ids is None:
+        style_ids = set()
+    if 'StyleID' in attrs:
+        style_ids.add(attrs['StyleID'])
+    children = attrs.get('children', None)
+    if children:
+        for child in children:
+            get_style_ids(child, style_ids)
+    return style_ids
+
+
 class icVPrototype(object):
     """
     Прототип объектов Virtual Excel.
@@ -360,3 +416,62 @@ class icVIndexedPrototype(icVPrototype):
                     flag = False
 
         return indexes, ret_attr
+
+
+class icVChildrenIndex(object):
+    """
+    Индекс дочерних элементов.
+    Индекс строится за один проход по дочерним элементам и дополняется
+    при добавлении элементов в конец списка. При других изменениях
+    состава элементов индекс перестраивается при следующем обращении.
+    """
+    def __init__(self, attrs):
+        """
+        Конструктор.
+
+        :param attrs: Атрибуты индексируемого элемента.
+        """
+        self.attrs = attrs
+        # Проиндексированный список дочерних элементов
+        self._children = None
+        # Количество проиндексированных элементов
+        self._count = 0
+        # Последний проиндексированный элемент
+        self._last = None
+
+    def clear(self):
+        """
+        Очистить индекс.
+        """
+        pass
+
+    def indexElements(self, elements):
+        """
+        Добавить элементы в индекс.
+
+        :param elements: Список атрибутов добавляемых элементов.
+        """
+        pass
+
+    def reset(self):
+        """
+        Сбросить индекс. Индекс будет перестроен при следующем обращении.
+        """
+        self._children = None
+
+    def update(self):
+        """
+        Привести индекс в соответствие с дочерними элементами.
+        """
+        children = self.attrs['children']
+        count = len(children)
+        if children is not self._children or count < self._count or \
+                (self._count and children[self._count - 1] is not self._last):
+            self._children = children
+            self._count = 0
+            self.clear()
+        if count != self._count:
+            self.indexElements(children[self._count:])
+            self._count = count
+            self._last = children[-1]
+        return self
@@ -11,7 +11,7 @@ except ImportError:
     import icprototype
     import iccell
 
-__version__ = (0, 1, 2, 1)
+__version__ = (0, 1, 2, 2)
 
 RANGE_ROW_IDX = 0
 RANGE_COL_IDX = 1
@@ -19,6 +19,46 @@ RANGE_HEIGHT_IDX = 2
 RANGE_WIDTH_IDX = 3
 
 
+def _get_sequence(values):
+    """
+    Привести последовательность значений к списку.
+    Массивы NumPy и объекты с буферным протоколом преобразуются в списки.
+
+    :param values: Последовательность значений.
+    :return: Список или кортеж значений или None, если это не последовательность.
+    """
+    if isinstance(values, (list, tuple)):
+        return values
+    if isinstance(values, (str, bytes, bytearray)):
+        return None
+    if not hasattr(values, 'tolist'):
+        try:
+            values = memoryview(values)
+        except TypeError:
+            return None
+    return values.tolist()
+
+
+def get_value_rows(values):
+    """
+    Привести двумерный блок значений к списку строк.
+    Массивы NumPy и объекты с буферным протоколом преобразуются в списки,
+    в том числе и строки блока.
+    Одномерная последовательность считается одной строкой.
+
+    :param values: Двумерная последовательность значений.
+    :return: Список строк значений.
+    """
+    if values is None:
+        return list()
+    seq_values = _get_sequence(values)
+    rows = list(values if seq_values is None else seq_values)
+    row_lists = [_get_sequence(row_values) for row_values in rows]
+    if rows and all(row_list is None for row_list in row_lists):
+        return [rows]
+    return [row_values if row_list is None else row_list for row_values, row_list in zip(rows, row_lists)]
+
+
 class icVRange(icprototype.icVPrototype):
     """
     Диапазон ячеек. Необходим для групповых операций над ячейками.
@@ -57,17 +97,17 @@ class icVRange(icprototype.icVPrototype):
         self._address = [self.row, self.col, self.height, self.width]
         return self._address
 
-    def setValues(self, values=None):
+    def setValues(self, values=None, style_id=None):
         """
         Установить значения в диапазоне.
+        Значения, не попадающие в диапазон, отбрасываются.
+
+        :param values: Двумерная последовательность значений:
+            список строк, массив NumPy или объект, поддерживающий буферный протокол.
+        :param style_id: Идентификатор общего стиля ячеек диапазона.
         """
-        for i_row, row in enumerate(values):
-            if i_row < self.height:
-                for i_col, col in enumerate(row):
-                    if i_col < self.width:
-                        cell = self._parent.getCell(self.row+i_row, self.col+i_col)
-                        value = col
-                        cell.setValue(value)
+        values = [row_values[:self.width] for row_values in get_value_rows(values)[:self.height]]
+        return self._parent.setValues(self.row, self.col, values, style_id)
 
     def setStyle(self, alignment=None,
                  borders=None, font=None, interior=None,
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import hashlib
+import re
 
 try:
     from . import icprototype
@@ -13,6 +13,154 @@ __version__ = (0, 1, 2, 1)
 
 COLOR_ENUM = ('#000000',)
 
+# Формат генерируемых идентификаторов стилей
+STYLE_ID_FMT = 'text%d'
+# Шаблон идентификатора стиля с номером в конце
+STYLE_ID_NUM_PATTERN = re.compile(r'^\D*(\d+)$')
+
+
+def get_element_fingerprint(element_name, element):
+    """
+    Отпечаток элемента стиля.
+    Отпечаток не зависит от порядка атрибутов и дочерних элементов.
+    Логические значения приводятся к целым, остальные значения к строкам.
+
+    :param element_name: Имя элемента стиля.
+    :param element: Словарь атрибутов элемента стиля.
+    :return: Кортеж, который можно использовать как ключ словаря.
+    """
+    attrs = tuple(sorted([(key, str(int(value)) if isinstance(value, bool) else str(value))
+                          for key, value in element.items() if key not in icprototype.PROTOTYPE_ATTR_NAMES]))
+    children = tuple(sorted([get_element_fingerprint(child.get('name'), child)
+                             for child in element.get('children', None) or ()]))
+    return element_name, attrs, children
+
+
+def get_style_fingerprint(style_attrs):
+    """
+    Отпечаток содержания стиля.
+
+    :param style_attrs: Атрибуты стиля.
+    :return: Кортеж, который можно использовать как ключ словаря.
+    """
+    return tuple(sorted([get_element_fingerprint(element.get('name'), element)
+                         for element in style_attrs['children']]))
+
+
+def get_style_elements_fingerprint(alignment=None,
+                                   borders=None, font=None, interior=None,
+                                   number_format=None):
+    """
+    Отпечаток содержания стиля по его элементам.
+    Не заполненные элементы не учитываются.
+
+    :return: Кортеж, который можно использовать как ключ словаря.
+    """
+    elements = (('Alignment', alignment), ('Borders', borders), ('Font', font),
+                ('Interior', interior), ('NumberFormat', number_format))
+    return tuple(sorted([get_element_fingerprint(element_name, element)
+                         for element_name, element in elements if element]))
+
+
+class icVStylesIndex(icprototype.icVChildrenIndex):
+    """
+    Индекс стилей: идентификатор <-> отпечаток содержания стиля.
+    """
+    def __init__(self, attrs):
+        """
+        Конструктор.
+        """
+        icprototype.icVChildrenIndex.__init__(self, attrs)
+        self.clear()
+
+    def clear(self):
+        """
+        Очистить индекс.
+        """
+        # Словарь идентификатор стиля:атрибуты стиля
+        self.styles = dict()
+        # Словарь отпечаток содержания стиля:идентификатор стиля
+        self.fingerprints = dict()
+        # Словарь идентификатор стиля:отпечаток содержания стиля
+        self.style_fingerprints = dict()
+        # Максимальный номер в идентификаторах стилей
+        self.max_id_num = 0
+
+    def indexElements(self, elements):
+        """
+        Добавить стили в индекс.
+        """
+        for style_attrs in elements:
+            self._addStyle(style_attrs)
+
+    def _addStyle(self, style_attrs):
+        """
+        Добавить стиль в индекс.
+        """
+        style_id = style_attrs.get('ID', None)
+        if style_id is None or style_id in self.styles:
+            return
+        fingerprint = get_style_fingerprint(style_attrs)
+        self.styles[style_id] = style_attrs
+        self.style_fingerprints[style_id] = fingerprint
+        self.fingerprints.setdefault(fingerprint, style_id)
+
+        match = STYLE_ID_NUM_PATTERN.match(style_id)
+        if match:
+            self.max_id_num = max(self.max_id_num, int(match.group(1)))
+
+    def _delStyle(self, style_id, style_attrs):
+        """
+        Удалить стиль из индекса.
+
+        :return: True - стиль был в индексе, False - нет.
+        """
+        if self.styles.get(style_id, None) is not style_attrs:
+            return False
+        del self.styles[style_id]
+        fingerprint = self.style_fingerprints.pop(style_id, None)
+        if self.fingerprints.get(fingerprint, None) == style_id:
+            del self.fingerprints[fingerprint]
+        return True
+
+    def updateStyle(self, style_attrs, style_id=None):
+        """
+        Обновить стиль в индексе после изменения его содержания или идентификатора.
+
+        :param style_attrs: Атрибуты стиля.
+        :param style_id: Идентификатор стиля до изменения.
+            Если не определен, то берется текущий идентификатор стиля.
+        """
+        if style_id is None:
+            style_id = style_attrs.get('ID', None)
+        if self._delStyle(style_id, style_attrs):
+            self._addStyle(style_attrs)
+
+    def findStyleID(self, fingerprint):
+        """
+        Поиск идентификатора стиля по отпечатку его содержания.
+        Если найденный стиль был изменен в обход индекса,
+        то индекс перестраивается.
+
+        :return: Идентификатор стиля или None, если стиль не найден.
+        """
+        style_id = self.fingerprints.get(fingerprint, None)
+        if style_id is not None:
+            style_attrs = self.styles[style_id]
+            if style_attrs.get('ID', None) != style_id or get_style_fingerprint(style_attrs) != fingerprint:
+                self.reset()
+                style_id = self.update().fingerprints.get(fingerprint, None)
+        return style_id
+
+    def newStyleID(self):
+        """
+        Новый не занятый идентификатор стиля.
+        """
+        i = self.max_id_num + 1
+        while (STYLE_ID_FMT % i) in self.styles:
+            i += 1
+        return STYLE_ID_FMT % i
+
 
 class icVStyles(icprototype.icVPrototype):
     """
@@ -24,35 +172,49 @@ class icVStyles(icprototype.icVPrototype):
         """
         icprototype.icVPrototype.__init__(self, parent, *args, **kwargs)
         self._attributes = {'name': 'Styles', 'children': []}
-        self._style_dict = {}
-        
-        # Словарь контрольная сумма содержания стиля:словарь атрибутов стиля
-        self._md5_styles_dict = {}
-        
-        # Максимальный идентификатор стиля (введен для оптимизации)
-        self.max_style_id = None
-        
-    def getMaxStyleID(self):
-        if self.max_style_id is None:
-            styles_id = self.getStylesID()
-            if styles_id:
-                self.max_style_id = max(styles_id)
+
+        # Индекс стилей
+        self._index = None
+
+    def getIndex(self):
+        """
+        Индекс стилей.
+        Индекс хранится в объекте приложения и разделяется всеми
+        объектами стилей, созданными для одних и тех же данных.
+        """
+        if self._index is None or self._index.attrs is not self._attributes:
+            get_styles_index = getattr(self.getApp(), 'getStylesIndex', None)
+            if get_styles_index:
+                self._index = get_styles_index(self._attributes)
             else:
-                self.max_style_id = 's0'
-        return self.max_style_id
+                self._index = icVStylesIndex(self._attributes)
+        return self._index.update()
+
+    def getMaxStyleID(self):
+        """
+        Идентификатор стиля с максимальным номером.
+        """
+        return STYLE_ID_FMT % self.getIndex().max_id_num
+
+    def newStyleID(self):
+        """
+        Новый не занятый идентификатор стиля.
+        """
+        return self.getIndex().newStyleID()
 
     def get_style_dict(self):
         """
         Словарь стилей по их идентификаторам.
         """
-        return self._style_dict
+        return self.getIndex().styles
 
     def init_style_dict(self):
         """
         Инициализация словаря стилей.
         """
-        self._style_dict = dict([(style['ID'], style) for style in self._attributes['children']])
-        return self._style_dict
+        index = self.getIndex()
+        index.reset()
+        return index.update().styles
 
     style_dict = property(get_style_dict)
 
@@ -62,12 +224,6 @@ class icVStyles(icprototype.icVPrototype):
         """
         style = icVStyle(self)
         attrs = style.create()
-
-        if self._style_dict is None:
-            self.init_style_dict()
-        else:
-            # Просто добавить стиль с словарь стилей (для увеличения производительности)
-            self._style_dict[attrs['ID']] = attrs
         return style
 
     def getStyle(self, style_id):
@@ -75,260 +231,41 @@ class icVStyles(icprototype.icVPrototype):
         Поиск стиля по идентификатору.
         """
         style = None
-        if style_id in self._style_dict:
-            style = icVStyle(self)
-            style.set_attributes(self._style_dict[style_id])
-        else:
+        index = self.getIndex()
+        style_attrs = index.styles.get(style_id, None)
+        if style_attrs is None or style_attrs.get('ID', None) != style_id:
             # Попробовать поискать в списке
             find_style = [style_attr for style_attr in self._attributes['children']
                           if style_attr['name'] == 'Style' and style_attr['ID'] == style_id]
-            if find_style:
-                style = icVStyle(self)
-                style.set_attributes(find_style[0])
-                # Блин рассинхронизация произошла со словарем
-                self.init_style_dict()
+            style_attrs = find_style[0] if find_style else None
+            if style_attrs is not None:
+                # Блин рассинхронизация произошла с индексом
+                index.reset()
+
+        if style_attrs is not None:
+            style = icVStyle(self)
+            style.set_attributes(style_attrs)
 
         # Если такой стиль не найден, тогда вернуть стиль по умолчанию
         if style is None and style_id != 'Default':
             return self.getStyle('Default')
         return style
 
-    def _equalStyleElement(self, style_element_attr1, style_element_attr2):
-        """
-        Сравнение элементов стилей.
-
-        :return: True - элементы равны, False - не равны.
-        """
-        if ((style_element_attr1 is None) and (style_element_attr2 is not None)) or \
-           ((style_element_attr1 is not None) and (style_element_attr2 is None)):
-            return False
-            
-        attrs1 = dict([item for item in style_element_attr1.items() if item[0] not in icprototype.PROTOTYPE_ATTR_NAMES])
-        attrs2 = dict([item for item in style_element_attr2.items() if item[0] not in icprototype.PROTOTYPE_ATTR_NAMES])
-        equal = True
-        for item in attrs1.items():
-            try:
-                if item[1] == attrs2[item[0]]:
-                    pass
-                elif type(item[1]) != type(attrs2[item[0]]):
-                    value1 = item[1]
-                    if isinstance(value1, bool):
-                        value1 = int(value1)
-                    value2 = attrs2[item[0]]
-                    if isinstance(value2, bool):
-                        value2 = int(value2)
-                    equal = equal and (str(value1) == str(value2))
-                else:
-                    equal = False
-            except KeyError:
-                return False
-
-            if equal is False:
-                break
-
-        # Если определены дочерние елементы, то рекурсивно проверить и их
-        if equal:
-            if ('children' in style_element_attr1 and style_element_attr1['children']) or \
-               ('children' in style_element_attr2 and style_element_attr2['children']):
-
-                children1 = style_element_attr1['children']
-                children2 = style_element_attr2['children']
-
-                if len(children1) != len(children2):
-                    return False
-
-                for i, child1 in enumerate(children1):
-                    child2 = children2[i]
-                    equal = equal and self._equalStyleElement(child1, child2)
-
-                    if equal is False:
-                        break
-                
-        return equal
-
-    def _compare_style_element(self, element, element_name, style):
-        """
-        Сравнение елемента стиля.
-        """
-        if element:
-            elements = [el for el in style['children'] if el['name'] == element_name]
-            if elements:
-                equal = self._equalStyleElement(elements[0], element)
-            else:
-                equal = False
-        else:
-            equal = True
-        return equal
-
-    def _compare_style_elements(self, style,
-                                alignment=None,
-                                borders=None, font=None, interior=None,
-                                number_format=None):
-        """
-        Сравнение элементов стиля.
-        """
-        equal_align = self._compare_style_element(alignment, 'Alignment', style)
-        equal_border = self._compare_style_element(borders, 'Borders', style)
-        equal_font = self._compare_style_element(font, 'Font', style)
-        equal_interior = self._compare_style_element(interior, 'Interior', style)
-        equal_n_fmt = self._compare_style_element(number_format, 'NumberFormat', style)
-        return equal_align and equal_border and equal_font and equal_interior and equal_n_fmt
-
     def findStyle(self, alignment=None,
                   borders=None, font=None, interior=None,
                   number_format=None):
         """
         Поиск стиля по его содержанию.
         """
-        find_style = None
-
-        md5_style = self._calcCrcStyleAttr(alignment, borders, font, interior, number_format)
-
-        find_result = md5_style in self._md5_styles_dict
-        if not find_result:
-            # Надо поискать стиль
-            for i in range(len(self._attributes['children'])):
-                style = self._attributes['children'][-i]
-                # Если количество элементов стиля не совпадает с количеством
-                # искомых элементов, то эти стили не равны
-                if len(style['children']) != len([element for element in [alignment, borders, font, interior,
-                                                                          number_format] if element is not None]):
-                    find_result = False
-                    continue
-            
-                find_result = self._compare_style_elements(style, alignment, borders, font, interior, number_format)
-
-                if find_result:
-                    find_style = style
-                    break
-        else:
-            # Искомый стиль есть в хеше
-            find_style = self._md5_styles_dict[md5_style]
-
-        if find_result:
+        fingerprint = get_style_elements_fingerprint(alignment, borders, font, interior, number_format)
+        index = self.getIndex()
+        style_id = index.findStyleID(fingerprint)
+        if style_id is not None:
             style = icVStyle(self)
-            if find_style:
-                style.set_attributes(find_style)
-                # Прописать в хэшэ
-                self._md5_styles_dict[md5_style] = find_style
+            style.set_attributes(index.styles[style_id])
             return style
         return None
 
-    def _getCrcElementStr(self, element):
-        """
-        Представить в строковом виде элемент без дополнительных полей.
-        """
-        return str(dict([(key, element[key]) for key in element.keys() \
-                         if key not in icprototype.PROTOTYPE_ATTR_NAMES]))
-        
-    def _getCrcAlignmentStr(self, style):
-        """
-        Выравнивание в строковом представлении (для вычисления контрольной суммы).
-        """
-        align = [element for element in style['children'] if element['name'] == 'Alignment']
-        if align:
-            return self._getCrcElementStr(align[0])
-        return ''        
-        
-    def _getCrcBordersStr(self, style):
-        """
-        Обрамление в строковом представлении (для вычисления контрольной суммы).
-        """
-        borders = [element for element in style['children'] if element['name'] == 'Borders']
-        if borders:
-            borders_str = ''
-            for border in borders[0]['children']:
-                borders_str += self._getCrcElementStr(border)
-            return borders_str
-        return ''        
-
-    def _getCrcFontStr(self, style):
-        """
-        Шрифт в строковом представлении (для вычисления контрольной суммы).
-        """
-        font = [element for element in style['children'] if element['name'] == 'Font']
-        if font:
-            return self._getCrcElementStr(font[0])
-        return ''        
-        
-    def _getCrcInteriorStr(self, style):
-        """
-        Интерьер в строковом представлении (для вычисления контрольной суммы).
-        """
-        interior = [element for element in style['children'] if element['name'] == 'Interior']
-        if interior:
-            return self._getCrcElementStr(interior[0])
-        return ''        
-        
-    def _getCrcNumberFormatStr(self, style):
-        """
-        Формат чисел в строковом представлении (для вычисления контрольной суммы).
-        """
-        num_fmt = [element for element in style['children'] if element['name'] == 'NumberFormat']
-        if num_fmt:
-            return self._getCrcElementStr(num_fmt[0])
-        return ''        
-    
-    def _calcCrcStyleAttr(self, alignment=None,
-                          borders=None, font=None, interior=None,
-                          number_format=None):
-        """
-        Вычислить контрольную сумму по атрибутам.
-        """
-        new_style_attr = {'children': []}
-        if alignment:
-            alignment['name'] = 'Alignment'
-            new_style_attr['children'].append(alignment)
-        if borders:
-            borders['name'] = 'Borders'
-            new_style_attr['children'].append(borders)
-        if font:
-            font['name'] = 'Font'
-            new_style_attr['children'].append(font)
-        if interior:
-            interior['name'] = 'Interior'
-            new_style_attr['children'].append(interior)
-        if number_format:
-            number_format['name'] = 'NumberFormat'
-            new_style_attr['children'].append(number_format)
-        return self._getCrcStyle(new_style_attr)
-        
-    def _getCrcStyle(self, style):
-        """
-        Контрольная сумма содержания стиля.
-        """
-        style_str = ''
-        # Alignment
-        style_str += self._getCrcAlignmentStr(style)
-        # Borders
-        style_str += self._getCrcBordersStr(style)
-        # Font
-        style_str += self._getCrcFontStr(style)
-        # Interior
-        style_str += self._getCrcInteriorStr(style)
-        # NumberFormat
-        style_str += self._getCrcNumberFormatStr(style)
-        return hashlib.md5(style_str).hexdigest()
-
-    def _delCrcStyle(self, crc_style):
-        """
-        Удалить стиль из кеша.
-        """
-        if crc_style in self._md5_styles_dict:
-            del self._md5_styles_dict[crc_style]
-            
-    def _isCrcStyleID(self, style_id):
-        """
-        Есть ли в кеше стиль с таким идентификатором?
-
-        :return: Возвращает контрольную сумму стиля в кеше или None,
-            если стиль не найден.
-        """
-        result = [i_style for i_style in self._md5_styles_dict.items() if i_style[1]['ID'] == style_id]
-        if result:
-            return result[0][0]
-        return None
-        
     def getStylesID(self):
         """
         Список идентификаторов стилей.
@@ -359,37 +296,33 @@ class icVStyles(icprototype.icVPrototype):
         """
         # Создать стиль по умолчанию если он создан
         self._createDefaultStyle()
-        
-        del_styles_id = []
-        styles_id = self.getStylesID()
+
+        # Стили ячеек упакованных таблиц учитываются после их распаковки
+        unpack_all = getattr(self.getApp(), 'unpackAll', None)
+        if unpack_all:
+            unpack_all()
+
         # Определение идентификаторов используемых стилей
-        used_styles_id = ['Default']
+        used_styles_id = set(['Default'])
         work_sheets = [element for element in self._parent._attributes['children'] if element['name'] == 'Worksheet']
         for work_sheet in work_sheets:
             tables = [element for element in work_sheet['children'] if element['name'] == 'Table']
             for table in tables:
                 if 'StyleID' in table:
-                    style_id = table['StyleID']
-                    if style_id not in used_styles_id:
-                        used_styles_id.append(style_id)
+                    used_styles_id.add(table['StyleID'])
                 for tab_element in table['children']:
                     if 'StyleID' in tab_element:
-                        style_id = tab_element['StyleID']
-                        if style_id not in used_styles_id:
-                            used_styles_id.append(style_id)
+                        used_styles_id.add(tab_element['StyleID'])
                     if tab_element['name'] == 'Row':
                         for cell in tab_element['children']:
                             if 'StyleID' in cell:
-                                style_id = cell['StyleID']
-                                if style_id not in used_styles_id:
-                                    used_styles_id.append(style_id)
-                                    
-        for style_id in styles_id:
-            if style_id not in used_styles_id:
-                result = self.delStyleByID(style_id)
-                if result:
-                    del_styles_id.append(style_id)
-                
+                                used_styles_id.add(cell['StyleID'])
+
+        # Удаление за один проход по списку стилей
+        styles = self._attributes['children']
+        del_styles_id = [style['ID'] for style in styles if style['ID'] not in used_styles_id]
+        if del_styles_id:
+            styles[:] = [style for style in styles if style['ID'] in used_styles_id]
         return del_styles_id
                 
     def delStyleByID(self, style_id):
@@ -431,20 +364,18 @@ class icVStyle(icprototype.icVPrototype):
 
         :param id_name: Имя идентификатора.
         """
+        style_id = self._attributes['ID']
         self._attributes['ID'] = str(id_name)
+
+        if self._parent:
+            # Перерегистрировать стиль в индексе под новым идентификатором
+            self._parent.getIndex().updateStyle(self._attributes, style_id)
     
     def newID(self):
         """
         Генерация нового идетификатора стиля.
         """
-        max_style_id = self._parent.getMaxStyleID()
-        max_str_i = ''.join([symb for symb in max_style_id if symb.isdigit()])
-        i = int(max_str_i)+1 if max_str_i else 0
-        new_id = 'text' + str(i)
-
-        # Запомнить максимальный идентификатор стиля
-        self._parent.max_style_id = new_id
-        return new_id
+        return self._parent.newStyleID()
 
     def newID_depricated(self):
         """
@@ -512,9 +443,8 @@ class icVStyle(icprototype.icVPrototype):
         self._attributes['children'] = style_attrs
         
         if self._parent:
-            md5_attrs = self._parent._isCrcStyleID(self.getID())
-            if md5_attrs:
-                self._parent._delCrcStyle(md5_attrs)
+            # Обновить отпечаток содержания стиля в индексе
+            self._parent.getIndex().updateStyle(self._attributes)
         return self._attributes
 
     def getAttrs(self):
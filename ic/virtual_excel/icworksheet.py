@@ -7,6 +7,7 @@ import copy
 try:
     from . import icprototype
     from . import icrange
+    from . import iccell
     from . import paper_size
     from . import config
     from . import icexceptions
@@ -14,6 +15,7 @@ except ImportError:
     # Для запуска тестов
     import icprototype
     import icrange
+    import iccell
     import paper_size
     import config
     import icexceptions
@@ -102,6 +104,8 @@ class icVWorksheet(icprototype.icVPrototype):
         Таблица.
         """
         if self._table:
+            # Упакованная таблица распаковывается при обращении к ней
+            self._table.unpack()
             return self._table
 
         tab_attr = [element for element in self._attributes['children'] if element['name'] == 'Table']
@@ -109,6 +113,8 @@ class icVWorksheet(icprototype.icVPrototype):
         if tab_attr:
             self._table = icVTable(self)
             self._table.set_attributes(tab_attr[0])
+            # Распаковка производится в тот же словарь атрибутов
+            self._table.unpack()
         else:
             self.createTable()
         return self._table
@@ -119,6 +125,18 @@ class icVWorksheet(icprototype.icVPrototype):
         """
         return self.getTable().getCell(row, col)
 
+    def setValues(self, row, col, values, style_id=None):
+        """
+        Записать двумерный блок значений начиная с ячейки (row, col).
+
+        :param row: Номер первой строки блока.
+        :param col: Номер первой колонки блока.
+        :param values: Двумерная последовательность значений:
+            список строк, массив NumPy или объект, поддерживающий буферный протокол.
+        :param style_id: Идентификатор общего стиля ячеек блока.
+        """
+        return self.getTable().setValues(row, col, values, style_id)
+
     def getRange(self, row, col, height, width):
         """
         Диапазон ячеек.
@@ -188,7 +206,12 @@ class icVWorksheet(icprototype.icVPrototype):
         Создать клон листа и добавить его в книгу.
         param new_name: Новое имя листа.
         """
-        new_attributes = copy.deepcopy(self._attributes)
+        clone_table = getattr(self.getApp(), 'cloneTable', None)
+        new_attributes = dict(self._attributes)
+        # Данные таблицы разделяются с клоном до первого обращения к ним
+        new_attributes['children'] = [clone_table(element) if clone_table and element['name'] == 'Table'
+                                      else icprototype.copy_attributes(element)
+                                      for element in self._attributes['children']]
         new_attributes['Name'] = new_name
 
         new_worksheet = self._parent.createWorksheet()
@@ -237,6 +260,198 @@ class icVWorksheet(icprototype.icVPrototype):
         return page_breaks
 
 
+class icVRowIndex(icprototype.icVChildrenIndex):
+    """
+    Индекс ячеек строки: номер колонки -> атрибуты ячейки.
+    """
+    def __init__(self, attrs):
+        """
+        Конструктор.
+        """
+        icprototype.icVChildrenIndex.__init__(self, attrs)
+        self.cells = dict()
+        self._cur_idx = 0
+
+    def clear(self):
+        """
+        Очистить индекс.
+        """
+        self.cells = dict()
+        self._cur_idx = 0
+
+    def indexElements(self, elements):
+        """
+        Добавить ячейки в индекс.
+        Номера ячеек определяются так же, как в icVCell._findElementIdxAttr.
+        """
+        cur_idx = self._cur_idx
+        for cell_attr in elements:
+            if 'Index' in cell_attr:
+                cur_idx = int(cell_attr['Index'])
+            else:
+                cur_idx += 1
+            self.cells.setdefault(cur_idx, cell_attr)
+
+            # Учет объединенных ячеек
+            if 'MergeAcross' in cell_attr:
+                cur_idx += int(cell_attr['MergeAcross'])
+        self._cur_idx = cur_idx
+
+
+class icVTableIndex(icprototype.icVChildrenIndex):
+    """
+    Индекс таблицы: номер строки -> атрибуты строки,
+    номер колонки -> атрибуты колонки, индексы ячеек строк,
+    объединенные ячейки.
+    """
+    def __init__(self, attrs):
+        """
+        Конструктор.
+        """
+        icprototype.icVChildrenIndex.__init__(self, attrs)
+        self.clear()
+
+    def clear(self):
+        """
+        Очистить индекс.
+        """
+        self.elements = {'Row': dict(), 'Column': dict()}
+        # Номер последнего элемента (как в _findElementIdxAttr)
+        self._cur_idx = {'Row': 0, 'Column': 0}
+        # Максимальный индекс элемента с учетом Span (как в _maxElementIdx)
+        self.max_idx = {'Row': -1, 'Column': -1}
+        # Индексы ячеек строк
+        self._row_indexes = dict()
+        # Объединенные ячейки: {(строка, колонка): (объединено строк, объединено колонок)}
+        # Строятся при первом обращении
+        self.merges = None
+        # Интервалы объединенных ячеек по строкам:
+        # {строка: [(первая колонка, последняя колонка, (строка, колонка)), ...]}
+        self._merge_rows = None
+
+    def indexElements(self, elements):
+        """
+        Добавить строки и колонки в индекс.
+        """
+        for element_attr in elements:
+            element_name = element_attr['name']
+            if element_name in self.elements:
+                if 'Index' in element_attr:
+                    cur_idx = int(element_attr['Index'])
+                    self.max_idx[element_name] = cur_idx - 1
+                else:
+                    cur_idx = self._cur_idx[element_name] + 1
+                    # Несколько элементов с такими же атрибутами
+                    self.max_idx[element_name] += int(element_attr['Span']) if 'Span' in element_attr else 1
+                self._cur_idx[element_name] = cur_idx
+                if cur_idx not in self.elements[element_name]:
+                    self.elements[element_name][cur_idx] = element_attr
+                    if element_name == 'Row' and self.merges is not None:
+                        self._indexRowMerges(cur_idx, element_attr)
+
+    def _indexRowMerges(self, row, row_attrs):
+        """
+        Добавить объединенные ячейки строки в индекс объединенных ячеек.
+
+        :param row: Номер строки.
+        :param row_attrs: Атрибуты строки.
+        """
+        for col, cell_attr in self.getRowIndex(row_attrs).cells.items():
+            if 'MergeAcross' in cell_attr or 'MergeDown' in cell_attr:
+                self._addMerge(row, col,
+                               int(cell_attr.get('MergeDown', 0)), int(cell_attr.get('MergeAcross', 0)))
+
+    def _addMerge(self, row, col, merge_down, merge_across):
+        """
+        Добавить объединенную ячейку в индекс.
+        """
+        self.merges[(row, col)] = (merge_down, merge_across)
+        for i_row in range(row, row + merge_down + 1):
+            self._merge_rows.setdefault(i_row, list()).append((col, col + merge_across, (row, col)))
+
+    def _delMerge(self, row, col):
+        """
+        Удалить объединенную ячейку из индекса.
+        """
+        merge_down, merge_across = self.merges.pop((row, col))
+        for i_row in range(row, row + merge_down + 1):
+            intervals = [interval for interval in self._merge_rows.get(i_row, ()) if interval[2] != (row, col)]
+            if intervals:
+                self._merge_rows[i_row] = intervals
+            elif i_row in self._merge_rows:
+                del self._merge_rows[i_row]
+
+    def getMerges(self):
+        """
+        Объединенные ячейки: {(строка, колонка): (объединено строк, объединено колонок)}.
+        """
+        if self.merges is None:
+            self.merges = dict()
+            self._merge_rows = dict()
+            for row, row_attrs in self.elements['Row'].items():
+                self._indexRowMerges(row, row_attrs)
+        return self.merges
+
+    def refreshRowMerges(self, rows):
+        """
+        Обновить объединенные ячейки указанных строк в индексе.
+        Вызывается после изменения ячеек строк (объединение, удаление ячеек).
+
+        :param rows: Номера строк.
+        """
+        if self.merges is None:
+            # Индекс будет построен при первом обращении
+            return
+        for row in rows:
+            for merge_cell in [merge_cell for merge_cell in self.merges if merge_cell[0] == row]:
+                self._delMerge(*merge_cell)
+            row_attrs = self.elements['Row'].get(row, None)
+            if row_attrs is not None:
+                self._indexRowMerges(row, row_attrs)
+
+    def resetMerges(self):
+        """
+        Сбросить индекс объединенных ячеек.
+        """
+        self.merges = None
+        self._merge_rows = None
+
+    def findMerge(self, row, col):
+        """
+        Найти объединенную ячейку, в которую попадает ячейка (row, col).
+        Сама объединенная ячейка в свою область не попадает.
+
+        :return: Кортеж (строка, колонка) объединенной ячейки или None.
+        """
+        self.getMerges()
+        for first_col, last_col, merge_cell in self._merge_rows.get(row, ()):
+            if first_col <= col <= last_col and merge_cell != (row, col):
+                return merge_cell
+        return None
+
+    def getRowIndex(self, row_attrs):
+        """
+        Индекс ячеек строки.
+
+        :param row_attrs: Атрибуты строки.
+        """
+        row_index = self._row_indexes.get(id(row_attrs), None)
+        if row_index is None or row_index.attrs is not row_attrs:
+            row_index = icVRowIndex(row_attrs)
+            self._row_indexes[id(row_attrs)] = row_index
+        return row_index.update()
+
+    def resetRowIndex(self, row_attrs):
+        """
+        Сбросить индекс ячеек строки.
+
+        :param row_attrs: Атрибуты строки.
+        """
+        row_index = self._row_indexes.get(id(row_attrs), None)
+        if row_index is not None:
+            row_index.reset()
+
+
 class icVTable(icprototype.icVPrototype):
     """
     Таблица.
@@ -252,8 +467,35 @@ class icVTable(icprototype.icVPrototype):
         self._basis_row = None
         self._basis_col = None
 
-        # Словарь объединенных ячеек
-        self._merge_cells = None
+        # Индекс строк, колонок и ячеек
+        self._index = None
+
+    def getIndex(self):
+        """
+        Индекс строк, колонок и ячеек таблицы.
+        Индекс хранится в объекте приложения и разделяется всеми
+        объектами таблицы, созданными для одних и тех же данных.
+        При упаковке таблицы индекс становится недействительным и
+        таблица распаковывается при получении нового индекса.
+        """
+        if self._index is None or self._index.attrs is not self._attributes:
+            get_table_index = getattr(self.getApp(), 'getTableIndex', None)
+            if get_table_index:
+                self._index = get_table_index(self._attributes)
+            else:
+                self._index = icVTableIndex(self._attributes)
+        return self._index.update()
+
+    def unpack(self):
+        """
+        Распаковать таблицу, если она была упакована.
+
+        :return: True - таблица распакована, False - таблица не была упакована.
+        """
+        unpack_table = getattr(self.getApp(), 'unpackTable', None)
+        if unpack_table:
+            return unpack_table(self._attributes)
+        return False
 
     def getUsedSize(self):
         """
@@ -290,6 +532,7 @@ class icVTable(icprototype.icVPrototype):
         """
         Список колонок. Данные.
         """
+        self.unpack()
         return [element for element in self._attributes['children'] if element['name'] == 'Column']
 
     def getColumnCount(self):
@@ -328,6 +571,12 @@ class icVTable(icprototype.icVPrototype):
         """
         Взять колонку по индексу.
         """
+        col_data = self.getIndex().elements['Column'].get(idx, None)
+        if col_data is not None:
+            col = icrange.icVColumn(self)
+            col.set_attributes(col_data)
+            return col
+
         col = None
         idxs, _i, col_data = self._findColIdxAttr(idx)
         if col_data is not None:
@@ -356,10 +605,11 @@ class icVTable(icprototype.icVPrototype):
         :param row: Индекс(Начинаяется с 0) клонируемой ячейки. -1 - Последняя.
         :return: Возвращает объект клонированной строки. Если строк в таблице нет, то возвращает None.
         """
+        self.unpack()
         if self._attributes['children']:
-            row_attr = copy.deepcopy(self._attributes['children'][row])
+            row_attr = icprototype.copy_attributes(self._attributes['children'][row])
             if bClearCell:
-                row_attr['children'] = [dict(cell.items()+[('value', None)]) for cell in row_attr['children']]
+                row_attr['children'] = [dict(cell, value=None) for cell in row_attr['children']]
 
             row_obj = icrange.icVRow(self)
             row_obj.set_attributes(row_attr)
@@ -391,6 +641,7 @@ class icVTable(icprototype.icVPrototype):
         """
         Список строк. Данные.
         """
+        self.unpack()
         return [element for element in self._attributes['children'] if element['name'] == 'Row']
 
     def getRowCount(self):
@@ -403,6 +654,12 @@ class icVTable(icprototype.icVPrototype):
         """
         Взять строку по индексу.
         """
+        row_data = self.getIndex().elements['Row'].get(idx, None)
+        if row_data is not None:
+            row = icrange.icVRow(self)
+            row.set_attributes(row_data)
+            return row
+
         row = None
         idxs, _i, row_data = self._findRowIdxAttr(idx)
         if row_data is not None:
@@ -476,16 +733,91 @@ class icVTable(icprototype.icVPrototype):
                 return cell
 
         cur_row = self.getRow(row)
-        cell = cur_row.getCellIdx(col)
+        cell_attr = self.getIndex().getRowIndex(cur_row.get_attributes()).cells.get(col, None)
+        if cell_attr is None:
+            cell = cur_row.createCellIdx(col)
+        else:
+            cell = iccell.icVCell(cur_row)
+            cell.set_attributes(cell_attr)
         # Установить координаты ячейки
         cell._row_idx = row
         cell._col_idx = col
         return cell
 
+    def setValues(self, row, col, values, style_id=None):
+        """
+        Записать двумерный блок значений начиная с ячейки (row, col).
+        Недостающие строки, колонки и ячейки создаются за один проход по блоку.
+
+        :param row: Номер первой строки блока.
+        :param col: Номер первой колонки блока.
+        :param values: Двумерная последовательность значений:
+            список строк, массив NumPy или объект, поддерживающий буферный протокол.
+        :param style_id: Идентификатор общего стиля ячеек блока.
+        :return: Количество записанных ячеек.
+        """
+        # Если координаты недопустимы, тогда ошибка
+        if row <= 0:
+            raise IndexError
+        if col <= 0:
+            raise IndexError
+
+        rows = icrange.get_value_rows(values)
+        if not rows:
+            return 0
+
+        # Ограничение по индексам строк и колонок
+        height = min(len(rows), 65535 - row + 1)
+        width = min(max([len(row_values) for row_values in rows]), 256 - col + 1)
+        if height <= 0 or width <= 0:
+            return 0
+
+        col_count = self.getColumnCount()
+        if col + width - 1 > col_count:
+            for i in range(col + width - 1 - col_count):
+                self.createColumn()
+
+        row_count = self.getRowCount()
+        if row + height - 1 > row_count:
+            for i in range(row + height - 1 - row_count):
+                self.createRow()
+
+        table_index = self.getIndex()
+        count = 0
+        for i_row, row_values in enumerate(rows[:height]):
+            cur_row_idx = row + i_row
+            cur_row = self.getRow(cur_row_idx)
+            row_attrs = cur_row.get_attributes()
+            for i_col, value in enumerate(row_values[:width]):
+                cur_col_idx = col + i_col
+                if table_index.findMerge(cur_row_idx, cur_col_idx) is not None:
+                    # Попадание в объединенную ячейку обрабатывается как в getCell
+                    cell = self.getCell(cur_row_idx, cur_col_idx)
+                else:
+                    row_index = table_index.getRowIndex(row_attrs)
+                    cell_attr = row_index.cells.get(cur_col_idx, None)
+                    cell = iccell.icVCell(cur_row)
+                    if cell_attr is None and cur_col_idx > row_index._cur_idx:
+                        # Ячейка правее всех ячеек строки добавляется в конец строки
+                        cell.setIndex(cur_col_idx)
+                        row_attrs['children'].append(cell.get_attributes())
+                    elif cell_attr is None:
+                        cell = cur_row.createCellIdx(cur_col_idx)
+                    else:
+                        cell.set_attributes(cell_attr)
+                    cell._row_idx = cur_row_idx
+                    cell._col_idx = cur_col_idx
+                if style_id:
+                    cell.setStyleID(style_id)
+                cell.setValue(value)
+                count += 1
+        return count
+
     def clearTab(self):
         """
         Очистка таблицы.
         """
+        self.unpack()
         return self.clear()
 
     def _findColIdxAttr(self, idx):
@@ -507,14 +839,14 @@ class icVTable(icprototype.icVPrototype):
         Максимальный индекс колонок в таблице.
         ВНИМАНИЕ! В этой функции индексация начинается с 0.
         """
-        return self._getBasisCol()._maxElementIdx(elements=self.getColumnsAttrs())
+        return self.getIndex().max_idx['Column']
 
     def _maxRowIdx(self):
         """
         Максимальный индекс строк в таблице.
         ВНИМАНИЕ! В этой функции индексация начинается с 0.
         """
-        return self._getBasisRow()._maxElementIdx(elements=self.getRowsAttrs())
+        return self.getIndex().max_idx['Row']
 
     def setExpandedRowCount(self, expanded_row_count=None):
         """
@@ -592,69 +924,40 @@ class icVTable(icprototype.icVPrototype):
             self._basis_col = icrange.icVColumn(self)
         return self._basis_col
 
+    def _getMergeCell(self, row, col):
+        """
+        Объект объединенной ячейки.
+        """
+        cur_row = self.getRow(row)
+        cell_obj = iccell.icVCell(cur_row)
+        cell_obj.set_attributes(self.getIndex().getRowIndex(cur_row.get_attributes()).cells[col])
+        # Установить координаты ячейки
+        cell_obj._row_idx = row
+        cell_obj._col_idx = col
+        return cell_obj
+
     def getMergeCells(self):
         """
         Словарь объединенных ячеек. В качестве ключа - кортеж координаты ячейки.
         """
         merge_cells = {}
-        rows = [element for element in self._attributes['children'] if element['name'] == 'Row']
-        for i_row, row in enumerate(rows):
-            i_col = 0
-            for cell in row['children']:
-                if cell['name'] == 'Cell':
-                    if 'Index' in cell:
-                        new_i_col = int(cell['Index'])
-                        if new_i_col >= i_col:
-                            i_col = new_i_col
-                    else:
-                        i_col += 1
-
-                    if 'MergeAcross' in cell or 'MergeDown' in cell:
-                        cur_row = self.getRow(i_row+1)
-                        cell_obj = cur_row.getCellIdx(i_col)
-                        # Установить координаты ячейки
-                        cell_obj._row_idx = i_row+1
-                        cell_obj._col_idx = i_col
-                        merge_cells[cell_obj.getRegion()] = cell_obj
-                    if 'MergeAcross' in cell:
-                        # Учет объекдиненных ячеек ДЕЛАТЬ ОБЯЗАТЕЛЬНО!!!
-                        # иначе не происходит учет предыдущих объединенных ячеек
-                        i_col += int(cell['MergeAcross'])-1
-
+        for (row, col), (merge_down, merge_across) in list(self.getIndex().getMerges().items()):
+            merge_cells[(row, col, merge_down, merge_across)] = self._getMergeCell(row, col)
         return merge_cells
 
     def isInMergeCell(self, row, column):
         """
         Попадает указанная ячейка в объединенную?
         """
-        # Кеширование объединенных ячеек на случай попадания
-        # в них при создании новой ячейки
-        if self._merge_cells is None:
-            self._merge_cells = self.getMergeCells()
-
-        for cell in self._merge_cells.items():
-            cell_region = cell[0]
-            if (row >= cell_region[0]) and (row <= (cell_region[0]+cell_region[2])) and \
-                    (column >= cell_region[1]) and (column <= (cell_region[1]+cell_region[3])):
-                if row != cell_region[0] or column != cell_region[1]:
-                    return True
-        return False
+        return self.getIndex().findMerge(row, column) is not None
 
     def getInMergeCell(self, row, column):
         """
         Получить объединенную ячейку на которую указывают координаты.
         """
-        # Кеширование объединенных ячеек на случай попадания
-        # в них при создании новой ячейки
-        if self._merge_cells is None:
-            self._merge_cells = self.getMergeCells()
-
-        for cell in self._merge_cells.items():
-            cell_region = cell[0]
-            if (row >= cell_region[0]) and (row<= (cell_region[0]+cell_region[2])) and \
-                    (column >= cell_region[1]) and (column <= (cell_region[1]+cell_region[3])):
-                if row != cell_region[0] or column != cell_region[1]:
-                    return cell[1]
+        merge_cell = self.getIndex().findMerge(row, column)
+        if merge_cell is not None:
+            return self._getMergeCell(*merge_cell)
         return None
 
     def delColumn(self, idx=-1):
@@ -670,6 +973,8 @@ class icVTable(icprototype.icVPrototype):
                 row = self.getRow(i_row+1)
                 if row:
                     row.delCell(idx)
+            # Номера колонок и ячеек изменились
+            self.getIndex().reset()
             return result
         return False
 
@@ -681,7 +986,10 @@ class icVTable(icprototype.icVPrototype):
 
         if row:
             # Удалить строку из таблицы
-            return row._delElementIdxAttr(idx - 1, 'Row')
+            result = row._delElementIdxAttr(idx - 1, 'Row')
+            # Номера строк изменились
+            self.getIndex().reset()
+            return result
         return False
 
 
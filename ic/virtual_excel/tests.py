@@ -5,14 +5,24 @@
 Модуль тестов для виртуального Excel.
 """
 
+import array
+import shutil
+import tempfile
 import time
 import sys
 import os
 import os.path
 
 import unittest
+import xml.sax
+import xml.sax.handler
+from xml.sax import xmlreader
 
+from . import config
 from . import icexcel
+from . import icods
+from . import icworksheet
+from .icexcel import xml2dict
 
 __version__ = (0, 1, 1, 1)
 
@@ -284,5 +294,447 @@ def test_merge_cell():
     print('test_merge_cell STOP', time.time()-start_time)
 
 
+class icVirtualExcelCloneTests(unittest.TestCase):
+    """
+    Тесты клонирования листов.
+    """
+    def _createWorksheet(self):
+        """
+        Книга с заполненным листом.
+        """
+        app = icexcel.icVExcel()
+        work_book = app.createWorkbook()
+        work_sheet = work_book.createWorksheet()
+        work_sheet.setName('Sheet1')
+        table = work_sheet.getTable()
+        for i_row in range(1, 4):
+            for i_col in range(1, 3):
+                table.getCell(i_row, i_col).setValue('%d:%d' % (i_row, i_col))
+        return app, work_sheet
+
+    def test_clone_then_write(self):
+        """
+        Запись в ранее полученные объекты ячеек и строк после клонирования листа.
+        """
+        app, work_sheet = self._createWorksheet()
+        table = work_sheet.getTable()
+        cell = table.getCell(1, 1)
+        row = table.getRow(2)
+
+        clone = work_sheet.clone('Sheet2')
+        cell.setValue('CHANGED')
+        row.createCellIdx(5).setValue('NEW')
+
+        table = work_sheet.getTable()
+        self.assertEqual(table.getCell(1, 1).getValue(), 'CHANGED')
+        self.assertEqual(table.getCell(2, 5).getValue(), 'NEW')
+        # Клон содержит данные на момент клонирования
+        clone_table = clone.getTable()
+        self.assertEqual(clone_table.getCell(1, 1).getValue(), '1:1')
+        self.assertEqual(clone_table.getCell(3, 2).getValue(), '3:2')
+        self.assertIsNone(clone_table.getCell(2, 5).getValue())
+
+    def test_clone_write_clone(self):
+        """
+        Запись в клон не изменяет исходный лист.
+        """
+        app, work_sheet = self._createWorksheet()
+        clone = work_sheet.clone('Sheet2')
+        clone.getTable().getCell(1, 1).setValue('CLONE')
+        self.assertEqual(work_sheet.getTable().getCell(1, 1).getValue(), '1:1')
+        self.assertEqual(clone.getTable().getCell(1, 1).getValue(), 'CLONE')
+
+
+class icVirtualExcelReleaseTests(unittest.TestCase):
+    """
+    Тесты освобождения упакованных таблиц и индексов удаленных листов.
+    """
+    def _createApp(self):
+        """
+        Книга с заполненным листом и его клоном.
+        """
+        app = icexcel.icVExcel()
+        work_book = app.createWorkbook()
+        work_sheet = work_book.createWorksheet()
+        work_sheet.setName('Sheet1')
+        work_sheet.getTable().getCell(1, 1).setValue('1:1')
+        work_sheet.clone('Sheet2')
+        return app
+
+    def test_del_worksheet(self):
+        """
+        Удаление листа освобождает его упакованную таблицу и индекс.
+        """
+        app = self._createApp()
+        self.assertEqual(len(app._packed_tables), 1)
+        self.assertTrue(app.delWorksheet(None, 'Sheet2'))
+        self.assertEqual(app._packed_tables, {})
+
+        self.assertEqual(len(app._table_indexes), 1)
+        self.assertTrue(app.delWorksheet(None, 'Sheet1'))
+        self.assertEqual(app._table_indexes, {})
+
+    def test_clipboard(self):
+        """
+        Замена листа в буфере обмена освобождает таблицу предыдущего листа.
+        """
+        app = self._createApp()
+        app.delWorksheet(None, 'Sheet2')
+        app.copyWorksheet(None, 'Sheet1')
+        app.cutWorksheet(None, 'Sheet1')
+        app.copyWorksheet(None, 'Sheet1')
+        self.assertEqual(len(app._packed_tables), 1)
+        self.assertTrue(app.pasteWorksheet(None, new_worksheet_name='Sheet3'))
+        self.assertEqual(len(app._packed_tables), 1)
+        self.assertEqual(app.getWorkbook().findWorksheet('Sheet3').getTable().getCell(1, 1).getValue(), '1:1')
+        self.assertEqual(app._packed_tables, {})
+
+
+def _dataCell(value):
+    """
+    Атрибуты ячейки со строковым значением.
+    """
+    return {'name': 'Cell', 'children': [{'name': 'Data', 'Type': 'String', 'value': value, 'children': []}]}
+
+
+class icVTableTestMixin(object):
+    """
+    Общие функции тестов таблиц листа.
+    """
+    def _createTable(self):
+        """
+        Таблица нового листа.
+        """
+        app = icexcel.icVExcel()
+        work_sheet = app.createWorkbook().createWorksheet()
+        return work_sheet.getTable()
+
+    def assertIndex(self, table):
+        """
+        Индекс таблицы, обновляемый при изменениях, совпадает
+        с индексом, построенным заново по данным таблицы.
+        """
+        table_index = table.getIndex()
+        new_index = icworksheet.icVTableIndex(table.get_attributes()).update()
+        self.assertEqual(table_index.elements, new_index.elements)
+        self.assertEqual(table_index.max_idx, new_index.max_idx)
+        for row_attrs in new_index.elements['Row'].values():
+            self.assertEqual(table_index.getRowIndex(row_attrs).cells, new_index.getRowIndex(row_attrs).cells)
+        self.assertEqual(table_index.getMerges(), new_index.getMerges())
+
+    def _values(self, table, row_count, col_count):
+        """
+        Значения ячеек таблицы.
+        """
+        return [[table.getCell(row, col).getValue() for col in range(1, col_count + 1)]
+                for row in range(1, row_count + 1)]
+
+    def _cells(self, table):
+        """
+        Атрибуты ячеек таблицы: {(строка, колонка): атрибуты ячейки}.
+        Не зависит от порядка строк и колонок в списке дочерних элементов таблицы.
+        """
+        table_index = icworksheet.icVTableIndex(table.get_attributes()).update()
+        return dict([((row, col), cell_attrs) for row, row_attrs in table_index.elements['Row'].items()
+                     for col, cell_attrs in table_index.getRowIndex(row_attrs).cells.items()])
+
+
+class icVirtualExcelIndexTests(icVTableTestMixin, unittest.TestCase):
+    """
+    Тесты индекса строк, колонок и ячеек таблицы.
+    """
+    def test_append_delete(self):
+        """
+        Индекс после добавления и удаления строк и колонок.
+        """
+        table = self._createTable()
+        for row in range(1, 5):
+            for col in range(1, 4):
+                table.getCell(row, col).setValue('%d:%d' % (row, col))
+        self.assertIndex(table)
+        self.assertEqual((table.getRowCount(), table.getColumnCount()), (4, 3))
+
+        self.assertTrue(table.delRow(2))
+        self.assertIndex(table)
+        self.assertEqual(table.getRowCount(), 3)
+
+        self.assertTrue(table.delColumn(1))
+        self.assertIndex(table)
+        self.assertEqual(table.getColumnCount(), 2)
+
+        table.getCell(5, 2).setValue('5:2')
+        self.assertIndex(table)
+        self.assertEqual(self._values(table, 5, 2), [['1:2', '1:3'], ['3:2', '3:3'], ['4:2', '4:3'],
+                                                     [None, None], [None, '5:2']])
+
+    def test_insert(self):
+        """
+        Индекс после вставки строк между строками с явными номерами.
+        """
+        table = self._createTable()
+        table.get_attributes()['children'] = [{'name': 'Row', 'Index': '2', 'children': [_dataCell('B')]},
+                                              {'name': 'Row', 'Index': '5', 'children': [_dataCell('E')]}]
+        self.assertIndex(table)
+        self.assertEqual(table.getRowCount(), 5)
+
+        table.getCell(3, 1).setValue('C')
+        self.assertIndex(table)
+        table.getCell(1, 1).setValue('A')
+        self.assertIndex(table)
+        self.assertEqual(self._values(table, 5, 1), [['A'], ['B'], ['C'], [None], ['E']])
+
+
+class icVirtualExcelMergeIndexTests(icVTableTestMixin, unittest.TestCase):
+    """
+    Тесты индекса объединенных ячеек.
+    """
+    def test_merge_delete(self):
+        """
+        Индекс объединенных ячеек после удаления строк и колонок.
+        """
+        table = self._createTable()
+        for row in range(1, 5):
+            for col in range(1, 5):
+                table.getCell(row, col).setValue('%d:%d' % (row, col))
+        table.getCell(2, 2).setMerge(1, 1)
+        self.assertIndex(table)
+        self.assertEqual(table.getIndex().getMerges(), {(2, 2): (1, 1)})
+        self.assertTrue(table.isInMergeCell(3, 3))
+        self.assertFalse(table.isInMergeCell(2, 2))
+        self.assertEqual(table.getInMergeCell(3, 3).getValue(), '2:2')
+
+        table.delRow(1)
+        self.assertIndex(table)
+        self.assertEqual(table.getIndex().getMerges(), {(1, 2): (1, 1)})
+        self.assertTrue(table.isInMergeCell(2, 3))
+        self.assertFalse(table.isInMergeCell(3, 3))
+
+        table.delColumn(1)
+        self.assertIndex(table)
+        self.assertEqual(table.getIndex().getMerges(), {(1, 1): (1, 1)})
+        self.assertTrue(table.isInMergeCell(2, 2))
+
+        table.getCell(1, 1).setMerge(0, 0)
+        self.assertIndex(table)
+        self.assertEqual(table.getIndex().getMerges(), {})
+        self.assertFalse(table.isInMergeCell(2, 2))
+
+    def test_merge_insert(self):
+        """
+        Индекс объединенных ячеек после вставки строк.
+        """
+        table = self._createTable()
+        merge_cell = _dataCell('E')
+        merge_cell.update({'MergeAcross': '1', 'MergeDown': '1'})
+        table.get_attributes()['children'] = [{'name': 'Row', 'Index': '2', 'children': [_dataCell('B')]},
+                                              {'name': 'Row', 'Index': '5', 'children': [merge_cell]}]
+        self.assertEqual(table.getIndex().getMerges(), {(5, 1): (1, 1)})
+
+        table.getCell(3, 1).setValue('C')
+        self.assertIndex(table)
+        self.assertEqual(table.getIndex().getMerges(), {(5, 1): (1, 1)})
+        self.assertEqual(table.getInMergeCell(6, 2).getValue(), 'E')
+        self.assertIsNone(table.getInMergeCell(4, 1))
+
+
+class icVirtualExcelSetValuesTests(icVTableTestMixin, unittest.TestCase):
+    """
+    Тесты записи блока значений.
+    """
+    VALUES = [[1, 2.5, 'a', None], ['=1+1', 'b', 3, 'c'], [4, 5, 6, 7]]
+
+    def _prepareTable(self):
+        """
+        Таблица с заполненными и объединенными ячейками.
+
+        :return: Таблица, идентификатор стиля.
+        """
+        table = self._createTable()
+        table.getCell(1, 1).setValue(0)
+        table.getCell(2, 2).setValue('x')
+        table.getCell(3, 6).setValue('y')
+        table.getCell(4, 3).setMerge(1, 0)
+        cell = table.getCell(6, 1)
+        cell.setStyle(font={'Bold': 1})
+        return table, cell.getStyleID()
+
+    def test_set_values(self):
+        """
+        Запись блока совпадает с записью по ячейкам.
+        """
+        table, style_id = self._prepareTable()
+        self.assertEqual(table.setValues(2, 1, self.VALUES, style_id), 12)
+        self.assertIndex(table)
+
+        cell_table, style_id = self._prepareTable()
+        for i_row, row_values in enumerate(self.VALUES):
+            for i_col, value in enumerate(row_values):
+                cell = cell_table.getCell(2 + i_row, 1 + i_col)
+                cell.setStyleID(style_id)
+                cell.setValue(value)
+        self.assertEqual(table.get_attributes(), cell_table.get_attributes())
+
+    def test_set_values_new(self):
+        """
+        Запись блока в новую таблицу совпадает с записью по ячейкам.
+        """
+        table = self._createTable()
+        table.setValues(2, 2, self.VALUES)
+        self.assertIndex(table)
+
+        cell_table = self._createTable()
+        for i_row, row_values in enumerate(self.VALUES):
+            for i_col, value in enumerate(row_values):
+                cell_table.getCell(2 + i_row, 2 + i_col).setValue(value)
+        self.assertEqual(self._cells(table), self._cells(cell_table))
+
+    def test_set_values_buffer(self):
+        """
+        Запись блока из объектов с буферным протоколом.
+        """
+        table = self._createTable()
+        table.setValues(1, 1, [array.array('d', [1, 2]), array.array('d', [3, 4])])
+        self.assertEqual(self._values(table, 2, 2), [['1.0', '2.0'], ['3.0', '4.0']])
+
+        table = self._createTable()
+        table.setValues(1, 1, array.array('i', [1, 2, 3]))
+        self.assertEqual(self._values(table, 2, 3), [['1', '2', '3'], [None, None, None]])
+
+
+@unittest.skipIf(getattr(icods, 'odf', None) is None, 'ODFpy is not installed')
+class icVirtualExcelODSLoadTests(unittest.TestCase):
+    """
+    Тесты потоковой загрузки ODS файла.
+    """
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        self.stream_load = config.get_cfg_var('ODS_STREAM_LOAD')
+
+    def tearDown(self):
+        config.set_cfg_var('ODS_STREAM_LOAD', self.stream_load)
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+    def _saveODS(self):
+        """
+        Сохранить книгу из двух листов со стилями и объединенными ячейками в ODS файл.
+        """
+        ods_filename = os.path.join(self.tmp_path, 'test.ods')
+        app = icexcel.icVExcel()
+        work_book = app.createWorkbook()
+        for sheet_name in ('Sheet1', 'Sheet2'):
+            work_sheet = work_book.createWorksheet()
+            work_sheet.setName(sheet_name)
+            table = work_sheet.getTable()
+            for row in range(1, 8):
+                for col in range(1, 5):
+                    table.getCell(row, col).setValue(row * col if col % 2 else '%s %d:%d' % (sheet_name, row, col))
+            table.getCell(9, 2).setMerge(1, 1)
+            work_sheet.getRange(1, 1, 2, 2).setStyle(font={'Bold': 1, 'Size': 14})
+        app.saveAsODS(ods_filename)
+        return ods_filename
+
+    def _load(self, ods_filename, stream_load, **kwargs):
+        """
+        Загрузить ODS файл.
+
+        :param stream_load: Потоковая загрузка?
+        """
+        config.set_cfg_var('ODS_STREAM_LOAD', stream_load)
+        return icods.icODS().load(ods_filename, **kwargs)
+
+    def test_stream_load(self):
+        """
+        Потоковая загрузка дает те же данные, что и загрузка через ODFpy.
+        """
+        ods_filenames = (self._saveODS(),
+                         os.path.join(os.path.dirname(os.path.dirname(__file__)), 'report', 'new_report_template.ods'))
+        options = ({}, {'row_limit': 2}, {'sheet_limit': 1}, {'used_styles_only': True},
+                   {'sheet_name': 'Sheet2'}, {'sheet_name': 'Sheet2', 'used_styles_only': True})
+        for ods_filename in ods_filenames:
+            for kwargs in options:
+                data = self._load(ods_filename, True, **kwargs)
+                self.assertIsNotNone(data)
+                self.assertEqual(data, self._load(ods_filename, False, **kwargs))
+
+        data = self._load(ods_filenames[0], True)
+        self.assertEqual([element.get('Name', None) for element in data['children'][0]['children']],
+                         [None, 'Sheet1', 'Sheet2'])
+
+
+class icVirtualExcelXML2DictTests(unittest.TestCase):
+    """
+    Тесты загрузки XML файла через expat.
+    """
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+    def _saveXML(self):
+        """
+        Сохранить книгу больше блока чтения со стилями,
+        объединенными ячейками и многострочными значениями в XML файл.
+        """
+        xml_filename = os.path.join(self.tmp_path, 'test.xml')
+        app = icexcel.icVExcel()
+        work_book = app.createWorkbook()
+        for sheet_name in ('Лист1', 'Sheet2'):
+            work_sheet = work_book.createWorksheet()
+            work_sheet.setName(sheet_name)
+            table = work_sheet.getTable()
+            for row in range(1, 501):
+                for col in range(1, 6):
+                    value = row * col if col % 2 else 'Строка %d\n<%s> & "%d"' % (row, sheet_name, col)
+                    table.getCell(row, col).setValue(value)
+            table.getCell(502, 2).setMerge(1, 1)
+            work_sheet.getRange(1, 1, 2, 2).setStyle(font={'Bold': 1, 'Size': 14})
+        app.saveAs(xml_filename)
+        self.assertGreater(os.path.getsize(xml_filename), xml2dict.READ_BLOCK_SIZE)
+        return xml_filename
+
+    def _loadSAX(self, xml_filename):
+        """
+        Загрузить XML файл через SAX анализатор.
+        """
+        with open(xml_filename, 'rt', encoding='utf-8') as xml_file:
+            input_source = xmlreader.InputSource()
+            input_source.setByteStream(xml_file)
+            xml_reader = xml.sax.make_parser()
+            xml_parser = xml2dict.icXML2DICTReader()
+            xml_reader.setContentHandler(xml_parser)
+            xml_reader.setFeature(xml.sax.handler.feature_namespaces, 1)
+            xml_reader.parse(input_source)
+        return xml_parser.getData()
+
+    def _getXMLFilenames(self):
+        """
+        Имена проверяемых XML файлов.
+        """
+        return (self._saveXML(),
+                os.path.join(os.path.dirname(os.path.dirname(__file__)), 'report', 'new_report_template.xml'))
+
+    def test_expat(self):
+        """
+        Анализатор expat дает тот же словарь, что и SAX анализатор.
+        """
+        for xml_filename in self._getXMLFilenames():
+            data = xml2dict.XmlFile2Dict(xml_filename)
+            self.assertIsNotNone(data)
+            self.assertEqual(data, self._loadSAX(xml_filename))
+
+    def test_lazy(self):
+        """
+        Отложенная загрузка таблиц после загрузки содержимого дает тот же словарь, что и полная загрузка.
+        """
+        for xml_filename in self._getXMLFilenames():
+            data, lazy_tables = xml2dict.XmlFile2DictLazy(xml_filename)
+            self.assertTrue(lazy_tables)
+            for table_attrs, lazy_table in lazy_tables:
+                self.assertEqual(table_attrs['children'], [])
+                table_attrs['children'] = lazy_table.getChildren()
+            self.assertEqual(data, xml2dict.XmlFile2Dict(xml_filename))
+
+
 if __name__ == '__main__':
     test_merge_cell()
@@ -33,6 +33,9 @@ icReport - Программа запуска/обзора отчетов.
         --var=              Добавление переменной для заполнения в отчете
         --path=             Указание папки отчетов
         --no_gui            Включение консольного режима работы
+        --stream            Потоковая генерация отчета (строки не накапливаются в памяти)
+        --batch=            Режим пакетной генерации отчетов по файлу манифеста (INI)
+        --workers=          Количество процессов пакетной генерации
 """
 
 
@@ -70,7 +73,7 @@ def main(argv):
                                        'print=', 'preview=', 'export=', 'select=',
                                        'gen=', 'db=', 'sql=',
                                        'stylelib=', 'var=', 'path=',
-                                       'no_gui'])
+                                       'no_gui', 'stream', 'batch=', 'workers='])
     except getopt.error as err:
         log.error(err.msg, bForcePrint=True)
         log.info(__doc__, bForcePrint=True)
@@ -86,6 +89,7 @@ def main(argv):
     path = None
     mode = 'default'
     mode_arg = None
+    workers = None
 
     for option, arg in options:
         if option in ('-h', '--help', '-?'):
@@ -137,6 +141,13 @@ def main(argv):
             path = arg
         elif option in ('--no_gui', ):
             config.set_glob_var('NO_GUI_MODE', True)
+        elif option in ('--stream', ):
+            config.set_glob_var('STREAM_MODE', True)
+        elif option in ('--batch', ):
+            mode = 'batch'
+            mode_arg = arg
+        elif option in ('--workers', ):
+            workers = int(arg)
 
     # ВНИМАНИЕ! Небходимо добавить путь к папке отчетов,
     # чтобы проходили импорты модулей отчетов
@@ -145,6 +156,14 @@ def main(argv):
     if os.path.exists(path) and os.path.isdir(path) and path not in sys.path:
         sys.path.append(path)
 
+    if mode == 'batch':
+        # Пакетная генерация выполняется без диалоговых окон
+        config.set_glob_var('NO_GUI_MODE', True)
+        results = do_report.doReportBatch(mode_arg, report_dir=path, max_workers=workers)
+        if results is None or [result for result in results if result['error']]:
+            sys.exit(1)
+        return
+
     # Внимание! Приложение создается для
     # управления диалоговыми окнами отчетов
     app = wx.App()